@@ -0,0 +1,179 @@
+# coding=utf-8
+"""
+Per request allocations of the wire layer, without and with a BufferPool.
+
+    python benchmarks/bench_buffers.py
+
+Each workload runs the real Command code over a local socket pair, the other
+end answering every request with a canned response:
+
+* file_info: query_file_info, a 40 bytes response parsed with fetch_one
+* list_servers: 16 StorageInfo parsed with fetch_list, ~10 KB
+* upload_32k: a 32 KB upload, coalesced with its header in one write
+
+"churn" is the heap allocated per request, measured with tracemalloc as the
+peak over each request (python 3.9+); "slabs" counts the slabs the pool
+created over all the requests. Requests per second are measured separately,
+without tracemalloc. file_info stays under BufferPool.min_size and is not
+pooled, it shows the cost of the pool on the small commands.
+"""
+from __future__ import absolute_import, print_function
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyfdfs.buffers import BufferPool
+from pyfdfs.command import CommandHeader, Command
+from pyfdfs.connection import Connection
+from pyfdfs.structs import FileInfo, StorageInfo
+from pyfdfs.enums import STORAGE_PROTO_CMD_QUERY_FILE_INFO, TRACKER_PROTO_CMD_SERVER_LIST_STORAGE, \
+    STORAGE_PROTO_CMD_UPLOAD_FILE, FDFS_GROUP_NAME_MAX_LEN, FDFS_FILE_EXT_NAME_MAX_LEN, STORAGE_PROTO_CMD_RESP
+
+REQUESTS = 10000
+FILE_NAME = "M00/00/00/wKgAUVr0Ku6AQk9BAAAAAAAAAAA123.jpg"
+
+
+class PairPool(object):
+    """
+    connection pool of one connection over a socket pair
+    """
+
+    def __init__(self, conn, buffer_pool):
+        self.conn = conn
+        self.buffer_pool = buffer_pool
+
+    def get_connection(self):
+        return self.conn
+
+    def release(self, connection, ok=None):
+        pass
+
+
+def recv_exactly(sock, view):
+    offset = 0
+    while offset < len(view):
+        received = sock.recv_into(view[offset:])
+        if not received:
+            return False
+        offset += received
+    return True
+
+
+def answer(sock, response):
+    """
+    read every request, header then body, and send the canned response
+    """
+    header = CommandHeader()
+    header_view = memoryview(bytearray(header.resp_header_len()))
+    body = memoryview(bytearray(1 << 20))
+    reply = CommandHeader(req_pkg_len=len(response), cmd=STORAGE_PROTO_CMD_RESP).pack_req() + response
+    while recv_exactly(sock, header_view):
+        header.unpack_resp(header_view)
+        if not recv_exactly(sock, body[:header.resp_pkg_len]):
+            return
+        sock.sendall(reply)
+
+
+def file_info(pool):
+    file_name_len = len(FILE_NAME)
+    header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_len,
+                           cmd=STORAGE_PROTO_CMD_QUERY_FILE_INFO)
+    cmd = Command(pool=pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
+    cmd.pack("group1", FILE_NAME)
+    return cmd.fetch_one(FileInfo)
+
+
+def list_servers(pool):
+    header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN, cmd=TRACKER_PROTO_CMD_SERVER_LIST_STORAGE)
+    cmd = Command(pool=pool, header=header, fmt="!%ds" % FDFS_GROUP_NAME_MAX_LEN)
+    cmd.pack("group1")
+    return cmd.fetch_list(StorageInfo)
+
+
+PAYLOAD = os.urandom(32 * 1024)
+
+
+def upload_32k(pool):
+    pkg_len = 1 + 8 + 8 + FDFS_FILE_EXT_NAME_MAX_LEN + len(PAYLOAD)
+    header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
+    cmd = Command(pool=pool, header=header, fmt="!B Q Q %ds" % FDFS_FILE_EXT_NAME_MAX_LEN)
+    cmd.pack(0, 0, len(PAYLOAD), "jpg")
+    cmd.append(PAYLOAD)
+    with cmd.response() as (resp, resp_size):
+        return cmd.unpack("!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_size - FDFS_GROUP_NAME_MAX_LEN), resp)
+
+
+WORKLOADS = (
+    ("file_info", file_info, struct.pack("!Q Q Q 16s", 1024, int(time.time()), 0, b"192.168.0.81")),
+    ("list_servers", list_servers, b"\x00" * StorageInfo().get_fmt_size() * 16),
+    ("upload_32k", upload_32k, struct.pack("!%ds" % FDFS_GROUP_NAME_MAX_LEN, b"group1") + FILE_NAME.encode()),
+)
+
+
+def run(workload, response, buffer_pool, traced):
+    """
+    :return: requests per second, heap churned per request or None
+    """
+    a, b = socket.socketpair()
+    server = threading.Thread(target=answer, args=(b, response))
+    server.daemon = True
+    server.start()
+    conn = Connection(hosts=[("socketpair", 0)], timeout=60, buffer_pool=buffer_pool)
+    conn.sock = a
+    pool = PairPool(conn, buffer_pool)
+    for _ in range(100):
+        workload(pool)
+    churn = 0
+    start = time.time()
+    if traced:
+        tracemalloc.start()
+        for _ in range(REQUESTS):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            workload(pool)
+            churn += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    else:
+        for _ in range(REQUESTS):
+            workload(pool)
+    elapsed = time.time() - start
+    a.close()
+    server.join()
+    b.close()
+    return REQUESTS / elapsed, churn / float(REQUESTS) if traced else None
+
+
+def main():
+    traced = tracemalloc is not None and hasattr(tracemalloc, "reset_peak")
+    print("python %s, %d requests" % (sys.version.split()[0], REQUESTS))
+    print("%-13s %11s %11s %12s %12s %6s" % ("workload", "before rps", "after rps", "before churn",
+                                            "after churn", "slabs"))
+    for name, workload, response in WORKLOADS:
+        before_rps = run(workload, response, None, False)[0]
+        buffer_pool = BufferPool()
+        after_rps = run(workload, response, buffer_pool, False)[0]
+        allocations = buffer_pool.allocations
+        if traced:
+            before_churn = run(workload, response, None, True)[1]
+            after_churn = run(workload, response, buffer_pool, True)[1]
+            churn = "%10d B %10d B" % (before_churn, after_churn)
+        else:
+            churn = "%12s %12s" % ("n/a", "n/a")
+        print("%-13s %11.0f %11.0f %s %6d" % (name, before_rps, after_rps, churn, allocations))
+
+
+if __name__ == "__main__":
+    main()
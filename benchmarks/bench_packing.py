@@ -0,0 +1,87 @@
+# coding=utf-8
+"""
+Small objects: one file per object against packed bundles.
+
+    python benchmarks/bench_packing.py [objects] [object_size]
+
+Both run against the in-process stub server of the tests, over loopback, so
+the numbers count the round trips and the per request work of client and
+server, not disks. "one file per object" uploads every object with
+upload_file_by_buffer, a tracker query and an upload each; "packed" adds them
+to a Packer of 4 MB bundles. Reads are 2000 random objects, a ranged download
+of the bundle for the packed ones.
+"""
+from __future__ import absolute_import, print_function
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyfdfs.client import FdfsClient
+from pyfdfs.packing import Packer
+from tests.stub_server import StubServer
+
+READS = 2000
+
+
+def one_file_per_object(client, contents):
+    ids = []
+    for content in contents:
+        sr = client.upload_file_by_buffer(content, "bin")
+        ids.append("%s/%s" % (sr.group_name, sr.filename))
+    return ids
+
+
+def read_files(client, ids):
+    for value in ids:
+        group_name, file_name = value.split("/", 1)
+        client.download_to_buffer(group_name, file_name)
+
+
+def main():
+    objects = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    object_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2048
+    contents = [os.urandom(object_size) for _ in range(objects)]
+    server = StubServer().start()
+    client = FdfsClient([server.address])
+    packer = Packer(client, bundle_size=4 * 1024 * 1024)
+    try:
+        print("python %s, %d objects of %d bytes" % (sys.version.split()[0], objects, object_size))
+        print("%-20s %12s %12s %9s" % ("", "writes/s", "reads/s", "requests"))
+
+        requests = server.stats["requests"]
+        start = time.time()
+        ids = one_file_per_object(client, contents)
+        writes = objects / (time.time() - start)
+        write_requests = server.stats["requests"] - requests
+        sample = random.sample(ids, min(READS, objects))
+        start = time.time()
+        read_files(client, sample)
+        print("%-20s %12.0f %12.0f %9d" % ("one file per object", writes, len(sample) / (time.time() - start),
+                                           write_requests))
+        server.files.clear()
+
+        requests = server.stats["requests"]
+        start = time.time()
+        ids = packer.pack(contents)
+        writes = objects / (time.time() - start)
+        write_requests = server.stats["requests"] - requests
+        sample = random.sample(ids, min(READS, objects))
+        start = time.time()
+        for value in sample:
+            packer.read(value)
+        print("%-20s %12.0f %12.0f %9d" % ("packed", writes, len(sample) / (time.time() - start), write_requests))
+    finally:
+        packer.close()
+        for pool in client._pools():
+            pool.destroy()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# coding=utf-8
+"""
+Simulation of replica selection for reads, tracker choice against ReplicaSelector.
+
+    python benchmarks/bench_replicas.py
+
+Three fake storage servers hold every file: one fast, one behind a slow link,
+one with degraded disks that recover halfway through the run while the fast
+one degrades. Every read has a size drawn from a small-file heavy mix, and
+takes latency + size / bandwidth seconds of the server, with random jitter.
+"tracker" picks a replica at random, as the tracker does; "selector" asks a
+ReplicaSelector fed with the simulated timings. No socket is involved, the
+numbers only depend on the model and the seed.
+"""
+from __future__ import absolute_import, print_function
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyfdfs.selector import ReplicaSelector
+from pyfdfs.structs import BasicStorageInfo
+
+READS = 20000
+SIZES = ((0.6, 16 * 1024), (0.3, 256 * 1024), (0.1, 4 * 1024 * 1024))
+MB = 1024 * 1024.0
+
+
+class FakeServer(object):
+    def __init__(self, ip_addr, latency, bandwidth, degraded=None):
+        """
+        :param latency: seconds to the first byte
+        :param bandwidth: bytes per second
+        :param degraded: (first read, last read, slowdown factor)
+        """
+        self.info = BasicStorageInfo()
+        self.info.group_name = "group1"
+        self.info.ip_addr = ip_addr
+        self.info.storage_port = 23000
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.degraded = degraded
+        self.reads = 0
+
+    def read(self, rnd, idx, size):
+        """
+        :return: (latency, transfer time) of a simulated read
+        """
+        factor = 1
+        if self.degraded is not None and self.degraded[0] <= idx < self.degraded[1]:
+            factor = self.degraded[2]
+        jitter = rnd.lognormvariate(0, 0.3)
+        self.reads += 1
+        return self.latency * factor * jitter, size / (self.bandwidth / factor) * jitter
+
+
+def make_servers():
+    return [
+        FakeServer("10.0.0.1", 0.002, 110 * MB, degraded=(READS // 2, READS, 8)),
+        FakeServer("10.0.0.2", 0.030, 12 * MB),
+        FakeServer("10.0.0.3", 0.004, 90 * MB, degraded=(0, READS // 2, 10)),
+    ]
+
+
+def pick_size(rnd):
+    value = rnd.random()
+    for weight, size in SIZES:
+        if value < weight:
+            return size
+        value -= weight
+    return SIZES[-1][1]
+
+
+def simulate(strategy, seed=42):
+    rnd = random.Random(seed)
+    random.seed(seed)
+    servers = make_servers()
+    by_ip = dict((server.info.ip_addr, server) for server in servers)
+    selector = ReplicaSelector()
+    durations = []
+    halves = [dict((server.info.ip_addr, 0) for server in servers) for _ in range(2)]
+    for idx in range(READS):
+        size = pick_size(rnd)
+        if strategy == "selector":
+            server = by_ip[selector.rank([server.info for server in servers], size)[0].ip_addr]
+        else:
+            server = rnd.choice(servers)
+        latency, transfer_time = server.read(rnd, idx, size)
+        selector.record((server.info.ip_addr, 23000), latency, transfer_time, size)
+        durations.append(latency + transfer_time)
+        halves[idx * 2 // READS][server.info.ip_addr] += 1
+    return durations, halves
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def main():
+    print("%-9s %10s %10s %10s %10s   %s" % ("strategy", "mean ms", "p50 ms", "p99 ms", "total s",
+                                             "reads per server, first half | second half"))
+    for strategy in ("tracker", "selector"):
+        durations, halves = simulate(strategy)
+        ordered = sorted(durations)
+        share = " | ".join(" ".join("%s:%d" % (ip[-1], count) for ip, count in sorted(half.items()))
+                           for half in halves)
+        print("%-9s %10.2f %10.2f %10.2f %10.1f   %s" % (strategy, sum(durations) / len(durations) * 1000,
+                                                         percentile(ordered, 50) * 1000,
+                                                         percentile(ordered, 99) * 1000, sum(durations), share))
+
+
+if __name__ == "__main__":
+    main()
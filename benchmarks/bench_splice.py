@@ -0,0 +1,158 @@
+# coding=utf-8
+"""
+CPU spent by the client to download large files to disk.
+
+    python benchmarks/bench_splice.py [size_mb] [rounds]
+
+A child process plays the storage server on a loopback TCP socket and answers
+every download with the same file, sent with sendfile so it costs the client
+side nothing. The client writes each download to a file in a temporary
+directory, three ways:
+
+* buffer: download_to_buffer then write, the content as a python string
+* recv_into: download_to_file without splice, a reused 1 MB buffer
+* splice: download_to_file, socket -> pipe -> file with os.splice
+
+"cpu s/GB" is the user + system time of the client thread per GB downloaded
+(getrusage RUSAGE_THREAD), "MB/s" the wall clock throughput. Loopback and a
+page cache backed file make the copies the main cost, as on a fast network.
+"""
+from __future__ import absolute_import, print_function
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import time
+import shutil
+import socket
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyfdfs import connection
+from pyfdfs.command import CommandHeader, Command
+from pyfdfs.connection import Connection
+from pyfdfs.enums import STORAGE_PROTO_CMD_DOWNLOAD_FILE, STORAGE_PROTO_CMD_RESP, FDFS_GROUP_NAME_MAX_LEN, \
+    TRACKER_PROTO_PKG_LEN_SIZE
+
+FILE_NAME = "M00/00/00/wKgAUVr0Ku6AQk9BAAAAAAAAAAA123.bin"
+
+
+class OneConnectionPool(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer_pool = None
+
+    def get_connection(self):
+        return self.conn
+
+    def release(self, connection, ok=None):
+        pass
+
+
+def serve(listener, path):
+    """
+    answer every request with the content of path
+    """
+    sock = listener.accept()[0]
+    size = os.path.getsize(path)
+    header = CommandHeader()
+    reply = CommandHeader(req_pkg_len=size, cmd=STORAGE_PROTO_CMD_RESP).pack_req()
+    with open(path, "rb") as f_obj:
+        while 1:
+            request = sock.recv(header.resp_header_len(), socket.MSG_WAITALL)
+            if len(request) < header.resp_header_len():
+                return
+            header.unpack_resp(request)
+            sock.recv(header.resp_pkg_len, socket.MSG_WAITALL)
+            sock.sendall(reply)
+            offset = 0
+            while offset < size:
+                offset += os.sendfile(sock.fileno(), f_obj.fileno(), offset, size - offset)
+
+
+def download_command(pool):
+    file_name_len = len(FILE_NAME)
+    header = CommandHeader(req_pkg_len=TRACKER_PROTO_PKG_LEN_SIZE * 2 + FDFS_GROUP_NAME_MAX_LEN + file_name_len,
+                           cmd=STORAGE_PROTO_CMD_DOWNLOAD_FILE)
+    cmd = Command(pool=pool, header=header, fmt="!Q Q %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
+    cmd.pack(0, 0, "group1", FILE_NAME)
+    return cmd
+
+
+def buffer_mode(pool, f_obj):
+    resp, resp_size = download_command(pool).execute()
+    f_obj.write(resp)
+    f_obj.flush()
+
+
+def recv_into_mode(pool, f_obj):
+    download_command(pool).execute_to_file(f_obj.fileno(), use_splice=False)
+
+
+def splice_mode(pool, f_obj):
+    download_command(pool).execute_to_file(f_obj.fileno())
+
+
+MODES = (("buffer", buffer_mode), ("recv_into", recv_into_mode), ("splice", splice_mode))
+
+
+def thread_cpu():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(mode, source, target, rounds):
+    """
+    :return: (cpu seconds, wall seconds) of rounds downloads
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    server = multiprocessing.Process(target=serve, args=(listener, source))
+    server.start()
+    conn = Connection(hosts=[listener.getsockname()], timeout=60)
+    conn.connect()
+    pool = OneConnectionPool(conn)
+    cpu = wall = 0.0
+    with open(target, "w+b") as f_obj:
+        for _ in range(rounds):
+            f_obj.seek(0)
+            f_obj.truncate()
+            start_cpu, start = thread_cpu(), time.time()
+            mode(pool, f_obj)
+            cpu += thread_cpu() - start_cpu
+            wall += time.time() - start
+    conn.disconnect()
+    server.join()
+    listener.close()
+    return cpu, wall
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp_dir, "source")
+        with open(source, "wb") as f_obj:
+            for _ in range(size_mb):
+                f_obj.write(os.urandom(1 << 20))
+        gb = size_mb * rounds / 1024.0
+        print("python %s, %d MB x %d, splice %s" % (sys.version.split()[0], size_mb, rounds,
+                                                    "available" if connection.splice else "not available"))
+        print("%-10s %10s %10s" % ("mode", "cpu s/GB", "MB/s"))
+        for name, mode in MODES:
+            if name == "splice" and connection.splice is None:
+                continue
+            cpu, wall = run(mode, source, os.path.join(tmp_dir, "target"), rounds)
+            print("%-10s %10.3f %10.0f" % (name, cpu / gb, size_mb * rounds / wall))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# coding=utf-8
+"""
+Throughput of the wire layer, before and after the bytes/memoryview rewrite.
+
+    python benchmarks/bench_wire.py
+
+"before" re-implements the previous code paths inline: the whole file buffer
+packed into the request with struct and concatenated to the header, and the
+response read with 4 KB recv() calls joined at the end. "after" goes through
+Command.pack / Command.append / Connection.sendv and Connection.recv.
+Both run over a local socket pair, the other end draining or feeding bytes.
+"""
+from __future__ import absolute_import, print_function
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyfdfs.command import CommandHeader, Command
+from pyfdfs.connection import Connection
+from pyfdfs.enums import STORAGE_PROTO_CMD_UPLOAD_FILE, FDFS_FILE_EXT_NAME_MAX_LEN
+
+SIZES = (4 * 1024, 256 * 1024, 16 * 1024 * 1024)
+TOTAL_BYTES = 512 * 1024 * 1024
+
+
+def drain(sock):
+    while sock.recv(1 << 20):
+        pass
+
+
+def feed(sock, chunk, total):
+    view = memoryview(chunk)
+    while total > 0:
+        size = min(total, len(chunk))
+        sock.sendall(view[:size])
+        total -= size
+
+
+def legacy_send(conn, payload):
+    header = CommandHeader(req_pkg_len=len(payload), cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
+    cmd = Command(header=header, fmt="!B Q Q %ds %ds %ds" % (FDFS_FILE_EXT_NAME_MAX_LEN, 0, len(payload)))
+    cmd.buf = cmd.buf + struct.Struct(cmd.fmt).pack(0, 0, len(payload), b"txt", b"", payload)
+    conn.send(cmd.buf)
+
+
+def new_send(conn, payload):
+    header = CommandHeader(req_pkg_len=len(payload), cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
+    cmd = Command(header=header, fmt="!B Q Q %ds %ds" % (FDFS_FILE_EXT_NAME_MAX_LEN, 0))
+    cmd.pack(0, 0, len(payload), "txt", b"")
+    cmd.append(payload)
+    cmd.conn = conn
+    cmd.send_request()
+
+
+def legacy_recv(sock, byte_size, buffer_size=4096):
+    recv_buff = []
+    while byte_size > 0:
+        resp = sock.recv(buffer_size if buffer_size <= byte_size else byte_size)
+        recv_buff.append(resp)
+        byte_size -= len(resp)
+    return b"".join(recv_buff)
+
+
+def make_pair():
+    a, b = socket.socketpair()
+    for sock in (a, b):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    conn = Connection(hosts=[("socketpair", 0)], timeout=60)
+    conn.sock = a
+    return conn, a, b
+
+
+def bench_send(size, legacy):
+    conn, a, b = make_pair()
+    reader = threading.Thread(target=drain, args=(b,))
+    reader.start()
+    payload = os.urandom(size)
+    loops = max(TOTAL_BYTES // size, 1)
+    start = time.time()
+    for _ in range(loops):
+        if legacy:
+            legacy_send(conn, payload)
+        else:
+            new_send(conn, payload)
+    a.shutdown(socket.SHUT_WR)
+    reader.join()
+    elapsed = time.time() - start
+    a.close()
+    b.close()
+    return loops * size / elapsed / 1024 / 1024
+
+
+def bench_recv(size, legacy):
+    conn, a, b = make_pair()
+    loops = max(TOTAL_BYTES // size, 1)
+    writer = threading.Thread(target=feed, args=(b, os.urandom(min(size, 1 << 20)), loops * size))
+    writer.start()
+    start = time.time()
+    for _ in range(loops):
+        if legacy:
+            legacy_recv(a, size)
+        else:
+            conn.recv(size)
+    elapsed = time.time() - start
+    writer.join()
+    a.close()
+    b.close()
+    return loops * size / elapsed / 1024 / 1024
+
+
+def main():
+    print("python %s" % sys.version.split()[0])
+    print("%-6s %10s %12s %12s %8s" % ("path", "size", "before MB/s", "after MB/s", "speedup"))
+    for name, bench in (("send", bench_send), ("recv", bench_recv)):
+        for size in SIZES:
+            before = bench(size, True)
+            after = bench(size, False)
+            print("%-6s %10d %12.1f %12.1f %7.2fx" % (name, size, before, after, after / before))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# coding=utf-8
+"""
+ASGI counterpart of pyfdfs.web, python 3 only.
+
+    application = FdfsASGIApp(FdfsClient(["192.168.0.81:22122"]))
+
+The client is blocking: the download is opened and every chunk read in the
+executor of the event loop, and sent as soon as it is read, so one response
+holds at most one chunk in memory.
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import asyncio
+
+from pyfdfs.web import open_response, split_path, read_bytes
+
+
+class FdfsASGIApp(object):
+    """
+    ASGI application serving GET and HEAD /group_name/file_name
+    """
+
+    def __init__(self, client, chunk_size=64 * 1024, executor=None):
+        """
+        :param executor: concurrent.futures executor running the blocking reads, None for the loop default
+        """
+        self.client = client
+        self.chunk_size = chunk_size
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("Error: unsupported scope type %s" % scope["type"])
+        method = scope.get("method", "GET")
+        if method not in ("GET", "HEAD"):
+            await self._send_empty(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+        file_id = split_path(scope.get("path", ""))
+        if file_id is None:
+            await self._send_empty(send, 404)
+            return
+        range_header = None
+        for name, value in scope.get("headers", ()):
+            if name.lower() == b"range":
+                range_header = value.decode("latin-1")
+        loop = asyncio.get_event_loop()
+        status, headers, body = await loop.run_in_executor(
+            self.executor, open_response, self.client, file_id[0], file_id[1], range_header, self.chunk_size,
+            method == "HEAD")
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            })
+            while 1:
+                chunk = await loop.run_in_executor(self.executor, read_bytes, body, self.chunk_size)
+                if not chunk:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            body.close()
+
+    @staticmethod
+    async def _send_empty(send, status, headers=()):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-length", b"0")] + list(headers)})
+        await send({"type": "http.response.body", "body": b""})
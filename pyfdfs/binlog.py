@@ -0,0 +1,307 @@
+# coding=utf-8
+"""
+Change feed over the binlog of a storage server.
+
+A storage server logs every change of its files in a binlog, and answers
+STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG with the records of one store path,
+one per line:
+
+    1500000000 C M00/00/00/wKgAUVr0Ku6AQk9BAAAAAAAAAAA123.jpg
+    1500000060 l M00/00/00/wKgAUVr0K7aAd4GpAAAAAAAAAAA456.jpg M00/00/00/wKgAU...123.jpg
+
+An upper case op was made on this server, a lower case one was synced from
+another server of the group, so the binlog of one server covers the group.
+Which ops are sent back depends on the server version, some only send the
+creates and links.
+
+The command has no offset, the whole binlog comes back every time. A
+ChangeFeed remembers how many bytes of it were consumed, with the crc32 of
+those bytes, in an OffsetStore: the next poll skips them without parsing
+and only yields the new records, so indexing costs O(changes). A binlog
+that no longer starts with the consumed bytes (rewritten, other server) is
+read again from its start.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import json
+import threading
+
+from pyfdfs.checksum import Checksum
+from pyfdfs.compat import to_str
+
+OP_CREATE = "create"
+OP_DELETE = "delete"
+OP_UPDATE = "update"
+OP_LINK = "link"
+OP_APPEND = "append"
+OP_MODIFY = "modify"
+OP_TRUNCATE = "truncate"
+OP_RENAME = "rename"
+
+OP_TYPES = {
+    "C": OP_CREATE,
+    "D": OP_DELETE,
+    "U": OP_UPDATE,
+    "L": OP_LINK,
+    "A": OP_APPEND,
+    "M": OP_MODIFY,
+    "T": OP_TRUNCATE,
+    "R": OP_RENAME,
+}
+
+
+class BinlogRecord(object):
+    description_format = "BinlogRecord<%(op)s %(file_id)s at %(timestamp)d>"
+
+    def __init__(self, timestamp, op, file_id, src_file_id=None, replica=False, offset=0, crc32=0):
+        """
+        :param op: one of the OP_* constants
+        :param file_id: group_name/remote_file_name
+        :param src_file_id: file linked to, or renamed from
+        :param replica: True for a change synced from another server of the group
+        :param offset: bytes of the binlog up to the end of this record, where to resume after it
+        :param crc32: crc32 of those bytes
+        """
+        self.timestamp = timestamp
+        self.op = op
+        self.file_id = file_id
+        self.src_file_id = src_file_id
+        self.replica = replica
+        self.offset = offset
+        self.crc32 = crc32
+
+    def __repr__(self):
+        return self.description_format % {"op": self.op, "file_id": self.file_id, "timestamp": self.timestamp}
+
+
+class BinlogParser(object):
+    """
+    Streaming parser of binlog records, fed with chunks cut anywhere.
+    """
+    description_format = "BinlogParser<offset=%(offset)d,errors=%(errors)d>"
+
+    def __init__(self, group_name, store_path_index=0, offset=0, crc32=0):
+        """
+        :param offset: bytes of the binlog consumed before the first chunk fed
+        :param crc32: crc32 of those bytes
+        """
+        self.group_name = group_name
+        self.store_path = "M%02X" % store_path_index
+        self.offset = offset
+        self.checksum = Checksum()
+        self.checksum.crc32 = crc32
+        # lines that could not be parsed, skipped
+        self.errors = 0
+        self._tail = b""
+
+    def __repr__(self):
+        return self.description_format % {"offset": self.offset, "errors": self.errors}
+
+    def feed(self, chunk):
+        """
+        :param chunk: next bytes of the binlog
+        :return: [BinlogRecord] of the lines completed by chunk
+        """
+        data = self._tail + bytes(chunk) if self._tail else bytes(chunk)
+        end = data.rfind(b"\n") + 1
+        self._tail = data[end:]
+        records = []
+        start = 0
+        while start < end:
+            stop = data.index(b"\n", start) + 1
+            line = data[start:stop]
+            self.checksum.update(line)
+            self.offset += len(line)
+            record = self._parse(line)
+            if record is not None:
+                records.append(record)
+            start = stop
+        return records
+
+    def _file_id(self, file_name):
+        file_name = to_str(file_name)
+        if not file_name.startswith("M"):
+            # records of one store path may leave the path out
+            file_name = "%s/%s" % (self.store_path, file_name)
+        return "%s/%s" % (self.group_name, file_name)
+
+    def _parse(self, line):
+        fields = line.split()
+        if not fields:
+            return None
+        try:
+            timestamp, op_type, file_name = int(fields[0]), to_str(fields[1]), fields[2]
+            op = OP_TYPES[op_type.upper()]
+        except (ValueError, IndexError, KeyError):
+            self.errors += 1
+            return None
+        src_file_id = self._file_id(fields[3]) if len(fields) > 3 else None
+        return BinlogRecord(timestamp, op, self._file_id(file_name), src_file_id, op_type.islower(),
+                            self.offset, self.checksum.crc32)
+
+
+class OffsetStore(object):
+    """
+    Resume offsets of change feeds, in a json file replaced atomically on every save.
+    """
+    description_format = "OffsetStore<%(path)s>"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = {}
+        if os.path.exists(path):
+            with open(path) as f_obj:
+                self._offsets = json.load(f_obj)
+
+    def __repr__(self):
+        return self.description_format % {"path": self.path}
+
+    def get(self, key):
+        """
+        :return: (offset, crc32) saved for key, (0, 0) if none
+        """
+        with self._lock:
+            item = self._offsets.get(key)
+        return (item["offset"], item["crc32"]) if item else (0, 0)
+
+    def save(self, key, offset, crc32):
+        with self._lock:
+            self._offsets[key] = {"offset": offset, "crc32": crc32}
+            tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+            with open(tmp_path, "w") as f_obj:
+                json.dump(self._offsets, f_obj, sort_keys=True)
+                f_obj.flush()
+                os.fsync(f_obj.fileno())
+            os.rename(tmp_path, self.path)
+
+
+class ChangeFeed(object):
+    """
+    New binlog records of one store path of one storage server, at least once:
+    the offset of a record is saved once the next one is asked for.
+    """
+    description_format = "ChangeFeed<%(key)s,offset=%(offset)d>"
+
+    def __init__(self, client, group_name, store_path_index=0, storage_ip=None, offset_store=None,
+                 checkpoint_every=1000, chunk_size=256 * 1024):
+        """
+        :param client: FdfsClient
+        :param storage_ip: storage server to follow, the first one of the group if null
+        :param offset_store: OffsetStore, offsets are only kept in memory if null
+        :param checkpoint_every: records between two saves of the offset, it is also saved at the end of a poll
+        :param chunk_size: bytes read from the socket at a time
+        """
+        self.client = client
+        self.group_name = group_name
+        self.store_path_index = store_path_index
+        self.storage_ip = storage_ip
+        self.offset_store = offset_store
+        self.checkpoint_every = checkpoint_every
+        self.chunk_size = chunk_size
+        self.storage_info = None
+        self.offset = None
+        self.crc32 = 0
+        # polls that found the binlog rewritten and started over
+        self.resets = 0
+
+    def __repr__(self):
+        return self.description_format % {"key": self.key, "offset": self.offset or 0}
+
+    @property
+    def key(self):
+        if self.storage_info is None:
+            return "%s/%s/%d" % (self.group_name, self.storage_ip or "*", self.store_path_index)
+        return "%s/%s:%d/%d" % (self.group_name, self.storage_info.ip_addr, self.storage_info.storage_port,
+                                self.store_path_index)
+
+    def _storage_info(self):
+        """
+        :return: BasicStorageInfo of the followed storage server, the same one for every poll
+        """
+        if self.storage_info is None:
+            servers = self.client.query_store_with_group_all(self.group_name)
+            if self.storage_ip is not None:
+                servers = [server for server in servers if server.ip_addr == self.storage_ip]
+                if not servers:
+                    raise Exception("Error: storage server %s not in group %s" % (self.storage_ip,
+                                                                                 self.group_name))
+            self.storage_info = servers[0]
+        return self.storage_info
+
+    def commit(self):
+        """
+        save the offset of the last record consumed
+        """
+        if self.offset_store is not None and self.offset is not None:
+            self.offset_store.save(self.key, self.offset, self.crc32)
+
+    def poll(self):
+        """
+        :return: generator of the BinlogRecord appended since the last poll
+        """
+        storage_info = self._storage_info()
+        if self.offset is None:
+            self.offset, self.crc32 = self.offset_store.get(self.key) if self.offset_store else (0, 0)
+        stream = self.client.fetch_one_path_binlog(self.group_name, self.store_path_index, storage_info,
+                                                   self.chunk_size)
+        try:
+            if not self._skip(stream):
+                print("Error: binlog of %s rewritten, read again from its start" % self.key)
+                self.resets += 1
+                stream.close()
+                self.offset, self.crc32 = 0, 0
+                stream = self.client.fetch_one_path_binlog(self.group_name, self.store_path_index, storage_info,
+                                                           self.chunk_size)
+            parser = BinlogParser(self.group_name, self.store_path_index, self.offset, self.crc32)
+            pending = 0
+            for chunk in stream:
+                for record in parser.feed(chunk):
+                    yield record
+                    self.offset, self.crc32 = record.offset, record.crc32
+                    pending += 1
+                    if pending >= self.checkpoint_every:
+                        self.commit()
+                        pending = 0
+            # trailing lines without a record, e.g. malformed, are consumed too
+            self.offset, self.crc32 = parser.offset, parser.checksum.crc32
+        finally:
+            stream.close()
+            self.commit()
+
+    def _skip(self, stream):
+        """
+        read the bytes consumed by the previous polls
+        :return: False if they are no longer the start of the binlog
+        """
+        if stream.length < self.offset:
+            return False
+        checksum = Checksum()
+        remaining = self.offset
+        while remaining > 0:
+            chunk = stream.read(min(remaining, self.chunk_size))
+            if not chunk:
+                return False
+            checksum.update(chunk)
+            remaining -= len(chunk)
+        return checksum.crc32 == self.crc32
+
+    def run(self, callback, interval=10, stop_event=None):
+        """
+        :param callback: callback(BinlogRecord), the offset of a record is saved once it returns
+        :param interval: seconds between two polls
+        :param stop_event: threading.Event ending the loop, runs forever if null
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                for record in self.poll():
+                    callback(record)
+                    if stop_event.is_set():
+                        break
+            except Exception as e:
+                print("Error: change feed %s %s" % (self.key, e))
+            stop_event.wait(interval)
@@ -0,0 +1,137 @@
+# coding=utf-8
+"""
+Circuit breaker of a storage server endpoint.
+
+closed: commands go through, their outcomes are kept over a sliding window.
+open: once the error rate of the window reaches failure_rate, commands fail at
+    once with CircuitOpen for reset_timeout seconds.
+half-open: then up to half_open_calls trial commands go through, the first
+    success closes the breaker, a failure opens it again. A trial whose
+    outcome is never recorded expires after reset_timeout, letting a new
+    trial through.
+
+A ConnectionPool given a breaker counts a released connection that is still
+connected as a success and a dropped one, or a failed connect, as a failure.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+from collections import deque
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    description_format = "CircuitBreaker<state=%(state)s,failures=%(failures)d/%(calls)d>"
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=5, reset_timeout=30, half_open_calls=1):
+        """
+        :param failure_rate: error rate opening the breaker
+        :param window: outcomes of the last commands kept
+        :param min_calls: outcomes needed before the error rate counts
+        :param reset_timeout: seconds an open breaker fails commands at once
+        :param half_open_calls: trial commands let through when half-open
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = STATE_CLOSED
+        self.opened_at = 0
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        # start times of the trial commands in flight
+        self._trials = deque()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {
+            "state": self.state,
+            "failures": self._failures,
+            "calls": len(self._outcomes)
+        }
+
+    def available(self):
+        """
+        :return: True if a command would be let through, without taking a trial slot
+        """
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN:
+            return time.time() >= self.opened_at + self.reset_timeout
+        return self._live_trials(time.time()) < self.half_open_calls
+
+    def _live_trials(self, now):
+        """
+        :return: trial commands in flight, the expired ones dropped
+        """
+        while self._trials and self._trials[0] + self.reset_timeout <= now:
+            self._trials.popleft()
+        return len(self._trials)
+
+    def allow(self):
+        """
+        :return: True if a command may go through, takes a trial slot when half-open
+        """
+        if self.state == STATE_CLOSED:
+            return True
+        with self._lock:
+            now = time.time()
+            if self.state == STATE_OPEN:
+                if now < self.opened_at + self.reset_timeout:
+                    return False
+                self.state = STATE_HALF_OPEN
+                self._trials.clear()
+            if self.state == STATE_HALF_OPEN:
+                if self._live_trials(now) >= self.half_open_calls:
+                    return False
+                self._trials.append(now)
+            return True
+
+    def check(self, endpoint=None):
+        """
+        raise CircuitOpen unless a command may go through
+        """
+        if not self.allow():
+            raise CircuitOpen("Error: circuit open for %s, retry in %.1fs" %
+                              (endpoint, max(self.opened_at + self.reset_timeout - time.time(), 0)))
+
+    def record(self, ok):
+        """
+        :param ok: outcome of a command
+        """
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                if ok:
+                    self._close()
+                else:
+                    self._open()
+                return
+            if self.state == STATE_OPEN:
+                return
+            if len(self._outcomes) == self._outcomes.maxlen and not self._outcomes[0]:
+                self._failures -= 1
+            self._outcomes.append(ok)
+            if not ok:
+                self._failures += 1
+                if len(self._outcomes) >= self.min_calls and \
+                        self._failures >= self.failure_rate * len(self._outcomes):
+                    self._open()
+
+    def _open(self):
+        self.state = STATE_OPEN
+        self.opened_at = time.time()
+
+    def _close(self):
+        self.state = STATE_CLOSED
+        self._outcomes.clear()
+        self._failures = 0
@@ -0,0 +1,166 @@
+# coding=utf-8
+"""
+Process wide budget of the payload bytes in flight.
+
+A client given a MemoryBudget reserves from it, before allocating or sending:
+
+* the payload of a request, while it is sent (upload_file_by_buffer...)
+* the body of a response read in memory, once its size is known from the
+  header and until it is received (download_to_buffer, meta data...)
+* every chunk read from a ResponseStream, while it is received
+* the slots of a copy_file ring, for the whole copy
+
+and gives the bytes back once sent or received; what the caller keeps after
+that is its own. Transfers under min_size are not counted. When the budget is
+spent a reservation waits, first come first served, up to wait_timeout then
+raises BudgetExceeded, wait_timeout=0 fails at once; the deadline of the
+thread (pyfdfs.deadline) still bounds the wait. A reservation larger than the
+whole budget waits until nothing else is in flight. One budget is meant to be
+shared by every client of the process.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+from collections import deque
+
+from pyfdfs.deadline import get_deadline
+
+_DEFAULT = object()
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Reservation(object):
+    """
+    bytes held from a MemoryBudget, given back on exit
+    """
+
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def release(self):
+        nbytes, self.nbytes = self.nbytes, 0
+        if nbytes:
+            self.budget.release(nbytes)
+
+
+class MemoryBudget(object):
+    description_format = "MemoryBudget<in_use=%(in_use)d/%(max_bytes)d,waiting=%(waiting)d>"
+
+    def __init__(self, max_bytes, wait_timeout=None, min_size=64 * 1024):
+        """
+        :param max_bytes: payload bytes in flight at most
+        :param wait_timeout: seconds a reservation may wait, None to wait as long as the deadline allows,
+                             0 to fail at once
+        :param min_size: smaller transfers are not counted
+        """
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self.min_size = min_size
+        self._cond = threading.Condition(threading.Lock())
+        self._waiters = deque()
+        # gauges
+        self.in_use = 0
+        self.peak = 0
+        # counters
+        self.reservations = 0
+        self.waits = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return self.description_format % {"in_use": self.in_use, "max_bytes": self.max_bytes,
+                                          "waiting": len(self._waiters)}
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _fits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.max_bytes
+
+    def _take(self, nbytes):
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+        self.reservations += 1
+
+    def reserve(self, nbytes, wait_timeout=_DEFAULT):
+        """
+        :param nbytes: bytes about to be allocated or sent
+        :param wait_timeout: overrides the wait_timeout of the budget
+        :return: bytes reserved, 0 under min_size; give them back with release()
+        raise BudgetExceeded when they could not be reserved in time
+        """
+        if nbytes < self.min_size:
+            return 0
+        wait_timeout = self.wait_timeout if wait_timeout is _DEFAULT else wait_timeout
+        with self._cond:
+            if not self._waiters and self._fits(nbytes):
+                self._take(nbytes)
+                return nbytes
+            if wait_timeout == 0:
+                self.rejected += 1
+                raise BudgetExceeded("Error: %d bytes over the budget, %d of %d in flight" %
+                                     (nbytes, self.in_use, self.max_bytes))
+            deadline = get_deadline()
+            end = None if wait_timeout is None else time.time() + wait_timeout
+            ticket = object()
+            self._waiters.append(ticket)
+            self.waits += 1
+            try:
+                while self._waiters[0] is not ticket or not self._fits(nbytes):
+                    remaining = None if end is None else end - time.time()
+                    if deadline is not None:
+                        remaining = deadline.timeout(remaining)
+                    if remaining is not None and remaining <= 0:
+                        self.rejected += 1
+                        raise BudgetExceeded("Error: waited too long for %d bytes, %d of %d in flight" %
+                                             (nbytes, self.in_use, self.max_bytes))
+                    self._cond.wait(remaining)
+                self._take(nbytes)
+                return nbytes
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, nbytes):
+        """
+        :param nbytes: returned by reserve()
+        """
+        if not nbytes:
+            return
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    def hold(self, nbytes, wait_timeout=_DEFAULT):
+        """
+        :return: Reservation of nbytes, a context manager giving them back
+        """
+        return Reservation(self, self.reserve(nbytes, wait_timeout))
+
+    def snapshot(self):
+        """
+        :return: dictionary of the gauges and counters
+        """
+        with self._cond:
+            return {
+                "max_bytes": self.max_bytes,
+                "in_use": self.in_use,
+                "peak": self.peak,
+                "waiting": len(self._waiters),
+                "reservations": self.reservations,
+                "waits": self.waits,
+                "rejected": self.rejected,
+            }
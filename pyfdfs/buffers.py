@@ -0,0 +1,124 @@
+# coding=utf-8
+"""
+Reusable buffers for the wire layer.
+
+A client given a BufferPool packs its requests, reads its response headers
+and the bodies it parses itself (tracker answers, file info, meta data...)
+and fills its copy slots in bytearray slabs borrowed from the pool and given
+back once the command is done, instead of allocating new strings for every
+request. Slabs come in size classes, a request takes the smallest class
+that fits; sizes above the largest class are allocated and dropped as before.
+Bodies handed to the caller (download_to_buffer) are never pooled, nor are
+buffers under min_size: for those the memoryview bookkeeping costs more
+than the allocation it saves, python already recycles small objects.
+
+In debug mode the pool remembers where every outstanding slab was borrowed,
+leaks() lists the ones never given back, a slab given back twice raises
+BufferLeak, and a slab given back is overwritten so a late use shows.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import bisect
+import threading
+import traceback
+from collections import deque
+
+SIZE_CLASSES = (4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024)
+
+POISON = 0xdd
+
+
+class BufferLeak(Exception):
+    pass
+
+
+class BufferPool(object):
+    description_format = "BufferPool<classes=%(classes)s,free=%(free)d,outstanding=%(outstanding)d>"
+
+    def __init__(self, size_classes=SIZE_CLASSES, max_free=64, min_size=2048, debug=False):
+        """
+        :param size_classes: slab sizes
+        :param max_free: idle slabs kept per size class, the extra ones are dropped
+        :param min_size: smaller buffers are left to the allocator, see pooled()
+        :param debug: track the outstanding slabs, see leaks()
+        """
+        self.size_classes = tuple(sorted(size_classes))
+        self.max_free = max_free
+        self.min_size = min_size
+        self.debug = debug
+        self._free = dict((size, deque()) for size in self.size_classes)
+        self._lock = threading.Lock()
+        self._outstanding = {}
+        # slabs created, and slabs handed out again from the free lists
+        self.allocations = 0
+        self.reuses = 0
+
+    def __repr__(self):
+        return self.description_format % {"classes": ",".join("%d" % size for size in self.size_classes),
+                                          "free": sum(len(free) for free in self._free.values()),
+                                          "outstanding": len(self._outstanding)}
+
+    def size_class(self, size):
+        """
+        :return: slab size serving size bytes, None above the largest class
+        """
+        idx = bisect.bisect_left(self.size_classes, size)
+        return self.size_classes[idx] if idx < len(self.size_classes) else None
+
+    def pooled(self, size):
+        """
+        :return: True if a buffer of size bytes is worth borrowing from the pool
+        """
+        return self.min_size <= size <= self.size_classes[-1]
+
+    def acquire(self, size):
+        """
+        :param size: bytes needed
+        :return: bytearray of at least size bytes, its content is undefined; give it back with release()
+        """
+        slab_size = self.size_class(size)
+        slab = None
+        if slab_size is not None:
+            try:
+                slab = self._free[slab_size].pop()
+                self.reuses += 1
+            except IndexError:
+                pass
+        if slab is None:
+            slab = bytearray(slab_size or size)
+            self.allocations += 1
+        if self.debug:
+            with self._lock:
+                self._outstanding[id(slab)] = (len(slab), "".join(traceback.format_stack()[:-1]))
+        return slab
+
+    def release(self, slab):
+        """
+        :param slab: bytearray returned by acquire(), not to be used any more
+        """
+        if self.debug:
+            with self._lock:
+                if self._outstanding.pop(id(slab), None) is None:
+                    raise BufferLeak("Error: buffer of %d bytes released twice or not from this pool" % len(slab))
+            slab[:] = bytearray([POISON]) * len(slab)
+        free = self._free.get(len(slab))
+        # deque append / pop are atomic, the free lists need no lock
+        if free is not None and len(free) < self.max_free:
+            free.append(slab)
+
+    def leaks(self):
+        """
+        :return: [(size, stack where it was acquired)] of the slabs not given back, debug mode only
+        """
+        with self._lock:
+            return list(self._outstanding.values())
+
+    def check_leaks(self):
+        """
+        raise BufferLeak when slabs were not given back, debug mode only
+        """
+        leaks = self.leaks()
+        if leaks:
+            raise BufferLeak("Error: %d buffers not released, first acquired at:\n%s" % (len(leaks), leaks[0][1]))
@@ -0,0 +1,255 @@
+# coding=utf-8
+"""
+Bulk importer: upload a whole directory tree with a pool of processes.
+
+    python -m pyfdfs.bulk -t 192.168.0.81:22122 -m manifest.jsonl /data/archive
+
+Every uploaded file is appended to the manifest as a json line
+{"path": ..., "file_id": "group/remote_file_name", "size": ...}; running the
+same command again skips the paths already recorded, so an interrupted import
+can simply be restarted.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import json
+import time
+import stat
+import argparse
+import functools
+import threading
+import multiprocessing
+
+from pyfdfs.compat import PY3
+from pyfdfs.client import FdfsClient
+from pyfdfs.throttle import TransferScheduler, priority, PRIORITY_BACKGROUND
+
+_client = None
+_worker_options = {}
+
+
+def _init_worker(host_list, timeout, group_name, retries, rate=None):
+    """
+    runs once in every worker process, after the fork, so each worker owns its
+    own FdfsClient and never touches a socket opened by the parent
+
+    :param rate: bytes per second of this worker, None for unlimited
+    """
+    global _client
+    _client = FdfsClient(host_list, timeout=timeout, scheduler=TransferScheduler(rate) if rate else None)
+    _worker_options.update(group_name=group_name, retries=retries)
+
+
+def _upload(path):
+    """
+    :param path: file path
+    :return: (path, file_id, size, retries, error)
+    """
+    retries = 0
+    while 1:
+        try:
+            with priority(PRIORITY_BACKGROUND):
+                sr = _client.upload_file_by_filename(path, _worker_options["group_name"])
+            return path, "%s/%s" % (sr.group_name, sr.filename), os.path.getsize(path), retries, None
+        except Exception as e:
+            if retries >= _worker_options["retries"]:
+                return path, None, 0, retries, "%s" % e
+            retries += 1
+            time.sleep(min(2 ** retries * 0.1, 10))
+
+
+def _guarded_upload(path):
+    """
+    :return: result of _upload, anything it raises is returned as the error of the path
+    """
+    try:
+        return _upload(path)
+    except BaseException as e:
+        return path, None, 0, 0, "%s" % e
+
+
+def walk_files(root, done=None):
+    """
+    :param root: directory to import
+    :param done: set of paths to skip
+    :return: generator of regular file paths, yielded while the tree is walked
+    """
+    done = done or set()
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            if path in done:
+                continue
+            try:
+                if not stat.S_ISREG(os.lstat(path).st_mode):
+                    continue
+            except OSError:
+                continue
+            yield path
+
+
+def load_manifest(manifest):
+    """
+    :param manifest: manifest file path
+    :return: set of the paths already imported
+    """
+    done = set()
+    if not os.path.exists(manifest):
+        return done
+    with open(manifest) as f_obj:
+        for line in f_obj:
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError):
+                # torn last line of an interrupted run
+                continue
+    return done
+
+
+class BulkStats(object):
+    description_format = "files=%(files)d bytes=%(bytes)d failed=%(failed)d retries=%(retries)d " \
+                         "rate=%(files_rate).1f files/s %(bytes_rate).2f MB/s"
+
+    def __init__(self):
+        self.started = time.time()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.retries = 0
+
+    def __str__(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return self.description_format % {
+            "files": self.files,
+            "bytes": self.bytes,
+            "failed": self.failed,
+            "retries": self.retries,
+            "files_rate": self.files / elapsed,
+            "bytes_rate": self.bytes / elapsed / 1024 / 1024,
+        }
+
+
+class BulkImporter(object):
+    """
+    Walks a directory tree and fans the files out over a process pool.
+    At most `workers * queue_factor` files are in flight, so the tree is never
+    materialized in memory.
+    """
+
+    def __init__(self, host_list, manifest, group_name=None, workers=None, retries=3, timeout=60,
+                 queue_factor=4, report_interval=10, out=sys.stderr, rate=None):
+        """
+        :param rate: bytes per second of the whole import, shared evenly by the workers, None for unlimited
+        """
+        self.host_list = host_list
+        self.manifest = manifest
+        self.group_name = group_name
+        self.workers = workers or multiprocessing.cpu_count()
+        self.retries = retries
+        self.timeout = timeout
+        self.queue_factor = queue_factor
+        self.report_interval = report_interval
+        self.rate = rate
+        self.out = out
+        self.stats = BulkStats()
+        self.failures = []
+        self._lock = threading.Lock()
+        self._last_report = time.time()
+
+    def report(self):
+        self.out.write("%s\n" % self.stats)
+        self.out.flush()
+
+    def run(self, root):
+        """
+        :param root: directory to import
+        :return: BulkStats
+        """
+        done = load_manifest(self.manifest)
+        slots = threading.BoundedSemaphore(self.workers * self.queue_factor)
+        pool = multiprocessing.Pool(self.workers, _init_worker,
+                                    (self.host_list, self.timeout, self.group_name, self.retries,
+                                     self.rate / self.workers if self.rate else None))
+        self._last_report = time.time()
+        with open(self.manifest, "a") as manifest:
+            def on_result(result):
+                try:
+                    self._record(manifest, *result)
+                finally:
+                    slots.release()
+
+            def on_error(path, error):
+                try:
+                    self._record(manifest, path, None, 0, 0, "%s" % error)
+                finally:
+                    slots.release()
+
+            try:
+                for path in walk_files(root, done):
+                    slots.acquire()
+                    kwargs = {"callback": on_result}
+                    if PY3:
+                        # a task failing outside _guarded_upload, e.g. its result not picklable;
+                        # python 2 has no error_callback and relies on _guarded_upload alone
+                        kwargs["error_callback"] = functools.partial(on_error, path)
+                    pool.apply_async(_guarded_upload, (path,), **kwargs)
+                pool.close()
+                pool.join()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                manifest.flush()
+        self.report()
+        return self.stats
+
+    def _record(self, manifest, path, file_id, size, retries, error):
+        """
+        account for the result of a file, and report progress every report_interval seconds,
+        the last files drained after the walk included
+        """
+        with self._lock:
+            self.stats.retries += retries
+            if error is not None:
+                self.stats.failed += 1
+                self.failures.append((path, error))
+                self.out.write("Error: %s %s\n" % (path, error))
+            else:
+                self.stats.files += 1
+                self.stats.bytes += size
+                manifest.write("%s\n" % json.dumps({"path": path, "file_id": file_id, "size": size}))
+                manifest.flush()
+            if time.time() - self._last_report >= self.report_interval:
+                self.report()
+                self._last_report = time.time()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyfdfs.bulk",
+                                     description="upload a directory tree to fast dfs")
+    parser.add_argument("root", help="directory to import")
+    parser.add_argument("-t", "--tracker", required=True, action="append",
+                        help="tracker host:port, can be repeated or comma separated")
+    parser.add_argument("-m", "--manifest", required=True, help="resumable manifest, one json line per file")
+    parser.add_argument("-g", "--group", default=None, help="which group, default chosen by the tracker")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="worker processes, default cpu count")
+    parser.add_argument("-r", "--retries", type=int, default=3, help="retries per file")
+    parser.add_argument("--timeout", type=int, default=60, help="socket timeout in seconds")
+    parser.add_argument("--rate", type=float, default=None, help="bandwidth limit in MB/s, default unlimited")
+    parser.add_argument("--report-interval", type=int, default=10, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    host_list = [host for item in args.tracker for host in item.split(",") if host]
+    importer = BulkImporter(host_list, args.manifest, group_name=args.group, workers=args.workers,
+                            retries=args.retries, timeout=args.timeout, report_interval=args.report_interval,
+                            rate=args.rate * 1024 * 1024 if args.rate else None)
+    stats = importer.run(args.root)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
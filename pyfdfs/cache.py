@@ -0,0 +1,235 @@
+# coding=utf-8
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import errno
+import mmap
+import socket
+import select
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    from os import sendfile
+except ImportError:
+    from sendfile import sendfile
+
+from pyfdfs.compat import to_bytes, buffer_size
+
+
+class DiskCache(object):
+    """
+    Read-through cache of downloaded files in a local directory, evicting the
+    least recently used files once the cached bytes exceed max_bytes.
+
+    fast dfs file ids are never reused for other content, so a cached file is
+    valid until the file is deleted. Files are written to a temporary file and
+    renamed, several processes can share the directory.
+    """
+    description_format = "DiskCache<directory=%(directory)s,size=%(size)d/%(max_bytes)d,files=%(files)d>"
+    suffix = ".fdfs"
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        """
+        :param directory: cache directory, created if missing
+        :param max_bytes: cached bytes kept at most
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def __repr__(self):
+        return self.description_format % {
+            "directory": self.directory,
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "files": len(self._entries)
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        """
+        index the files already cached, least recently accessed first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_atime, name, st.st_size))
+        for atime, name, size in sorted(entries):
+            self._entries[name] = size
+            self.size += size
+        self._evict()
+
+    def _name(self, group_name, file_name):
+        return hashlib.sha1(to_bytes("%s/%s" % (group_name, file_name))).hexdigest() + self.suffix
+
+    def _evict(self):
+        """
+        must be called with the lock held, or from __init__
+        """
+        while self.size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def path(self, group_name, file_name):
+        """
+        :return: path of the cached file, None on miss
+        """
+        name = self._name(group_name, file_name)
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is None:
+                # cached by another process sharing the directory
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                if size > self.max_bytes:
+                    return None
+                self._entries[name] = size
+                self.size += size
+                self._evict()
+            else:
+                self._entries[name] = size
+        return path
+
+    def open(self, group_name, file_name):
+        """
+        :return: file object opened for binary reading, None on miss
+        """
+        path = self.path(group_name, file_name)
+        if path is None:
+            return None
+        try:
+            return open(path, "rb")
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # evicted in between by another process
+            self.discard(group_name, file_name)
+            return None
+
+    def get(self, group_name, file_name):
+        """
+        :return: read only mmap of the cached file, None on miss, close() it when done
+
+        slices of the mmap are bytes, the file content is only read from the
+        page cache for the slices actually used
+        """
+        f_obj = self.open(group_name, file_name)
+        if f_obj is None:
+            return None
+        with f_obj:
+            if os.fstat(f_obj.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, group_name, file_name, offset=0, size=0):
+        """
+        :param size: bytes to read, 0 for up to the end of the file
+        :return: bytes of the cached file from offset, None on miss
+        """
+        cached = self.get(group_name, file_name)
+        if not cached:
+            # a miss, or an empty file
+            return cached
+        try:
+            return cached[offset:offset + size] if size else cached[offset:]
+        finally:
+            cached.close()
+
+    def sendfile(self, sock, group_name, file_name, offset=0, count=None):
+        """
+        :param sock: connected socket, the cached file is sent to it with sendfile(2)
+        :return: bytes sent, None on miss
+        """
+        f_obj = self.open(group_name, file_name)
+        if f_obj is None:
+            return None
+        with f_obj:
+            if count is None:
+                count = os.fstat(f_obj.fileno()).st_size - offset
+            sent = 0
+            while sent < count:
+                try:
+                    size = sendfile(sock.fileno(), f_obj.fileno(), offset + sent, count - sent)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        self._wait_writable(sock)
+                        continue
+                    raise
+                if size == 0:
+                    break
+                sent += size
+        return sent
+
+    @staticmethod
+    def _wait_writable(sock):
+        """
+        a non blocking socket, or one with a timeout, is full: wait for room as its send would
+        """
+        if not select.select([], [sock], [], sock.gettimeout())[1]:
+            raise socket.timeout("timed out")
+
+    def set(self, group_name, file_name, file_buffer):
+        """
+        :param file_buffer: full file content, bytes, bytearray or memoryview
+        """
+        size = buffer_size(file_buffer)
+        if size > self.max_bytes:
+            return
+        name = self._name(group_name, file_name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f_obj:
+                f_obj.write(file_buffer)
+            os.rename(tmp_path, os.path.join(self.directory, name))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self.size += size
+            self._evict()
+
+    def discard(self, group_name, file_name):
+        """
+        forget a file, e.g. once it is deleted
+        """
+        name = self._name(group_name, file_name)
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._remove(name)
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._entries):
+                self._remove(name)
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+Checksums computed while the file content goes through the socket.
+
+A Checksum given to an upload or a download is updated with every chunk
+sent or received, so verifying a transfer needs no second read of the data.
+Its crc32 is the one the storage server reports in QUERY_FILE_INFO.
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import zlib
+import hashlib
+
+from pyfdfs.compat import PY3
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class Checksum(object):
+    description_format = "Checksum<size=%(size)d,crc32=%(crc32)08x,sha256=%(sha256)s>"
+
+    def __init__(self, sha256=False):
+        """
+        :param sha256: also compute the sha256 digest
+        """
+        self.size = 0
+        self.crc32 = 0
+        self._sha256 = hashlib.sha256() if sha256 else None
+
+    def __repr__(self):
+        return self.description_format % {"size": self.size, "crc32": self.crc32, "sha256": self.sha256}
+
+    def update(self, data):
+        """
+        :param data: bytes, bytearray or memoryview, read in place
+        """
+        if not PY3:
+            # python 2 zlib only takes read only buffers
+            data = data.tobytes() if isinstance(data, memoryview) else buffer(data)
+        self.crc32 = zlib.crc32(data, self.crc32) & 0xffffffff
+        if self._sha256 is not None:
+            self._sha256.update(data)
+        self.size += len(data)
+
+    @property
+    def sha256(self):
+        """
+        :return: hex digest, None when not computed
+        """
+        return self._sha256.hexdigest() if self._sha256 is not None else None
+
+    def verify(self, file_info):
+        """
+        :param file_info: FileInfo of the file as reported by the storage server
+        raise ChecksumMismatch unless size and crc32 match
+        """
+        # the server sends its 32 bits crc sign extended
+        crc32 = file_info.crc32 & 0xffffffff
+        if file_info.file_size != self.size or crc32 != self.crc32:
+            raise ChecksumMismatch("Error: checksum mismatch, %d bytes crc32 %08x, server has %d bytes crc32 %08x" %
+                                   (self.size, self.crc32, file_info.file_size, crc32))
@@ -5,48 +5,369 @@ __author__ = 'mazesoul'
 
 import os
 import stat
+import errno
+import time
+import random
+import functools
+import threading
 from pyfdfs.connection import ConnectionPool, Connection
 from pyfdfs.tracker import Tracker
 from pyfdfs.storage import Storage
+from pyfdfs.command import ServerError
+from pyfdfs.topology import ClusterTopology
+from pyfdfs.storage_ids import StorageIdMap
+from pyfdfs.dedup import dedup_key
+from pyfdfs.deadline import deadline
+from pyfdfs.compress import DecompressingStream, codec_of, get_codec, META_CODEC, META_SIZE, UNKNOWN
+from pyfdfs.checksum import Checksum, ChecksumMismatch
+from pyfdfs.singleflight import SingleFlight
+from pyfdfs.copier import RingBuffer
+from pyfdfs.structs import StorageResponseInfo
 from pyfdfs.enums import STORAGE_SET_METADATA_FLAG_OVERWRITE, STORAGE_SET_METADATA_FLAG_MERGE
 
+
+def bounded(method):
+    """
+    run a client call within the deadline of the client, see pyfdfs.deadline
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with deadline(self.deadline):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def merge_meta(meta_data, *updates):
+    """
+    :return: new dictionary, meta_data updated with every dictionary of updates
+    """
+    merged = dict(meta_data or {})
+    for update in updates:
+        merged.update(update or {})
+    return merged
+
+
 class FdfsClient(object):
-    def __init__(self, host_list, pool_cls=ConnectionPool, conn_cls=Connection, timeout=60, max_conn=2 ** 31):
+    def __init__(self, host_list, pool_cls=ConnectionPool, conn_cls=Connection, timeout=60, max_conn=2 ** 31,
+                 topology_refresh=None, dedup_index=None, dedup_link=False, hedge=None,
+                 cache=None, connect_timeout=None, read_timeout=None, deadline=None,
+                 min_idle=None, warmup=False, warmup_jitter=1.0, warmup_storages=False, wait_timeout=None,
+                 scheduler=None, selector=None, breaker_cls=None, compressor=None, checksum=None, verify=False,
+                 single_flight=False, buffer_pool=None, storage_id_refresh=None, budget=None):
+        """
+        :param timeout: default of connect_timeout and read_timeout, seconds
+        :param connect_timeout: seconds to set up a connection
+        :param read_timeout: seconds a single socket read or write may wait
+        :param deadline: seconds a whole call may take, tracker queries included, None for unbounded
+        :param min_idle: connections opened ahead by warmup, in the tracker pool and every storage pool
+        :param warmup: warm the pools up in a background thread, see warmup()
+        :param warmup_jitter: the background warmup starts after a random delay up to this many seconds
+        :param warmup_storages: also warm the pools of the storage servers, see warmup()
+        :param wait_timeout: seconds to wait for a connection once max_conn are open, None to fail at once
+        :param scheduler: TransferScheduler throttling the storage transfers, see pyfdfs.throttle
+        :param selector: ReplicaSelector sending reads to the fastest replica, see pyfdfs.selector
+        :param breaker_cls: circuit breaker class, one instance per storage server, see pyfdfs.breaker
+        :param compressor: Compressor of the uploads, downloads are then decompressed, see pyfdfs.compress
+        :param checksum: "crc32" or "sha256" (crc32 too), checksum of the uploads kept as sr.checksum
+                         and of the download streams as stream.checksum, see pyfdfs.checksum
+        :param verify: compare the crc32 of uploads and full downloads with the one of the storage server
+        :param single_flight: concurrent identical reads and tracker queries share one request,
+                              see pyfdfs.singleflight
+        :param buffer_pool: BufferPool lending the request, response and copy buffers, see pyfdfs.buffers
+        :param storage_id_refresh: seconds between two refreshes of the storage ids and servers, reads and
+                                   updates then go to the source server named by the file id, see pyfdfs.storage_ids
+        :param budget: MemoryBudget bounding the payload bytes in flight, uploads, downloads and copies
+                       wait for it or fail with BudgetExceeded, see pyfdfs.budget
+        """
         hosts = []
         for item in host_list:
             addr, port = item.split(":")
             hosts.append((str(addr), int(port),))
-        self.tracker_pool = pool_cls(hosts=hosts, conn_cls=conn_cls, timeout=timeout, max_conn=max_conn)
+        self.tracker_pool = pool_cls(hosts=hosts, conn_cls=conn_cls, timeout=timeout, max_conn=max_conn,
+                                     connect_timeout=connect_timeout, read_timeout=read_timeout, min_idle=min_idle,
+                                     wait_timeout=wait_timeout, buffer_pool=buffer_pool, budget=budget)
         self.tracker = Tracker(self.tracker_pool)
         self.pool_cls = pool_cls
         self.conn_cls = conn_cls
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
         self.max_conn = max_conn
+        self.min_idle = min_idle
+        self.wait_timeout = wait_timeout
+        self.scheduler = scheduler
+        self.selector = selector
+        self.breaker_cls = breaker_cls
+        self.buffer_pool = buffer_pool
+        self.budget = budget
         self.storage_servers = {}
+        self._storage_lock = threading.Lock()
+        self.topology = None
+        if topology_refresh:
+            self.topology = ClusterTopology(self.tracker, refresh_interval=topology_refresh)
+            self.topology.start()
+        self.storage_ids = None
+        if storage_id_refresh:
+            self.storage_ids = StorageIdMap(self.tracker, refresh_interval=storage_id_refresh)
+            self.storage_ids.start()
+        self.dedup_index = dedup_index
+        self.dedup_link = dedup_link
+        self.hedge = hedge
+        self.cache = cache
+        self.compressor = compressor
+        self.checksum = checksum
+        self.verify = verify
+        self.flight = SingleFlight() if single_flight else None
+        self._warm = threading.Event()
+        self._warmup_thread = None
+        if warmup:
+            self._warmup_thread = threading.Thread(target=self.warmup, name="pyfdfs-warmup",
+                                                   args=(warmup_storages, random.uniform(0, warmup_jitter),))
+            self._warmup_thread.daemon = True
+            self._warmup_thread.start()
 
     def __del__(self):
         try:
+            if self.topology is not None:
+                self.topology.stop()
+            if self.storage_ids is not None:
+                self.storage_ids.stop()
             self.tracker_pool.destroy()
             self.tracker_pool = None
-            for k, v in self.storage_servers.iteritems():
-                v.pool.destroy()
-        except Exception, e:
+            for storage in list(self.storage_servers.values()):
+                storage.pool.destroy()
+        except Exception as e:
             print("Error: %s" % e)
             pass
 
-    def _get_storage(self, host, port):
+    def _get_storage(self, host, port, group_name=None):
         """
         :param host: which storage server host
         :param port: which storage server port
+        :param group_name: group of the storage server
         :return: Storage Object
         """
         storage = self.storage_servers.get((host, port,))
         if storage is None:
-            storage = Storage(host, port, pool_cls=self.pool_cls, conn_cls=self.conn_cls,
-                              timeout=self.timeout, max_conn=self.max_conn)
-            self.storage_servers[(host, port,)] = storage
+            with self._storage_lock:
+                storage = self.storage_servers.get((host, port,))
+                if storage is None:
+                    storage = Storage(host, port, pool_cls=self.pool_cls, conn_cls=self.conn_cls,
+                                      timeout=self.timeout, max_conn=self.max_conn,
+                                      connect_timeout=self.connect_timeout, read_timeout=self.read_timeout,
+                                      min_idle=self.min_idle, wait_timeout=self.wait_timeout,
+                                      scheduler=self.scheduler, group_name=group_name,
+                                      observer=self.selector.record if self.selector is not None else None,
+                                      breaker=self.breaker_cls() if self.breaker_cls is not None else None,
+                                      buffer_pool=self.buffer_pool, budget=self.budget)
+                    self.storage_servers[(host, port,)] = storage
         return storage
 
+    def _query_store(self, group_name=None):
+        """
+        :param group_name: which group, can be null
+        :return: BasicStorageInfo
+        function: storage server for upload, from the topology snapshot when possible
+        """
+        storage_info = None
+        if self.topology is not None:
+            storage_info = self.topology.pick_store(group_name)
+        if storage_info is None:
+            if group_name is not None:
+                storage_info = self.tracker.query_store_with_group_one(group_name)
+            else:
+                storage_info = self.tracker.query_store_without_group_one()
+        if not self._available(storage_info):
+            if group_name is not None:
+                storage_info = self._redirect(storage_info, self.tracker.query_store_with_group_all(group_name))
+            else:
+                storage_info = self._redirect(storage_info, self.tracker.query_store_without_group_all())
+        return storage_info
+
+    def _query_fetch(self, group_name, file_name):
+        """
+        :param group_name: which group
+        :param file_name: which file
+        :return: BasicStorageInfo
+        function: storage server for download, the source server of the file or one from the topology
+                  snapshot when possible
+        """
+        storage_info = None
+        if self.storage_ids is not None:
+            storage_info = self.storage_ids.pick_source(group_name, file_name)
+        if storage_info is None and self.topology is not None:
+            storage_info = self.topology.pick_fetch(group_name)
+        if storage_info is None:
+            storage_info = self.query_fetch_one(group_name, file_name)
+        if not self._available(storage_info):
+            storage_info = self._redirect(storage_info, self.tracker.query_fetch_all(group_name, file_name))
+        return storage_info
+
+    def _query_update(self, group_name, file_name):
+        """
+        :param group_name: which group
+        :param file_name: which file
+        :return: BasicStorageInfo
+        function: source storage server of the file, to update or delete it
+        """
+        storage_info = None
+        if self.storage_ids is not None:
+            storage_info = self.storage_ids.pick_source(group_name, file_name)
+        if storage_info is None:
+            storage_info = self.tracker.query_update(group_name, file_name)
+        return storage_info
+
+    def _available(self, storage_info):
+        """
+        :return: False when the circuit breaker of the storage server is open
+        """
+        if self.breaker_cls is None:
+            return True
+        storage = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        return storage.pool.breaker.available()
+
+    def _redirect(self, storage_info, storage_infos):
+        """
+        :return: the first of storage_infos whose breaker is not open, storage_info if none
+        """
+        for si in storage_infos:
+            if self._available(si):
+                return si
+        return storage_info
+
+    def _read(self, group_name, file_name, func):
+        """
+        :param func: func(storage) performing the read
+        :return: result of func
+        function: run a read on a storage server holding the file: the fastest one
+                  with a ReplicaSelector, hedged across all of them with a HedgePolicy
+        """
+        if self.hedge is None:
+            return self._read_first(group_name, file_name, func)
+        return self.hedge.run(self._read_storages(group_name, file_name), func)
+
+    def _read_first(self, group_name, file_name, func):
+        """
+        :param func: func(storage) performing the read
+        :return: result of func on the first storage server of _read_storages
+        function: a server picked from the topology snapshot may not hold a new file yet, its sync from
+                  the source server still pending: on ENOENT the read is tried once more on the server
+                  the tracker picks, which knows the sync state of the group
+        """
+        storage = self._read_storages(group_name, file_name)[0]
+        try:
+            return func(storage)
+        except ServerError as e:
+            if e.status != errno.ENOENT or self.topology is None or self.selector is not None:
+                raise
+            storage_info = self.query_fetch_one(group_name, file_name)
+            retry = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+            if retry is storage:
+                raise
+            return func(retry)
+
+    def _read_storages(self, group_name, file_name):
+        """
+        :return: List<Storage> holding the file, the one to read from first
+        """
+        if self.hedge is None and self.selector is None:
+            storage_info = self._query_fetch(group_name, file_name)
+            return [self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)]
+        if self.selector is not None:
+            storage_infos = self.selector.rank(self.selector.replicas(self, group_name, file_name))
+        else:
+            storage_infos = self.query_fetch_all(group_name, file_name)
+        storage_infos = [si for si in storage_infos if self._available(si)] or storage_infos
+        return [self._get_storage(si.ip_addr, si.storage_port, si.group_name) for si in storage_infos]
+
+    def warmup(self, storages=False, delay=0):
+        """
+        :param storages: also resolve the storage servers and warm their pools:
+                         True for the servers of query_store_without_group_all,
+                         or a list of group names for query_store_with_group_all
+        :param delay: seconds to wait first
+        :return: True once warm, False if a server could not be reached
+        function: open min_idle connections in every pool ahead of the first commands
+        """
+        if delay:
+            time.sleep(delay)
+        try:
+            self.tracker_pool.warmup()
+            storage_infos = []
+            if storages is True:
+                storage_infos = self.tracker.query_store_without_group_all()
+            elif storages:
+                for group_name in storages:
+                    storage_infos.extend(self.tracker.query_store_with_group_all(group_name))
+            for storage_info in storage_infos:
+                storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port,
+                                                   storage_info.group_name)
+                storage_server.pool.warmup()
+        except Exception as e:
+            print("Error: warmup %s" % e)
+            return False
+        self._warm.set()
+        return True
+
+    def ready(self, timeout=0):
+        """
+        :param timeout: seconds to wait for the warmup, None to wait until it is done
+        :return: True once the pools are warm
+        """
+        if self._warm.wait(timeout):
+            return all(pool.is_warm() for pool in self._pools())
+        return False
+
+    def _shared(self, key, func):
+        """
+        :param key: (command, group name, file name, ...)
+        :return: func(), shared with the concurrent calls of the same key with single_flight
+        """
+        if self.flight is None:
+            return func()
+        return self.flight.do(key, func)
+
+    def _new_checksum(self):
+        """
+        :return: Checksum for a transfer, None when neither checksum nor verify is asked for
+        """
+        if self.checksum is None and not self.verify:
+            return None
+        return Checksum(sha256=self.checksum == "sha256")
+
+    def _verify_upload(self, storage_server, sr):
+        """
+        raise ChecksumMismatch, once the corrupt file is deleted, unless the storage server has the sent content
+        """
+        if not self.verify or sr.checksum is None:
+            return
+        try:
+            sr.checksum.verify(storage_server.query_file_info(sr.group_name, sr.filename))
+        except ChecksumMismatch:
+            try:
+                storage_server.delete_file(sr.group_name, sr.filename)
+            except Exception as e:
+                print("Error: %s" % e)
+            raise
+
+    def _download(self, group_name, file_name, offset=0, download_bytes=0):
+        """
+        :return: content downloaded from a storage server holding the file, verified if asked for
+        """
+        verify = self.verify and offset == 0 and download_bytes == 0
+
+        def download(storage):
+            checksum = Checksum() if verify else None
+            resp = storage.download_to_buffer(group_name, file_name, offset, download_bytes, checksum)
+            if verify:
+                checksum.verify(storage.query_file_info(group_name, file_name))
+            return resp
+        return self._read(group_name, file_name, download)
+
+    def _pools(self):
+        return [self.tracker_pool] + [storage.pool for storage in list(self.storage_servers.values())]
+
     @staticmethod
     def _check_file(file_name):
         if not os.path.isfile(file_name):
@@ -56,6 +377,7 @@ class FdfsClient(object):
         else:
             return True, ""
 
+    @bounded
     def list_groups(self):
         """
         :return: List<GroupInfo>
@@ -63,6 +385,7 @@ class FdfsClient(object):
         """
         return self.tracker.list_groups()
 
+    @bounded
     def list_one_group(self, group_name):
         """
         :param: group_name: which group
@@ -71,6 +394,7 @@ class FdfsClient(object):
         """
         return self.tracker.list_one_group(group_name)
 
+    @bounded
     def list_servers(self, group_name, storage_ip=None):
         """
         :param: group_name: which group
@@ -80,6 +404,7 @@ class FdfsClient(object):
         """
         return self.tracker.list_servers(group_name, storage_ip)
 
+    @bounded
     def query_store_without_group_one(self):
         """
         :return: BasicStorageInfo
@@ -87,6 +412,7 @@ class FdfsClient(object):
         """
         return self.tracker.query_store_without_group_one()
 
+    @bounded
     def query_store_with_group_one(self, group_name):
         """
         :param: group_name: which group
@@ -95,6 +421,7 @@ class FdfsClient(object):
         """
         return self.tracker.query_store_with_group_one(group_name)
 
+    @bounded
     def query_store_without_group_all(self):
         """
         :return: List<BasicStorageInfo>
@@ -102,6 +429,7 @@ class FdfsClient(object):
         """
         return self.tracker.query_store_without_group_all()
 
+    @bounded
     def query_store_with_group_all(self, group_name):
         """
         :param: group_name: which group
@@ -110,6 +438,7 @@ class FdfsClient(object):
         """
         return self.tracker.query_store_with_group_all(group_name)
 
+    @bounded
     def query_fetch_one(self, group_name, file_name):
         """
         :param group_name: which group
@@ -117,8 +446,10 @@ class FdfsClient(object):
         :return: BasicStorageInfo
         function: query which storage server to download the file
         """
-        return self.tracker.query_fetch_one(group_name, file_name)
+        return self._shared(("query_fetch_one", group_name, file_name),
+                            lambda: self.tracker.query_fetch_one(group_name, file_name))
 
+    @bounded
     def query_fetch_all(self, group_name, file_name):
         """
         :param group_name: which group
@@ -126,8 +457,10 @@ class FdfsClient(object):
         :return: List<BasicStorageInfo>
         function: query all storage servers to download the file
         """
-        return self.tracker.query_fetch_all(group_name, file_name)
+        return self._shared(("query_fetch_all", group_name, file_name),
+                            lambda: self.tracker.query_fetch_all(group_name, file_name))
 
+    @bounded
     def upload_file_by_filename(self, file_name, group_name=None, meta_data=None):
         """
         :param file_name: file name for upload
@@ -139,55 +472,334 @@ class FdfsClient(object):
         is_file, msg = self._check_file(file_name)
         if not is_file:
             raise Exception(msg)
-        if group_name is not None:
-            storage_info = self.tracker.query_store_with_group_one(group_name)
-        else:
-            storage_info = self.tracker.query_store_without_group_one()
-        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port)
-        return storage_server.upload_file_by_filename(file_name, storage_info.current_write_path, meta_data)
+        ext = Storage.get_ext(file_name)
+        if self.compressor is not None and self.compressor.wants(os.stat(file_name).st_size, ext):
+            with open(file_name, "rb") as f_obj:
+                return self.upload_file_by_buffer(f_obj.read(), ext, group_name, meta_data)
+        storage_info = self._query_store(group_name)
+        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        sr = storage_server.upload_file_by_filename(file_name, storage_info.current_write_path, meta_data,
+                                                    self._new_checksum())
+        self._verify_upload(storage_server, sr)
+        if self.compressor is not None:
+            self.compressor.remember("%s/%s" % (sr.group_name, sr.filename), None)
+        return sr
 
-    def upload_file_by_buffer(self, file_buffer, ext, group_name=None, meta_data=None):
+    @bounded
+    def upload_file_by_buffer(self, file_buffer, ext, group_name=None, meta_data=None, compress=True):
         """
         :param file_buffer: file name for upload
         :param ext: file ext name
         :param group_name: which group, can be null
         :param meta_data: dictionary, store metadata in it ,can be null
+        :param compress: False to upload as is with a compressor, for a file read with ranged downloads
         :return: StorageResponseInfo
         function: upload file buffer to storage server
         """
-        if group_name is not None:
-            storage_info = self.tracker.query_store_with_group_one(group_name)
-        else:
-            storage_info = self.tracker.query_store_without_group_one()
-        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port)
-        return storage_server.upload_file_by_buffer(file_buffer, storage_info.current_write_path,
-                                                    meta_data, ext)
+        key = None
+        if self.dedup_index is not None and (meta_data is None or self.dedup_link):
+            key = dedup_key(file_buffer, ext)
+            sr = self._dedup_lookup(key, ext, group_name, meta_data)
+            if sr is not None:
+                return sr
+        compressed = None
+        if self.compressor is not None and compress:
+            compressed = self.compressor.compress(file_buffer, ext)
+            if compressed is not None:
+                file_buffer = compressed[0]
+                meta_data = merge_meta(meta_data, compressed[1])
+        storage_info = self._query_store(group_name)
+        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        sr = storage_server.upload_file_by_buffer(file_buffer, storage_info.current_write_path, meta_data, ext,
+                                                  self._new_checksum())
+        self._verify_upload(storage_server, sr)
+        if self.compressor is not None:
+            self.compressor.remember("%s/%s" % (sr.group_name, sr.filename), None if compressed is None else
+                                     (get_codec(compressed[1][META_CODEC]), compressed[1][META_SIZE]))
+        if key is not None:
+            self.dedup_index.set(key, "%s/%s" % (sr.group_name, sr.filename))
+        return sr
+
+    def _dedup_lookup(self, key, ext, group_name, meta_data):
+        """
+        :return: StorageResponseInfo of the already uploaded content, None on miss
+
+        without dedup_link the existing file id is returned as is, so uploads
+        carrying meta data always miss. With dedup_link a new file id linked
+        to the existing file is created on its source storage server, and gets
+        its own meta data.
+        """
+        file_id = self.dedup_index.get(key)
+        if file_id is None:
+            return None
+        src_group_name, src_file_name = file_id.split("/", 1)
+        if group_name is not None and group_name != src_group_name:
+            return None
+        if not self.dedup_link:
+            sr = StorageResponseInfo()
+            sr.group_name = src_group_name
+            sr.filename = src_file_name
+            return sr
+        try:
+            storage_info = self._query_update(src_group_name, src_file_name)
+            storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+            sr = storage_server.create_link(src_group_name, src_file_name, key, ext)
+            if self.compressor is not None:
+                # the link shares the compressed content, it needs its codec too
+                meta_data = merge_meta(self._compression_meta(storage_server.get_meta(src_group_name, src_file_name)),
+                                       meta_data)
+        except Exception:
+            # the source file is gone, upload the content again
+            self.dedup_index.discard_file(file_id)
+            return None
+        if meta_data:
+            storage_server.set_meta(sr.filename, sr.group_name, meta_data)
+        return sr
+
+    @bounded
+    def copy_file(self, group_name, file_name, dest_group_name=None, meta=True, delete_source=False,
+                  chunk_size=256 * 1024, slots=8):
+        """
+        :param group_name: group of the file
+        :param file_name: file name
+        :param dest_group_name: group of the copy, can be null
+        :param meta: give the copy the meta data of the file
+        :param delete_source: delete the file once copied
+        :param chunk_size: bytes of a RingBuffer slot
+        :param slots: slots of the RingBuffer
+        :return: StorageResponseInfo of the copy
+        function: pipe a download into an upload, see pyfdfs.copier; the stored bytes are copied
+                  as they are, compressed files keep their codec through their meta data
+        """
+        meta_data = self._meta(group_name, file_name) if meta else None
+        storage_info = self._query_store(dest_group_name)
+        dest = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        stream = self._read_first(group_name, file_name,
+                                  lambda storage: storage.download_stream(group_name, file_name,
+                                                                          chunk_size=chunk_size))
+        ring = RingBuffer(stream, slots, chunk_size, self.buffer_pool, self.budget)
+        try:
+            sr = dest.upload_stream(ring, stream.length, storage_info.current_write_path, meta_data,
+                                    Storage.get_ext(file_name, double_ext=False), self._new_checksum())
+        finally:
+            ring.close()
+        self._verify_upload(dest, sr)
+        if delete_source:
+            self.delete_file(group_name, file_name)
+        return sr
+
+    @bounded
+    def delete_file(self, group_name, file_name):
+        """
+        :param group_name: which group
+        :param file_name: which file
+        :return: none
+        function: delete file from its source storage server
+        """
+        storage_info = self._query_update(group_name, file_name)
+        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        storage_server.delete_file(group_name, file_name)
+        if self.cache is not None:
+            self.cache.discard(group_name, file_name)
+        if self.selector is not None:
+            self.selector.discard(group_name, file_name)
+        if self.dedup_index is not None:
+            self.dedup_index.discard_file("%s/%s" % (group_name, file_name))
+        if self.compressor is not None:
+            self.compressor.forget("%s/%s" % (group_name, file_name))
 
+    @bounded
     def set_meta(self, file_name, meta_data, group_name=None, overwrite=True):
         """
         :param file_name: which file
         :param meta_data: update info
-        :param group_name: which group
+        :param group_name: which group, None when file_name is the file id group_name/remote_file_name
         :param overwrite: default True, False for merge & update
         :return: none
+        function: update the meta data on the source storage server of the file
         """
-        if group_name is not None:
-            storage_info = self.tracker.query_store_with_group_one(group_name)
-        else:
-            storage_info = self.tracker.query_store_without_group_one()
-        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port)
+        if group_name is None:
+            group_name, file_name = file_name.split("/", 1)
+        storage_info = self._query_update(group_name, file_name)
+        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
         operation_flag = STORAGE_SET_METADATA_FLAG_OVERWRITE if overwrite else STORAGE_SET_METADATA_FLAG_MERGE
+        if self.compressor is not None and overwrite:
+            # keep the codec of a compressed file
+            meta_data = merge_meta(self._compression_meta(self._meta(group_name, file_name)), meta_data)
+        if self.cache is not None:
+            self.cache.discard(group_name, file_name)
+        if self.compressor is not None:
+            self.compressor.forget("%s/%s" % (group_name, file_name))
         return storage_server.set_meta(file_name, group_name, meta_data, operation_flag)
 
+    @bounded
     def get_meta(self, group_name, file_name):
         """
         :param group_name: group name
         :param file_name: file name
         :return: meta data, dictionary, store metadata in it
         """
-        if group_name is not None:
-            storage_info = self.tracker.query_store_with_group_one(group_name)
-        else:
-            storage_info = self.tracker.query_store_without_group_one()
-        storage_server = self._get_storage(storage_info.ip_addr, storage_info.storage_port)
-        return storage_server.get_meta(group_name, file_name)
+        return self._meta(group_name, file_name)
+
+    def _meta(self, group_name, file_name):
+        return self._shared(("get_meta", group_name, file_name), lambda: self._read(
+            group_name, file_name, lambda storage: storage.get_meta(group_name, file_name)))
+
+    @staticmethod
+    def _compression_meta(meta_data):
+        return dict((k, v) for k, v in meta_data.items() if k in (META_CODEC, META_SIZE))
+
+    def _codec(self, group_name, file_name):
+        """
+        :return: (Codec, original size) of a compressed file, None when stored as is or without compressor
+        """
+        if self.compressor is None or not self.compressor.may_be_compressed(file_name):
+            return None
+        file_id = "%s/%s" % (group_name, file_name)
+        codec = self.compressor.recall(file_id)
+        if codec is UNKNOWN:
+            codec = codec_of(self._meta(group_name, file_name))
+            self.compressor.remember(file_id, codec)
+        return codec
+
+    @bounded
+    def download_to_buffer(self, group_name, file_name, offset=0, download_bytes=0):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :param offset: first byte to download
+        :param download_bytes: bytes to download, 0 for up to the end of the file
+        :return: file content
+
+        with a cache, hits are read from the local copy and full downloads are cached.
+        A compressed file is downloaded whole and decompressed, then sliced.
+        With verify, full downloads are checked against the crc32 of the storage server.
+        With single_flight, concurrent identical downloads share one and get the same bytes
+        """
+        if self.cache is not None:
+            cached = self.cache.read(group_name, file_name, offset, download_bytes)
+            if cached is not None:
+                return cached
+        return self._shared(("download", group_name, file_name, offset, download_bytes),
+                            lambda: self._fetch(group_name, file_name, offset, download_bytes))
+
+    def _fetch(self, group_name, file_name, offset, download_bytes):
+        """
+        download_to_buffer past the cache lookup
+        """
+        codec = self._codec(group_name, file_name)
+        if codec is not None:
+            content = codec[0].decompress(self._download(group_name, file_name))
+            if self.cache is not None:
+                self.cache.set(group_name, file_name, content)
+            return content[offset:offset + download_bytes] if download_bytes else content[offset:]
+        resp = self._download(group_name, file_name, offset, download_bytes)
+        if self.cache is not None and offset == 0 and download_bytes == 0:
+            self.cache.set(group_name, file_name, resp)
+        return resp
+
+    @bounded
+    def download_stream(self, group_name, file_name, offset=0, download_bytes=0, chunk_size=64 * 1024):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :param offset: first byte to download
+        :param download_bytes: bytes to download, 0 for up to the end of the file
+        :param chunk_size: bytes read from the socket at a time
+        :return: ResponseStream, iterate it or read() it, close() it when done,
+                 DecompressingStream for a compressed file. With checksum, stream.checksum
+                 is the Checksum of the bytes read so far, of the stored bytes for a compressed file
+        """
+        codec = self._codec(group_name, file_name)
+        checksum = Checksum(sha256=self.checksum == "sha256") if self.checksum is not None else None
+        if codec is None:
+            return self._read_first(group_name, file_name, lambda storage: storage.download_stream(
+                group_name, file_name, offset, download_bytes, chunk_size, checksum))
+        codec, size = codec
+        length = max(min(download_bytes or size, size - offset), 0)
+        return DecompressingStream(self._read_first(group_name, file_name, lambda storage: storage.download_stream(
+            group_name, file_name, chunk_size=chunk_size, checksum=checksum)), codec, offset, length)
+
+    @bounded
+    def download_to_file(self, group_name, file_name, local_file_name, offset=0, download_bytes=0, use_splice=True):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :param local_file_name: path of the file written, replaced if it exists, removed if the download fails
+        :param offset: first byte to download
+        :param download_bytes: bytes to download, 0 for up to the end of the file
+        :param use_splice: move the content from the socket to the file with os.splice when available
+        :return: bytes written
+        function: download into a local file without holding the content in memory; on linux the bytes
+                  go from the socket to the file with os.splice, without passing through python.
+                  A compressed file is decompressed through download_stream instead.
+                  With verify, full downloads are checked against the crc32 of the storage server
+        """
+        try:
+            # readable too, a spliced checksum is read back from the file
+            with open(local_file_name, "w+b") as f_obj:
+                if self._codec(group_name, file_name) is not None:
+                    return self._write_stream(self.download_stream(group_name, file_name, offset, download_bytes),
+                                              f_obj)
+                verify = self.verify and offset == 0 and download_bytes == 0
+
+                def download(storage):
+                    checksum = Checksum() if verify else None
+                    written = storage.download_to_file(group_name, file_name, f_obj.fileno(), offset,
+                                                       download_bytes, checksum, use_splice)
+                    if verify:
+                        checksum.verify(storage.query_file_info(group_name, file_name))
+                    return written
+                return self._read_first(group_name, file_name, download)
+        except Exception:
+            if os.path.exists(local_file_name):
+                os.remove(local_file_name)
+            raise
+
+    @staticmethod
+    def _write_stream(stream, f_obj):
+        """
+        :return: bytes of stream written to f_obj
+        """
+        written = 0
+        try:
+            for chunk in stream:
+                f_obj.write(chunk)
+                written += len(chunk)
+        finally:
+            stream.close()
+        return written
+
+    def fetch_one_path_binlog(self, group_name, store_path_index=0, storage_info=None, chunk_size=64 * 1024):
+        """
+        :param group_name: group name
+        :param store_path_index: store path index on the storage server
+        :param storage_info: BasicStorageInfo of the storage server, the first one of the group if null
+        :param chunk_size: bytes read from the socket at a time
+        :return: ResponseStream over the binlog of the store path, see pyfdfs.binlog
+        function: unbounded by the deadline of the client, a binlog can be large
+        """
+        if storage_info is None:
+            storage_info = self.query_store_with_group_all(group_name)[0]
+        storage = self._get_storage(storage_info.ip_addr, storage_info.storage_port, storage_info.group_name)
+        return storage.fetch_one_path_binlog(group_name, store_path_index, chunk_size)
+
+    @bounded
+    def content_size(self, group_name, file_name):
+        """
+        :return: size of the file content, before compression for a compressed file
+        """
+        codec = self._codec(group_name, file_name)
+        if codec is not None:
+            return codec[1]
+        return self.query_file_info(group_name, file_name).file_size
+
+    @bounded
+    def query_file_info(self, group_name, file_name):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :return: FileInfo
+        """
+        return self._shared(("query_file_info", group_name, file_name), lambda: self._read(
+            group_name, file_name, lambda storage: storage.query_file_info(group_name, file_name)))
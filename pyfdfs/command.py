@@ -5,9 +5,27 @@ __author__ = 'mazesoul'
 
 import os
 import sys
+import time
 import errno
 import struct
-from sendfile import sendfile
+
+try:
+    from os import sendfile
+except ImportError:
+    from sendfile import sendfile
+
+from pyfdfs.compat import PY3, text_type, buffer_size
+from pyfdfs.deadline import get_deadline
+
+
+class ServerError(Exception):
+    """
+    the server answered with a non zero status, the connection stays usable
+    """
+
+    def __init__(self, status):
+        Exception.__init__(self, 'Error: %d, %s' % (status, os.strerror(status)))
+        self.status = status
 
 
 class CommandHeader(object):
@@ -31,13 +49,34 @@ class CommandHeader(object):
 
 class Command(object):
     buffer_size = 4096
+    coalesce_size = 64 * 1024
+
+    @staticmethod
+    def check_deadline():
+        """
+        fail before taking a connection when the deadline of the thread is spent
+        """
+        deadline = get_deadline()
+        if deadline is not None:
+            deadline.check()
 
     def __init__(self, pool=None, header=None, fmt=None):
         self.pool = pool
         self._conn = None
         self.header = header
-        self.buf = self.header.pack_req()
+        self.payload = []
         self.fmt = fmt
+        # Checksum of the content sent (payload or file) and received (response body)
+        self.send_checksum = None
+        self.recv_checksum = None
+        # BufferPool of the connection pool, see pyfdfs.buffers
+        self.buffers = getattr(pool, "buffer_pool", None)
+        # MemoryBudget of the connection pool, see pyfdfs.budget
+        self.budget = getattr(pool, "budget", None)
+        self._slab = None
+        self._slabs = []
+        self._pooled_response = False
+        self.buf = self.header.pack_req()
 
     def get_conn(self):
         if self._conn is None:
@@ -55,43 +94,214 @@ class Command(object):
     conn = property(get_conn, set_conn, del_conn)
 
     def pack(self, *values):
-        st = struct.Struct(self.fmt)
-        self.buf = "%s%s" % (self.buf, st.pack(*values))
+        """
+        pack the fixed part of the request body with self.fmt, text values are utf-8 encoded
+        """
+        values = [item.encode("utf-8") if isinstance(item, text_type) else item for item in values]
+        offset = len(self.buf)
+        size = offset + struct.calcsize(self.fmt)
+        if self._slab is None and (self.buffers is None or not self.buffers.pooled(size)):
+            self.buf += struct.pack(self.fmt, *values)
+            return
+        self._grow(size)
+        struct.pack_into(self.fmt, self._slab, offset, *values)
+
+    def _grow(self, size):
+        """
+        pooled request: make self.buf size bytes long, over a slab of the buffer pool, keeping its content
+        """
+        if self._slab is None or len(self._slab) < size:
+            slab = self.buffers.acquire(size)
+            # through a memoryview: bytearray slice assignment copies its value first
+            memoryview(slab)[:len(self.buf)] = self.buf
+            if self._slab is not None:
+                self.buffers.release(self._slab)
+            self._slab = slab
+        self.buf = memoryview(self._slab)[:size]
+
+    def _release_request(self):
+        if self._slab is not None:
+            self.buffers.release(self._slab)
+            self._slab = self.buf = None
+
+    def release_buffers(self):
+        """
+        give the slabs of the command back to the buffer pool
+        """
+        self._release_request()
+        while self._slabs:
+            self.buffers.release(self._slabs.pop())
+
+    def append(self, byte_stream):
+        """
+        :param byte_stream: bytes, bytearray or memoryview sent after the packed part, never copied
+        """
+        self.payload.append(byte_stream)
+
+    def _reserve(self, size):
+        """
+        :return: bytes reserved from the budget before size bytes are allocated or sent, 0 without a budget
+        """
+        if self.budget is None:
+            return 0
+        return self.budget.reserve(size)
+
+    def _give_back(self, reserved):
+        if reserved:
+            self.budget.release(reserved)
+
+    def _reserve_payload(self):
+        """
+        :return: bytes of the payload reserved from the budget, the slab of the request is given back when refused
+        """
+        try:
+            return self._reserve(sum(buffer_size(item) for item in self.payload)) if self.payload else 0
+        except Exception:
+            # nothing will be sent
+            self._release_request()
+            raise
+
+    def send_request(self, reserved=None):
+        """
+        :param reserved: bytes of the payload the caller already reserved, None to reserve them here;
+                         given back once the request is sent
+        """
+        if self.send_checksum is not None:
+            for item in self.payload:
+                self.send_checksum.update(memoryview(item))
+        # reserved before taking a connection, so a caller waiting for the budget holds none
+        if reserved is None:
+            reserved = self._reserve_payload()
+        try:
+            if not self.payload:
+                self.conn.send(self.buf)
+            elif len(self.payload) == 1 and len(self.payload[0]) <= self.coalesce_size:
+                # one small write is cheaper than a gather write
+                item = self.payload[0]
+                size = len(self.buf) + buffer_size(item)
+                if self._slab is not None or self.buffers is not None and self.buffers.pooled(size):
+                    used = len(self.buf)
+                    self._grow(size)
+                    self.buf[used:] = memoryview(item).cast("B") if PY3 else item
+                    self.conn.send(self.buf)
+                else:
+                    self.conn.send(self.buf + item if isinstance(item, bytes) else bytearray(self.buf) + item)
+            else:
+                self.conn.sendv([self.buf] + self.payload)
+        finally:
+            # the request is on the wire, or the connection is dropped
+            self._release_request()
+            self._give_back(reserved)
 
     def execute(self):
         """
         :return: response_body, total_response_size
         """
+        return self._execute(pooled=False)
+
+    def response(self):
+        """
+        :return: context manager over (response_body, total_response_size), for bodies parsed at once:
+                 with a buffer pool a large body is a memoryview over a pooled slab, only valid in the block
+        """
+        self._pooled_response = True
+        return self
+
+    def __enter__(self):
+        return self._execute(pooled=self._pooled_response)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release_buffers()
+
+    def execute_to_file(self, fd, use_splice=True):
+        """
+        :param fd: file descriptor the response body is written to, see Connection.recv_to_file
+        :param use_splice: move the body with os.splice when available
+        :return: bytes written, total_response_size
+        """
+        return self._execute(pooled=False, fd=fd, use_splice=use_splice)
+
+    def _execute(self, pooled, fd=None, use_splice=True):
+        self.check_deadline()
+        # the payload is reserved before the connection is taken, see send_request
+        reserved = self._reserve_payload()
         try:
-            self.conn.send(self.buf)
-            resp_header = self.conn.recv(self.header.resp_header_len())
-            self.header.unpack_resp(resp_header)
-            if self.header.status != 0:
-                raise Exception('Error: %d, %s' % (self.header.status, os.strerror(self.header.status)))
-            resp_body = self.conn.recv(self.header.resp_pkg_len)
+            observer = self.conn.observer
+        except Exception:
+            self._give_back(reserved)
+            self.release_buffers()
+            raise
+        started = received = time.time() if observer is not None else None
+        try:
+            self.send_request(reserved)
+            self._recv_header()
+            if observer is not None:
+                received = time.time()
+            if fd is None:
+                resp_body = self._recv_body(pooled)
+            else:
+                resp_body = self.conn.recv_to_file(fd, self.header.resp_pkg_len, self.recv_checksum, use_splice)
+            if observer is not None:
+                self.observe(observer, received - started, time.time() - received, self.header.resp_pkg_len)
             return resp_body, self.header.resp_pkg_len
-        except Exception as e:
-            if self.conn:
-                self.conn.disconnect()
-            raise e
+        except ServerError:
+            self.release_buffers()
+            raise
+        except Exception:
+            if self._conn:
+                if observer is not None:
+                    self.observe(observer, time.time() - started, ok=False)
+                self._conn.disconnect()
+            # no body is handed out, __exit__ of response() does not run when __enter__ raises
+            self.release_buffers()
+            raise
         finally:
             del self.conn
 
-    def send_file(self, file_name, buffer_size=4096):
+    def stream(self, chunk_size=64 * 1024):
+        """
+        :return: ResponseStream over the response body, the connection is kept until it is consumed or closed
+        """
+        self.check_deadline()
+        try:
+            self.send_request()
+            self._recv_header()
+        except ServerError:
+            del self.conn
+            raise
+        except Exception:
+            if self._conn:
+                self._conn.disconnect()
+            del self.conn
+            raise
+        return ResponseStream(self, self.header.resp_pkg_len, chunk_size)
+
+    def observe(self, observer, latency, transfer_time=0, nbytes=0, ok=True):
+        """
+        report the timings of the command to the observer of its connection, see pyfdfs.selector
+        """
+        observer((self._conn.remote_addr, self._conn.remote_port), latency, transfer_time, nbytes, ok)
+
+    def send_file(self, file_name, buffer_size=1 << 20):
         """
         :param file_name: file path
         :return: response_body, total_response_size
         """
         if 'linux' not in sys.platform.lower():
             raise Exception('sendfile system call only available on linux.')
+        self.check_deadline()
         try:
-            self.conn.send(self.buf)
-            resp_header = self.conn.recv(self.header.resp_header_len())
-            self.header.unpack_resp(resp_header)
-            if self.header.status != 0:
-                raise Exception('Error: %d, %s' % (self.header.status, os.strerror(self.header.status)))
+            self.send_request()
             sock_fd = self.conn.get_fd()
+            if self.conn.scheduler is not None:
+                # throttled: pace every chunk
+                buffer_size = min(buffer_size, self.conn.scheduler.chunk_size)
             offset = 0
+            checksum = self.send_checksum
+            # the sent range is read back from the page cache, the send itself stays zero copy
+            read_back = None
+            if checksum is not None:
+                read_back = memoryview(self._borrow(buffer_size))[:buffer_size]
             with open(file_name, "rb") as f_obj:
                 while 1:
                     try:
@@ -99,43 +309,209 @@ class Command(object):
                         if sent == 0:
                             break
                         offset += sent
+                        if checksum is not None:
+                            checksum.update(read_back[:f_obj.readinto(read_back[:sent])])
+                        self.conn.pace(sent)
                     except OSError as e:
                         if e.errno == errno.EAGAIN:
+                            self.check_deadline()
                             continue
                         raise e
-            resp_body = self.conn.recv(self.header.resp_pkg_len)
-            return resp_body, self.header.resp_pkg_len
-        except Exception as e:
-            if self.conn:
-                self.conn.disconnect()
-            raise e
+            return self._recv_response()
+        except ServerError:
+            raise
+        except Exception:
+            if self._conn:
+                self._conn.disconnect()
+            raise
         finally:
             del self.conn
+            self.release_buffers()
+
+    def send_chunks(self, chunks):
+        """
+        :param chunks: iterable of bytes-like objects, sent after the packed part as they are produced;
+                       their memory is the producer's, a RingBuffer reserves its slots from the budget
+        :return: response_body, total_response_size
+
+        the chunks must add up to the size announced in the header
+        """
+        self.check_deadline()
+        expected = self.header.req_pkg_len - (len(self.buf) - self.header.resp_header_len())
+        try:
+            self.send_request()
+            sent = 0
+            for chunk in chunks:
+                if self.send_checksum is not None:
+                    self.send_checksum.update(chunk)
+                self.conn.send(chunk)
+                sent += len(chunk)
+            if sent != expected:
+                raise Exception("Error: %d bytes sent, %d announced" % (sent, expected))
+            return self._recv_response()
+        except ServerError:
+            raise
+        except Exception:
+            if self._conn:
+                self._conn.disconnect()
+            raise
+        finally:
+            del self.conn
+
+    def _recv_response(self):
+        self._recv_header()
+        return self._recv_body(pooled=False), self.header.resp_pkg_len
+
+    def _borrow(self, size):
+        """
+        :return: slab of at least size bytes, from the buffer pool when there is one, released with the command
+        """
+        if self.buffers is None or not self.buffers.pooled(size):
+            return bytearray(size)
+        slab = self.buffers.acquire(size)
+        self._slabs.append(slab)
+        return slab
+
+    def _recv_header(self):
+        """
+        read the response header into self.header, raise ServerError on a non zero status once its body is drained
+        """
+        self.header.unpack_resp(self.conn.recv(self.header.resp_header_len()))
+        if self.header.status != 0:
+            self.conn.discard(self.header.resp_pkg_len)
+            raise ServerError(self.header.status)
+
+    def _recv_body(self, pooled):
+        """
+        :param pooled: read the body into a pooled slab, released by release_buffers
+        """
+        size = self.header.resp_pkg_len
+        reserved = self._reserve(size)
+        try:
+            if not pooled or self.buffers is None or not self.buffers.pooled(size):
+                return self.conn.recv(size, checksum=self.recv_checksum)
+            view = memoryview(self._borrow(size))[:size]
+            self.conn.recv_into(view, checksum=self.recv_checksum)
+            return view
+        finally:
+            self._give_back(reserved)
 
     @staticmethod
     def unpack(fmt, resp):
         return struct.unpack(fmt, resp)
 
     def fetch_by_fmt(self, fmt):
-        resp, resp_size = self.execute()
-        return self.unpack(fmt, resp)
+        with self.response() as (resp, resp_size):
+            return self.unpack(fmt, resp)
 
     def fetch_list(self, item_cls):
-        resp, resp_size = self.execute()
-        ret_list = []
-        idx = 0
-        item = item_cls()
-        fmt_size = item.get_fmt_size()
-        while resp_size > 0:
-            item.set_info(resp[idx * fmt_size:(idx + 1) * fmt_size])
-            ret_list.append(item)
+        with self.response() as (resp, resp_size):
+            resp = memoryview(resp)
+            ret_list = []
+            idx = 0
             item = item_cls()
-            resp_size -= fmt_size
-            idx += 1
-        return ret_list
+            fmt_size = item.get_fmt_size()
+            while resp_size > 0:
+                item.set_info(resp[idx * fmt_size:(idx + 1) * fmt_size])
+                ret_list.append(item)
+                item = item_cls()
+                resp_size -= fmt_size
+                idx += 1
+            return ret_list
 
     def fetch_one(self, item_cls):
-        resp, resp_size = self.execute()
-        ret = item_cls()
-        ret.set_info(resp)
-        return ret
+        with self.response() as (resp, resp_size):
+            ret = item_cls()
+            ret.set_info(resp)
+            return ret
+
+
+class ResponseStream(object):
+    """
+    Response body read from the connection as it is consumed, chunk_size bytes
+    at a time, so memory stays bounded whatever the body size. Iterable, and
+    file-like enough (read, close) for wsgi.file_wrapper.
+    """
+    description_format = "ResponseStream<length=%(length)d,remaining=%(remaining)d>"
+
+    def __init__(self, cmd, length, chunk_size=64 * 1024):
+        self.cmd = cmd
+        self.length = length
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.checksum = cmd.recv_checksum
+        if not length:
+            self.close()
+
+    def __repr__(self):
+        return self.description_format % {"length": self.length, "remaining": self.remaining}
+
+    def __iter__(self):
+        while self.remaining > 0:
+            yield self.read(self.chunk_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, size=-1):
+        """
+        :param size: bytes to read at most, -1 for the whole remaining body
+        :return: bytes or bytearray, empty once the body is consumed
+        """
+        if self.cmd is None or self.remaining <= 0:
+            return b""
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        cmd = self.cmd
+        # over the budget: the stream is left as it is, the read can be retried
+        reserved = cmd._reserve(size)
+        try:
+            chunk = cmd.conn.recv(size, checksum=cmd.recv_checksum)
+        except Exception:
+            self._release(failed=True)
+            raise
+        finally:
+            cmd._give_back(reserved)
+        self.remaining -= size
+        if self.remaining <= 0:
+            self.close()
+        return chunk
+
+    def readinto(self, view):
+        """
+        :param view: writable memoryview, filled with the next bytes of the body
+        :return: bytes read, len(view) unless the body ends first, 0 once it is consumed
+        """
+        if self.cmd is None or self.remaining <= 0:
+            return 0
+        size = min(len(view), self.remaining)
+        try:
+            self.cmd.conn.recv_into(view[:size], checksum=self.cmd.recv_checksum)
+        except Exception:
+            self._release(failed=True)
+            raise
+        self.remaining -= size
+        if self.remaining <= 0:
+            self.close()
+        return size
+
+    def close(self):
+        """
+        give the connection back; one closed before the end of the body is disconnected,
+        without counting as a failure of the server
+        """
+        self._release(failed=False)
+
+    def _release(self, failed):
+        cmd, self.cmd = self.cmd, None
+        if cmd is None or cmd._conn is None:
+            return
+        conn = cmd._conn
+        cmd._conn = None
+        if self.remaining > 0:
+            conn.disconnect()
+            cmd.pool.release(conn, ok=not failed)
+        else:
+            cmd.pool.release(conn)
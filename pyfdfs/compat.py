@@ -0,0 +1,43 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import sys
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+    text_type = str
+    integer_types = (int,)
+else:
+    text_type = unicode
+    integer_types = (int, long)
+
+
+def to_bytes(value, encoding="utf-8"):
+    """
+    text -> bytes, bytes-like objects are returned untouched
+    """
+    if isinstance(value, text_type):
+        return value.encode(encoding)
+    return value
+
+
+def to_str(value, encoding="utf-8"):
+    """
+    bytes -> native str, only used on small fields (names, meta data), never on file content
+    """
+    if PY3 and isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode(encoding)
+    if not PY3 and isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return value
+
+
+def buffer_size(file_buffer):
+    """
+    :return: size in bytes of a str, bytes, bytearray or memoryview
+    """
+    view = memoryview(file_buffer)
+    return view.itemsize * len(view) if view.ndim == 1 else view.nbytes
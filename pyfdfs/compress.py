@@ -0,0 +1,353 @@
+# coding=utf-8
+"""
+Transparent compression of uploads.
+
+A client given a Compressor compresses the buffers it uploads when it pays:
+buffers below min_size, above max_size, with an already compressed ext
+(jpg, zip, ...), or whose leading sample_size bytes do not shrink below
+max_ratio are uploaded as is. A compressed file carries its codec and
+original size in its meta data (META_CODEC, META_SIZE), which the client
+reads back to decompress downloads, streams included. The codec of a file id
+never changes: the compressor remembers the last codec_cache_size it saw, and
+files whose ext it never compresses are not asked for theirs.
+
+zlib is always there, lzma on python 3, zstd with the zstandard package;
+register_codec adds others.
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import zlib
+import threading
+from collections import OrderedDict
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pyfdfs.compat import PY3, buffer_size
+
+META_CODEC = "pyfdfs-codec"
+META_SIZE = "pyfdfs-size"
+
+INCOMPRESSIBLE_EXTS = frozenset([
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif",
+    "mp3", "aac", "ogg", "flac", "mp4", "m4a", "m4v", "mkv", "mov", "avi", "webm",
+    "gz", "tgz", "bz2", "xz", "lz4", "lzma", "zst", "zip", "rar", "7z", "jar", "apk", "docx", "xlsx", "pptx",
+])
+
+
+class Codec(object):
+    name = None
+
+    def __repr__(self):
+        return "%s<%s>" % (self.__class__.__name__, self.name)
+
+    def compress(self, data):
+        raise NotImplementedError()
+
+    def decompressobj(self):
+        """
+        :return: object whose decompress(chunk) returns the bytes decompressed so far
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        decompressor = self.decompressobj()
+        out = decompressor.decompress(data)
+        flush = getattr(decompressor, "flush", None)
+        return out + flush() if flush is not None else out
+
+    def decompress_some(self, decompressor, data, max_length):
+        """
+        :param decompressor: returned by decompressobj
+        :param data: compressed bytes
+        :param max_length: decompressed bytes returned at most, when the codec can bound them
+        :return: (decompressed bytes, compressed bytes left over, True if the decompressor holds more output)
+        """
+        return decompressor.decompress(data), b"", False
+
+
+def _as_input(data):
+    """
+    python 2 codecs do not take memoryview
+    """
+    if not PY3 and isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(_as_input(data), self.level)
+
+    def decompressobj(self):
+        return zlib.decompressobj()
+
+    def decompress_some(self, decompressor, data, max_length):
+        out = decompressor.decompress(data, max_length)
+        return out, decompressor.unconsumed_tail, False
+
+
+class LzmaCodec(Codec):
+    name = "lzma"
+
+    def __init__(self, preset=6):
+        if lzma is None:
+            raise Exception("Error: lzma needs python 3")
+        self.preset = preset
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.preset)
+
+    def decompressobj(self):
+        return lzma.LZMADecompressor()
+
+    def decompress_some(self, decompressor, data, max_length):
+        out = decompressor.decompress(data, max_length)
+        return out, b"", not decompressor.needs_input and not decompressor.eof
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+
+    def __init__(self, level=3):
+        if zstandard is None:
+            raise Exception("Error: zstd needs the zstandard package")
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(_as_input(data))
+
+    def decompressobj(self):
+        # no output bound: zstandard decompressobj has no max_length
+        return zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """
+    :param codec: Codec, decompresses the files whose META_CODEC is codec.name
+    """
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    :return: Codec registered under name
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        raise Exception("Error: unknown codec %s" % name)
+    return codec
+
+
+register_codec(ZlibCodec())
+if lzma is not None:
+    register_codec(LzmaCodec())
+if zstandard is not None:
+    register_codec(ZstdCodec())
+
+
+# codec of a file id not remembered
+UNKNOWN = object()
+
+
+class Compressor(object):
+    description_format = "Compressor<codec=%(codec)s,min_size=%(min_size)d,max_ratio=%(max_ratio).2f>"
+
+    def __init__(self, codec=None, min_size=4096, max_size=64 << 20, sample_size=64 * 1024, max_ratio=0.9,
+                 skip_exts=INCOMPRESSIBLE_EXTS, codec_cache_size=10000):
+        """
+        :param codec: Codec of the uploads, ZlibCodec() if null, registered for downloads
+        :param min_size: smaller buffers are uploaded as is
+        :param max_size: larger buffers are uploaded as is, so files are not read in memory
+        :param sample_size: bytes compressed first to estimate the ratio
+        :param max_ratio: compressed size / size above which the data is uploaded as is
+        :param skip_exts: exts of already compressed formats, never compressed
+        :param codec_cache_size: codecs of file ids remembered, saving a get_meta per download
+        """
+        self.codec = codec or ZlibCodec()
+        register_codec(self.codec)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+        self.skip_exts = skip_exts
+        self.codec_cache_size = codec_cache_size
+        self._codecs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {"codec": self.codec.name, "min_size": self.min_size,
+                                          "max_ratio": self.max_ratio}
+
+    def wants(self, size, ext):
+        """
+        :param ext: file ext name, double ext like tar.gz included (see Storage.get_ext)
+        :return: True if data of this size and ext is worth trying to compress
+        """
+        if size < self.min_size or size > self.max_size:
+            return False
+        return (ext or "").lower().rsplit(".", 1)[-1] not in self.skip_exts
+
+    def may_be_compressed(self, file_name):
+        """
+        :return: False for a file whose ext is never compressed, its codec need not be asked for
+        """
+        base_name = file_name.rsplit("/", 1)[-1]
+        return "." not in base_name or base_name.rsplit(".", 1)[-1].lower() not in self.skip_exts
+
+    def recall(self, file_id):
+        """
+        :param file_id: group_name/file_name
+        :return: (Codec, original size) or None as remembered, UNKNOWN if not remembered
+        """
+        with self._lock:
+            codec = self._codecs.pop(file_id, UNKNOWN)
+            if codec is not UNKNOWN:
+                self._codecs[file_id] = codec
+            return codec
+
+    def remember(self, file_id, codec):
+        """
+        :param codec: (Codec, original size) of the file, None when stored as is
+        """
+        if not self.codec_cache_size:
+            return
+        with self._lock:
+            self._codecs.pop(file_id, None)
+            self._codecs[file_id] = codec
+            while len(self._codecs) > self.codec_cache_size:
+                self._codecs.popitem(last=False)
+
+    def forget(self, file_id):
+        with self._lock:
+            self._codecs.pop(file_id, None)
+
+    def compress(self, file_buffer, ext):
+        """
+        :return: (compressed bytes, meta data to store with them), None to upload file_buffer as is
+        """
+        size = buffer_size(file_buffer)
+        if not self.wants(size, ext):
+            return None
+        view = memoryview(file_buffer)
+        if size > self.sample_size:
+            sample = self.codec.compress(view[:self.sample_size])
+            if len(sample) > self.sample_size * self.max_ratio:
+                return None
+        compressed = self.codec.compress(view)
+        if len(compressed) > size * self.max_ratio:
+            return None
+        return compressed, {META_CODEC: self.codec.name, META_SIZE: size}
+
+
+def codec_of(meta_data):
+    """
+    :return: (Codec, original size) of a compressed file, None for a file stored as is
+    """
+    name = meta_data.get(META_CODEC) if meta_data else None
+    if not name:
+        return None
+    return get_codec(name), int(meta_data[META_SIZE])
+
+
+class DecompressingStream(object):
+    """
+    Decompressed content of a ResponseStream over a compressed file, from
+    offset for length bytes. Same interface as ResponseStream.
+    """
+    description_format = "DecompressingStream<codec=%(codec)s,length=%(length)d,remaining=%(remaining)d>"
+
+    def __init__(self, stream, codec, offset, length):
+        """
+        :param stream: ResponseStream over the whole compressed file
+        :param offset: decompressed bytes skipped
+        :param length: decompressed bytes returned
+        """
+        self.stream = stream
+        self.codec = codec
+        self.length = length
+        self.remaining = length
+        self.chunk_size = stream.chunk_size
+        self.checksum = stream.checksum
+        self._skip = offset
+        self._decompressor = codec.decompressobj()
+        self._pending = b""
+        # compressed bytes read but not decompressed yet, and whether the decompressor holds more output
+        self._input = b""
+        self._more = False
+
+    def __repr__(self):
+        return self.description_format % {"codec": self.codec.name, "length": self.length,
+                                          "remaining": self.remaining}
+
+    def __iter__(self):
+        while self.remaining > 0:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _fill(self):
+        """
+        decompress up to chunk_size more bytes into _pending, reading the next chunk of the stream
+        when needed, False at the end of the stream
+        """
+        if not self._input and not self._more:
+            self._input = self.stream.read(self.chunk_size)
+            if not self._input:
+                flush = getattr(self._decompressor, "flush", None)
+                self._add(flush() if flush is not None else b"")
+                return False
+        out, self._input, self._more = self.codec.decompress_some(self._decompressor, _as_input(self._input),
+                                                                  self.chunk_size)
+        self._add(out)
+        return True
+
+    def _add(self, out):
+        if self._skip:
+            skipped = min(self._skip, len(out))
+            out = out[skipped:]
+            self._skip -= skipped
+        self._pending += out
+
+    def read(self, size=-1):
+        """
+        :param size: bytes to read at most, -1 for the whole remaining content
+        :return: bytes, empty once the content is consumed
+        """
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        while len(self._pending) < size and self._fill():
+            pass
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        self.remaining -= len(chunk)
+        if self.remaining <= 0 or not chunk:
+            self.close()
+        return chunk
+
+    def close(self):
+        self._pending = self._input = b""
+        self._more = False
+        self.stream.close()
@@ -1,14 +1,74 @@
 # coding=utf-8
+"""
+Concurrency model
+
+* A ConnectionPool can be shared by any number of threads: it hands every
+  Connection to at most one thread at a time, and the thread gives it back
+  with release() once its command is done.
+* ThreadAffinityConnectionPool additionally pins one connection to each
+  thread, so a thread keeps talking over the same socket.
+* A pool notices a fork on its next use (_check_pid) and starts over empty in
+  the child; the inherited sockets are closed on the child side only, so the
+  parent keeps its connections. Sockets are never shared across processes.
+
+Timeouts
+
+* connect_timeout bounds connection setup, read_timeout every single socket
+  read or write (an idle connection), both default to timeout.
+* a deadline (pyfdfs.deadline) bound to the calling thread cuts both to what
+  is left of it, so a whole call fails once its budget is spent.
+
+Throttling
+
+* a connection given a scheduler (pyfdfs.throttle) paces its reads and writes
+  through the token buckets of its endpoint and group.
+* a pool given a wait_timeout lets callers wait for a connection once
+  max_conn are open, the waiters of the lowest priority class first.
+
+Circuit breaking
+
+* a pool given a breaker (pyfdfs.breaker) fails at once while it is open and
+  stops retrying a failed connect as soon as it opens.
+
+Buffers
+
+* a pool given a buffer_pool (pyfdfs.buffers) lends its slabs to the
+  commands and connections; they are handed to one thread at a time, like
+  the connections themselves.
+* recv_to_file moves a response body from the socket to a file with
+  os.splice through a pipe when available (linux, python 3.10+), the bytes
+  never reach user space; it falls back to recv_into and write.
+* a pool given a budget (pyfdfs.budget) makes its commands reserve the
+  payloads they send and the bodies they read in memory from it, callers
+  wait or fail once the bytes in flight reach its max_bytes.
+"""
 from __future__ import absolute_import, with_statement
 
 __author__ = 'mazesoul'
 
 import os
 import sys
+import errno
+import heapq
 import random
+import select
 import socket
 import threading
-from itertools import chain
+from itertools import chain, count
+
+try:
+    from os import splice
+    import fcntl
+except ImportError:
+    splice = None
+
+# fcntl.F_SETPIPE_SZ, python 3.10+ on linux
+F_SETPIPE_SZ = 1031
+
+from pyfdfs.compat import PY3, integer_types
+from pyfdfs.deadline import get_deadline, DeadlineExceeded
+from pyfdfs.throttle import get_priority
+from pyfdfs.breaker import STATE_CLOSED
 
 
 class Connection(object):
@@ -24,6 +84,14 @@ class Connection(object):
         self.remote_port = None
         self.sock = None
         self.timeout = conn_kwargs['timeout']
+        self.connect_timeout = conn_kwargs.get('connect_timeout') or self.timeout
+        self.read_timeout = conn_kwargs.get('read_timeout') or self.timeout
+        self.scheduler = conn_kwargs.get('scheduler')
+        self.group_name = conn_kwargs.get('group_name')
+        self.observer = conn_kwargs.get('observer')
+        self.buffer_pool = conn_kwargs.get('buffer_pool')
+        self._timeout_cut = False
+        self._buckets = None
 
     def __repr__(self):
         return self.description_format % {
@@ -41,12 +109,53 @@ class Connection(object):
         if self.sock:
             return
         self.remote_addr, self.remote_port = random.choice(self.hosts)
+        deadline = get_deadline()
+        connect_timeout = deadline.timeout(self.connect_timeout) if deadline else self.connect_timeout
         try:
-            sock = socket.create_connection((self.remote_addr, self.remote_port,), self.timeout)
+            sock = socket.create_connection((self.remote_addr, self.remote_port,), connect_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self.read_timeout)
         except socket.error:
             e = sys.exc_info()[1]
+            if deadline is not None and (isinstance(e, socket.timeout) and connect_timeout != self.connect_timeout or
+                                         deadline.remaining() <= 0):
+                raise DeadlineExceeded(self._error_message(e))
             raise Exception(self._error_message(e))
         self.sock = sock
+        self._timeout_cut = False
+        if self.scheduler is not None:
+            self._buckets = self.scheduler.buckets((self.remote_addr, self.remote_port), self.group_name)
+
+    def _set_timeout(self):
+        """
+        socket timeout of the next read or write: read_timeout, cut to the deadline of the thread
+        """
+        deadline = get_deadline()
+        if deadline is not None:
+            timeout = deadline.timeout(self.read_timeout)
+            self.sock.settimeout(timeout)
+            self._timeout_cut = timeout != self.read_timeout
+        elif self._timeout_cut:
+            self.sock.settimeout(self.read_timeout)
+            self._timeout_cut = False
+
+    def pace(self, nbytes):
+        """
+        wait until nbytes may be transferred, when throttled
+        """
+        if self._buckets:
+            self.scheduler.pace(self._buckets, nbytes)
+
+    def _io_error(self, action, exception):
+        """
+        :return: exception to raise for a failed socket read or write
+        """
+        message = 'Error: while %s socket: (%s)' % (action, exception.args,)
+        deadline = get_deadline()
+        if deadline is not None and (self._timeout_cut and isinstance(exception, socket.timeout) or
+                                     deadline.remaining() <= 0):
+            return DeadlineExceeded(message)
+        return Exception(message)
 
     def _error_message(self, exception):
         """
@@ -62,36 +171,259 @@ class Connection(object):
     def disconnect(self):
         """
         disconnects from the fast dfs server
+
+        a socket inherited through fork is only closed, never shut down, as
+        shutdown would also tear down the connection of the parent process
         """
         if self.sock is None:
             return
         try:
-            self.sock.shutdown(socket.SHUT_RDWR)
+            if self.pid == os.getpid():
+                self.sock.shutdown(socket.SHUT_RDWR)
             self.sock.close()
         except socket.error:
             pass
         self.sock = None
 
-    def recv(self, byte_size, buffer_size=4096):
+    def recv_into(self, view, buffer_size=65536, checksum=None):
+        """
+        :param view: writable memoryview, filled completely
+        :param checksum: Checksum updated with every received piece, see pyfdfs.checksum
+        """
+        if self.sock is None:
+            self.connect()
+        offset = 0
+        byte_size = len(view)
+        try:
+            while offset < byte_size:
+                self._set_timeout()
+                received = self.sock.recv_into(view[offset:], min(buffer_size, byte_size - offset))
+                if received == 0:
+                    raise socket.error('connection closed by %s:%s' % (self.remote_addr, self.remote_port))
+                if checksum is not None:
+                    checksum.update(view[offset:offset + received])
+                offset += received
+                if self._buckets:
+                    self.pace(received)
+        except (socket.error, socket.timeout) as e:
+            raise self._io_error("reading from", e)
+        return byte_size
+
+    def recv(self, byte_size, buffer_size=65536, checksum=None):
+        """
+        :param checksum: Checksum updated with the received bytes
+        :return: bytes or bytearray of exactly byte_size bytes
+        """
+        if byte_size == 0:
+            return b""
+        if byte_size <= buffer_size:
+            # small responses usually arrive in one piece, skip the preallocation
+            if self.sock is None:
+                self.connect()
+            self._set_timeout()
+            try:
+                resp = self.sock.recv(byte_size)
+            except (socket.error, socket.timeout) as e:
+                raise self._io_error("reading from", e)
+            if self._buckets:
+                self.pace(len(resp))
+            if checksum is not None:
+                checksum.update(resp)
+            if len(resp) == byte_size:
+                return resp
+            if not resp:
+                raise Exception('Error: while reading from socket: (connection closed by %s:%s)' %
+                                (self.remote_addr, self.remote_port))
+            recv_buff = bytearray(byte_size)
+            recv_buff[:len(resp)] = resp
+            self.recv_into(memoryview(recv_buff)[len(resp):], buffer_size, checksum)
+            return recv_buff
+        recv_buff = bytearray(byte_size)
+        self.recv_into(memoryview(recv_buff), buffer_size, checksum)
+        return recv_buff
+
+    def recv_to_file(self, fd, byte_size, checksum=None, use_splice=True, buffer_size=1 << 20):
+        """
+        :param fd: file descriptor, written from its current position
+        :param checksum: Checksum updated with the received bytes, read back from the file when spliced,
+                         fd must then be open for reading too
+        :param use_splice: move the bytes with os.splice when available
+        :return: byte_size
+        """
         if self.sock is None:
             self.connect()
-        recv_buff = []
+        received = 0
+        if use_splice and splice is not None:
+            received = self._splice_to_file(fd, byte_size, checksum, buffer_size)
+        if received < byte_size:
+            self._copy_to_file(fd, byte_size - received, checksum, buffer_size)
+        return byte_size
+
+    def _splice_to_file(self, fd, byte_size, checksum, buffer_size):
+        """
+        socket -> pipe -> fd with os.splice
+        :return: bytes moved, less than byte_size when the socket or the file can not be spliced,
+                 the rest is left in the socket
+        """
+        pipe_r, pipe_w = os.pipe()
+        try:
+            try:
+                fcntl.fcntl(pipe_w, F_SETPIPE_SZ, buffer_size)
+            except (IOError, OSError):
+                # above /proc/sys/fs/pipe-max-size, the default 64 KB pipe still works
+                pass
+            sock_fd = self.sock.fileno()
+            # throttled: pace every chunk, as send_file does
+            step = self.scheduler.chunk_size if self.scheduler is not None else byte_size
+            received = 0
+            while received < byte_size:
+                self._set_timeout()
+                try:
+                    size = splice(sock_fd, pipe_w, min(byte_size - received, step))
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        self._wait_readable()
+                        continue
+                    if received == 0 and e.errno in (errno.EINVAL, errno.ENOSYS):
+                        return 0
+                    raise self._io_error("reading from", e)
+                if size == 0:
+                    raise self._io_error("reading from", socket.error(
+                        'connection closed by %s:%s' % (self.remote_addr, self.remote_port)))
+                position = os.lseek(fd, 0, os.SEEK_CUR) if checksum is not None else None
+                self._drain_pipe(pipe_r, fd, size)
+                if checksum is not None:
+                    checksum.update(os.pread(fd, size, position))
+                received += size
+                if self._buckets:
+                    self.pace(size)
+            return received
+        finally:
+            os.close(pipe_r)
+            os.close(pipe_w)
+
+    @staticmethod
+    def _drain_pipe(pipe_r, fd, size):
+        """
+        pipe -> fd, with os.splice unless the file system of fd does not take it
+        """
+        while size > 0:
+            try:
+                moved = splice(pipe_r, fd, size)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                data = os.read(pipe_r, size)
+                moved = len(data)
+                while data:
+                    data = data[os.write(fd, data):]
+            size -= moved
+
+    def _wait_readable(self):
+        """
+        a socket with a timeout is non blocking underneath: wait for data as its recv would
+        """
+        timeout = self.sock.gettimeout()
+        try:
+            readable = select.select([self.sock], [], [], timeout)[0]
+        except (select.error, ValueError) as e:
+            raise self._io_error("reading from", e)
+        if not readable:
+            raise self._io_error("reading from", socket.timeout("timed out"))
+
+    def _copy_to_file(self, fd, byte_size, checksum, buffer_size):
+        """
+        socket -> buffer -> fd with recv_into and write
+        """
+        size = min(byte_size, buffer_size)
+        pool = self.buffer_pool if self.buffer_pool is not None and self.buffer_pool.pooled(size) else None
+        slab = pool.acquire(size) if pool is not None else bytearray(size)
         try:
+            view = memoryview(slab)
             while byte_size > 0:
-                resp = self.sock.recv(buffer_size if buffer_size <= byte_size else byte_size)
-                recv_buff.append(resp)
-                byte_size -= len(resp)
-        except (socket.error, socket.timeout), e:
-            raise Exception('Error: while reading from socket: (%s)' % e.args)
-        return ''.join(recv_buff)
+                chunk = min(byte_size, size)
+                self.recv_into(view[:chunk], checksum=checksum)
+                written = 0
+                while written < chunk:
+                    written += os.write(fd, view[written:chunk])
+                byte_size -= chunk
+        finally:
+            if pool is not None:
+                pool.release(slab)
+
+    def discard(self, byte_size, buffer_size=65536):
+        """
+        read and drop byte_size bytes, e.g. the body of an error response
+        """
+        if byte_size == 0:
+            return
+        size = min(byte_size, buffer_size)
+        pool = self.buffer_pool if self.buffer_pool is not None and self.buffer_pool.pooled(size) else None
+        slab = pool.acquire(size) if pool is not None else bytearray(size)
+        try:
+            view = memoryview(slab)
+            while byte_size > 0:
+                chunk = min(byte_size, size)
+                self.recv_into(view[:chunk])
+                byte_size -= chunk
+        finally:
+            if pool is not None:
+                pool.release(slab)
 
     def send(self, byte_stream):
         if self.sock is None:
             self.connect()
+        if self._buckets:
+            return self._send_paced([byte_stream])
+        self._set_timeout()
         try:
             self.sock.sendall(byte_stream)
-        except (socket.error, socket.timeout), e:
-            raise Exception('Error: while writing to socket: (%s)' % e.args)
+        except (socket.error, socket.timeout) as e:
+            raise self._io_error("writing to", e)
+
+    def sendv(self, byte_streams):
+        """
+        :param byte_streams: list of bytes, bytearray or memoryview, sent in order
+        function: gather write, a single sendmsg call when the platform has it
+        """
+        if self.sock is None:
+            self.connect()
+        if self._buckets:
+            return self._send_paced(byte_streams)
+        if not hasattr(self.sock, "sendmsg"):
+            for byte_stream in byte_streams:
+                self.send(byte_stream)
+            return
+        views = [memoryview(item).cast("B") for item in byte_streams if len(item)]
+        try:
+            while views:
+                self._set_timeout()
+                sent = self.sock.sendmsg(views)
+                while views and sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                if sent:
+                    views[0] = views[0][sent:]
+        except (socket.error, socket.timeout) as e:
+            raise self._io_error("writing to", e)
+
+    def _send_paced(self, byte_streams):
+        """
+        send in chunks of scheduler.chunk_size bytes, each one paced
+        """
+        chunk_size = self.scheduler.chunk_size
+        for byte_stream in byte_streams:
+            view = memoryview(byte_stream)
+            if PY3:
+                view = view.cast("B")
+            for offset in range(0, len(view), chunk_size):
+                chunk = view[offset:offset + chunk_size]
+                self.pace(len(chunk))
+                self._set_timeout()
+                try:
+                    self.sock.sendall(chunk)
+                except (socket.error, socket.timeout) as e:
+                    raise self._io_error("writing to", e)
 
     def get_fd(self):
         if self.sock is None:
@@ -99,31 +431,55 @@ class Connection(object):
         return self.sock.fileno()
 
 
+class _Waiter(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.woken = False
+        self.connection = None
+
+
 class ConnectionPool(object):
     """
     Generic connection pool
     """
     pid = os.getpid()
     max_conn = 2 ** 31
+    min_idle = 0
+    wait_timeout = None
+    breaker = None
     _created_connections = 0
     _available_connections = []
     _in_use_connections = set()
     check_lock = threading.Lock()
 
-    def __init__(self, conn_cls=Connection, max_conn=None, **connection_kwargs):
+    def __init__(self, conn_cls=Connection, max_conn=None, min_idle=None, wait_timeout=None, breaker=None,
+                 **connection_kwargs):
         if max_conn is not None:
-            if not isinstance(max_conn, (int, long)) or max_conn < 0:
+            if not isinstance(max_conn, integer_types) or max_conn < 0:
                 raise ValueError('"max_conn" must be a positive integer')
             self.max_conn = max_conn
+        if min_idle is not None:
+            if not isinstance(min_idle, integer_types) or min_idle < 0:
+                raise ValueError('"min_idle" must be a positive integer')
+            self.min_idle = min(min_idle, self.max_conn)
+        self.wait_timeout = wait_timeout
+        self.breaker = breaker
+        # BufferPool lent to the commands and connections, see pyfdfs.buffers
+        self.buffer_pool = connection_kwargs.get("buffer_pool")
+        # MemoryBudget the commands reserve their transfers from, see pyfdfs.budget
+        self.budget = connection_kwargs.get("budget")
         self.conn_cls = conn_cls
         self.connection_kwargs = connection_kwargs
         self.reset()
 
     def reset(self):
         self.pid = os.getpid()
+        self._lock = threading.Lock()
         self._created_connections = 0
         self._available_connections = []
         self._in_use_connections = set()
+        self._waiters = []
+        self._waiter_seq = count()
 
     def __repr__(self):
         return "%s<%s:%s>" % (
@@ -137,57 +493,236 @@ class ConnectionPool(object):
             with self.check_lock:
                 if self.pid == os.getpid():
                     return
-                self.destroy()
+                # self._lock was copied from the parent and may be held by
+                # a thread that does not exist here, never wait on it
+                for conn in self._all_connections():
+                    conn.disconnect()
+                self.reset()
+
+    def _all_connections(self):
+        return list(chain(self._available_connections, self._in_use_connections))
+
+    def _pop_connection(self):
+        """
+        take an idle connection, called with self._lock held
+        """
+        try:
+            return self._available_connections.pop()
+        except IndexError:
+            return None
+
+    def _push_connection(self, connection):
+        """
+        give back an idle connection, called with self._lock held
+        """
+        self._available_connections.append(connection)
 
     def get_connection(self):
         """
         get a connection from the pool
         """
         self._check_pid()
-        try:
-            connection = self._available_connections.pop()
-        except IndexError:
+        if self.breaker is not None:
+            self.breaker.check(self.connection_kwargs["hosts"])
+        with self._lock:
+            connection = self._pop_connection()
+            if connection is not None:
+                self._in_use_connections.add(connection)
+                return connection
+            if self.wait_timeout is None or self._created_connections < self.max_conn:
+                waiter = None
+            else:
+                waiter = self._add_waiter()
+        if waiter is None:
             connection = self.make_connection()
-        self._in_use_connections.add(connection)
+        else:
+            connection = self._wait(*waiter)
+            if connection is None:
+                # a connection was dropped, its slot was handed over
+                connection = self._new_connection()
+        with self._lock:
+            self._in_use_connections.add(connection)
         return connection
 
+    def _add_waiter(self):
+        """
+        queue a caller waiting for a connection, called with self._lock held
+        :return: waiter, timeout
+        """
+        timeout = self.wait_timeout
+        deadline = get_deadline()
+        if deadline is not None:
+            timeout = deadline.timeout(timeout)
+        entry = (get_priority(), next(self._waiter_seq), _Waiter())
+        heapq.heappush(self._waiters, entry)
+        return entry, timeout
+
+    def _wait(self, entry, timeout):
+        """
+        :return: connection released by another thread, None for a free slot
+        """
+        waiter = entry[2]
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.woken:
+                return waiter.connection
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        message = "Error: no connection available after %.3fs, %s open" % (timeout, self.max_conn)
+        deadline = get_deadline()
+        if deadline is not None and deadline.remaining() <= 0:
+            raise DeadlineExceeded(message)
+        raise Exception(message)
+
+    def _wake(self, connection):
+        """
+        hand a connection, or None for a free slot, to the first waiter, called with self._lock held
+        """
+        waiter = heapq.heappop(self._waiters)[2]
+        waiter.woken = True
+        waiter.connection = connection
+        if connection is not None:
+            self._in_use_connections.add(connection)
+        waiter.event.set()
+
+    def _release_slot(self):
+        """
+        a connection is gone, called with self._lock held
+        """
+        if self._waiters:
+            self._wake(None)
+        else:
+            self._created_connections -= 1
+
     def make_connection(self):
         """
         create a new connection
         """
-        if self._created_connections >= self.max_conn:
-            raise Exception("Too many connections")
+        with self._lock:
+            if self._created_connections >= self.max_conn:
+                raise Exception("Too many connections")
+            self._created_connections += 1
+        return self._new_connection()
+
+    def _new_connection(self):
+        """
+        connect a new connection, its slot is already counted in _created_connections
+        """
         conn_instance = None
         num_try = 10
         while 1:
             try:
-                if num_try <= 0:
-                    sys.exit()
                 conn_instance = self.conn_cls(**self.connection_kwargs)
                 conn_instance.connect()
-                self._created_connections += 1
                 break
+            except DeadlineExceeded:
+                with self._lock:
+                    self._release_slot()
+                raise
             except Exception as e:
                 print("%s %s retry:[%s]" % (self, e, num_try))
                 num_try -= 1
+                if self.breaker is not None:
+                    self.breaker.record(False)
+                    if self.breaker.state != STATE_CLOSED:
+                        num_try = 0
+                if num_try <= 0:
+                    with self._lock:
+                        self._release_slot()
+                    raise
         return conn_instance
 
-    def release(self, connection):
+    def warmup(self, min_idle=None):
+        """
+        :param min_idle: connections to have open, default self.min_idle
+        :return: number of connections opened
+        function: open connections ahead of the first commands, they are idle
+                  and shared by all threads, also with ThreadAffinityConnectionPool
+        """
+        self._check_pid()
+        min_idle = self.min_idle if min_idle is None else min_idle
+        opened = 0
+        while 1:
+            with self._lock:
+                if self._created_connections >= min_idle:
+                    return opened
+            connection = self.make_connection()
+            with self._lock:
+                ConnectionPool._push_connection(self, connection)
+            opened += 1
+
+    def is_warm(self):
+        """
+        :return: True once min_idle connections are open
+        """
+        self._check_pid()
+        return self._created_connections >= self.min_idle
+
+    def release(self, connection, ok=None):
         """
         release the connection back to the pool
+
+        :param ok: outcome for the breaker, by default whether the connection is still connected
         """
         self._check_pid()
         if connection.pid != self.pid:
             return
-        self._in_use_connections.remove(connection)
-        if connection.sock:
-            self._available_connections.append(connection)
+        with self._lock:
+            if connection not in self._in_use_connections:
+                return
+            self._in_use_connections.remove(connection)
+            if not connection.sock:
+                self._release_slot()
+            elif self._waiters:
+                self._wake(connection)
+            else:
+                self._push_connection(connection)
+        if self.breaker is not None:
+            # a connection is dropped on any network error
+            self.breaker.record(bool(connection.sock) if ok is None else ok)
 
     def destroy(self):
         """
         disconnects all connections in the pool
         """
-        all_conns = chain(self._available_connections, self._in_use_connections)
+        with self._lock:
+            all_conns = self._all_connections()
         for conn in all_conns:
             conn.disconnect()
         self.reset()
+
+
+class ThreadAffinityConnectionPool(ConnectionPool):
+    """
+    Connection pool pinning one connection to each thread
+
+    A thread releasing its connection keeps it for its next command instead of
+    putting it back in the shared list, so it keeps talking over the same
+    socket. Connections of threads that have exited are disconnected lazily.
+    """
+
+    def reset(self):
+        super(ThreadAffinityConnectionPool, self).reset()
+        self._affine_connections = {}
+
+    def _all_connections(self):
+        return super(ThreadAffinityConnectionPool, self)._all_connections() + \
+            list(self._affine_connections.values())
+
+    def _pop_connection(self):
+        connection = self._affine_connections.pop(threading.current_thread().ident, None)
+        if connection is not None:
+            return connection
+        return super(ThreadAffinityConnectionPool, self)._pop_connection()
+
+    def _push_connection(self, connection):
+        ident = threading.current_thread().ident
+        if ident in self._affine_connections:
+            super(ThreadAffinityConnectionPool, self)._push_connection(connection)
+            return
+        self._affine_connections[ident] = connection
+        if len(self._affine_connections) > threading.active_count():
+            alive = set(item.ident for item in threading.enumerate())
+            for dead_ident in [key for key in self._affine_connections if key not in alive]:
+                self._affine_connections.pop(dead_ident).disconnect()
+                self._release_slot()
@@ -0,0 +1,108 @@
+# coding=utf-8
+"""
+Streaming copy between storage servers.
+
+FdfsClient.copy_file pipes the download of a file into an upload on another
+storage server: a reader thread receives the download into the slots of a
+RingBuffer while the calling thread sends the filled slots, so both
+connections are busy at once and a copy holds at most slots * chunk_size
+bytes whatever the file size.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from pyfdfs.deadline import deadline, get_deadline
+
+
+class RingBuffer(object):
+    description_format = "RingBuffer<slots=%(slots)d,chunk_size=%(chunk_size)d>"
+
+    def __init__(self, stream, slots=8, chunk_size=256 * 1024, buffers=None, budget=None):
+        """
+        :param stream: ResponseStream read into the slots
+        :param slots: chunks buffered at most
+        :param chunk_size: bytes of a slot
+        :param buffers: BufferPool lending the slots, see pyfdfs.buffers
+        :param budget: MemoryBudget the slots are reserved from until close(), see pyfdfs.budget
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffers = buffers
+        self.budget = budget
+        self._reserved = 0
+        if budget is not None:
+            try:
+                self._reserved = budget.reserve(slots * chunk_size)
+            except Exception:
+                stream.close()
+                raise
+        self._slabs = [buffers.acquire(chunk_size) if buffers is not None else bytearray(chunk_size)
+                       for _ in range(slots)]
+        self._views = [memoryview(slab)[:chunk_size] for slab in self._slabs]
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for idx in range(slots):
+            self._free.put(idx)
+        self._closed = False
+        self._thread = threading.Thread(target=self._fill, name="pyfdfs-copy", args=(get_deadline(),))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return self.description_format % {"slots": len(self._views), "chunk_size": self.chunk_size}
+
+    def _fill(self, call_deadline):
+        """
+        reader thread, under the deadline of the thread that created the buffer
+        """
+        with deadline(call_deadline):
+            try:
+                while 1:
+                    idx = self._free.get()
+                    if self._closed:
+                        return
+                    size = self.stream.readinto(self._views[idx])
+                    if size == 0:
+                        self._filled.put(None)
+                        return
+                    self._filled.put((idx, size))
+            except Exception as e:
+                self._filled.put(e)
+
+    def __iter__(self):
+        """
+        :return: generator of memoryview over the filled slots, a slot is reused once the next one is asked for
+        """
+        while 1:
+            item = self._filled.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            idx, size = item
+            yield self._views[idx][:size]
+            self._free.put(idx)
+
+    def close(self):
+        """
+        stop the reader thread and give the download connection back
+        """
+        self._closed = True
+        self._free.put(-1)
+        self._thread.join()
+        self.stream.close()
+        if self.buffers is not None:
+            for slab in self._slabs:
+                self.buffers.release(slab)
+        self._slabs = self._views = []
+        reserved, self._reserved = self._reserved, 0
+        if reserved:
+            self.budget.release(reserved)
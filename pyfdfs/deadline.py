@@ -0,0 +1,94 @@
+# coding=utf-8
+"""
+End-to-end deadlines. A deadline is bound to the calling thread, every socket
+operation made by that thread (tracker query, storage request, connection
+setup) waits at most what is left of it:
+
+    with deadline(2.0):
+        client.upload_file_by_buffer(data, "jpg")
+
+Nested deadlines never extend the enclosing one.
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    description_format = "Deadline<remaining=%(remaining).3f>"
+
+    def __init__(self, seconds):
+        """
+        :param seconds: budget from now
+        """
+        self.seconds = seconds
+        self.expires_at = time.time() + seconds
+
+    def __repr__(self):
+        return self.description_format % {"remaining": self.remaining()}
+
+    def remaining(self):
+        """
+        :return: seconds left, negative once expired
+        """
+        return self.expires_at - time.time()
+
+    def check(self):
+        """
+        :return: seconds left, raise DeadlineExceeded once expired
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Error: deadline of %ss exceeded" % self.seconds)
+        return remaining
+
+    def timeout(self, timeout):
+        """
+        :param timeout: socket timeout otherwise used, None for no timeout
+        :return: timeout cut to what is left of the deadline
+        """
+        remaining = self.check()
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+_local = threading.local()
+
+
+def get_deadline():
+    """
+    :return: Deadline of the current thread, None when unbounded
+    """
+    return getattr(_local, "deadline", None)
+
+
+class deadline(object):
+    """
+    context manager binding a deadline to the current thread
+
+    :param seconds: budget in seconds, or a Deadline, e.g. to carry the
+                    deadline of a thread over to a worker thread; None does nothing
+    """
+
+    def __init__(self, seconds):
+        if seconds is None or isinstance(seconds, Deadline):
+            self.deadline = seconds
+        else:
+            self.deadline = Deadline(seconds)
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = get_deadline()
+        if self.deadline is not None and (self.previous is None or
+                                          self.deadline.expires_at < self.previous.expires_at):
+            _local.deadline = self.deadline
+        return get_deadline()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.deadline = self.previous
@@ -0,0 +1,131 @@
+# coding=utf-8
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def dedup_key(file_buffer, ext, algorithm="sha256"):
+    """
+    :param file_buffer: str, bytearray or memoryview, hashed in place without a copy
+    :param ext: file ext name, part of the key so the same bytes keep their ext
+    :param algorithm: any hashlib algorithm
+    :return: index key
+    """
+    digest = hashlib.new(algorithm)
+    digest.update(memoryview(file_buffer))
+    return "%s:%s.%s" % (algorithm, digest.hexdigest(), ext or "")
+
+
+class DedupIndex(object):
+    """
+    Maps a content key (see dedup_key) to the file id "group_name/file_name"
+    of the first upload of that content
+    """
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, file_id):
+        raise NotImplementedError()
+
+    def discard_file(self, file_id):
+        """
+        forget every key pointing to file_id, e.g. once the file is deleted
+        """
+        raise NotImplementedError()
+
+
+class MemoryDedupIndex(DedupIndex):
+    """
+    In-process LRU index, holding at most max_size keys
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get(self, key):
+        with self._lock:
+            file_id = self._keys.pop(key, None)
+            if file_id is not None:
+                self._keys[key] = file_id
+            return file_id
+
+    def set(self, key, file_id):
+        with self._lock:
+            # a key re-pointed to a new file, or a file under a new key: drop the stale mappings
+            old_file_id = self._keys.pop(key, None)
+            if old_file_id is not None and self._files.get(old_file_id) == key:
+                del self._files[old_file_id]
+            old_key = self._files.get(file_id)
+            if old_key is not None:
+                self._keys.pop(old_key, None)
+            self._keys[key] = file_id
+            self._files[file_id] = key
+            while len(self._keys) > self.max_size:
+                old_key, old_file_id = self._keys.popitem(last=False)
+                if self._files.get(old_file_id) == old_key:
+                    del self._files[old_file_id]
+
+    def discard_file(self, file_id):
+        with self._lock:
+            key = self._files.pop(file_id, None)
+            if key is not None:
+                self._keys.pop(key, None)
+
+
+class SqliteDedupIndex(DedupIndex):
+    """
+    Persistent index in a sqlite database, can be shared by several processes
+    """
+    schema = ("CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, file_id TEXT NOT NULL, created REAL)",
+              "CREATE INDEX IF NOT EXISTS dedup_file_id ON dedup (file_id)",)
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.pid = None
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _get_db(self):
+        """
+        sqlite connections cannot cross a fork, open one per process
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self._lock = threading.Lock()
+            self._db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                       isolation_level=None)
+            for statement in self.schema:
+                self._db.execute(statement)
+        return self._db
+
+    def get(self, key):
+        db = self._get_db()
+        with self._lock:
+            row = db.execute("SELECT file_id FROM dedup WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, file_id):
+        db = self._get_db()
+        with self._lock:
+            db.execute("INSERT OR REPLACE INTO dedup (key, file_id, created) VALUES (?, ?, ?)",
+                       (key, file_id, time.time()))
+
+    def discard_file(self, file_id):
+        db = self._get_db()
+        with self._lock:
+            db.execute("DELETE FROM dedup WHERE file_id = ?", (file_id,))
@@ -196,8 +196,8 @@ STORAGE_SET_METADATA_FLAG_OVERWRITE = 'O'
 # for replace, insert when the meta item not exist, otherwise update it
 STORAGE_SET_METADATA_FLAG_MERGE = 'M'
 
-FDFS_RECORD_SEPARATOR = '\x01'
-FDFS_FIELD_SEPARATOR = '\x02'
+FDFS_RECORD_SEPARATOR = b'\x01'
+FDFS_FIELD_SEPARATOR = b'\x02'
 
 FDFS_PROTO_PKG_LEN_SIZE = 8
 FDFS_PROTO_CMD_SIZE = 1
@@ -0,0 +1,261 @@
+# coding=utf-8
+"""
+Prometheus exporter of the cluster statistics kept by the tracker.
+
+    python -m pyfdfs.exporter -t 192.168.0.81:22122 --port 9400
+
+Every `interval` seconds list_groups / list_servers are asked over the pooled
+tracker connections. Each storage server counter (uploads, downloads,
+deletes, sync, file io... total and success, count and bytes) is exported
+as is, and as a per second rate computed from the delta between the last
+two heartbeats of the server, over their heartbeat times. Capacity, status,
+connection counts and heartbeat times are exported as gauges. The text page
+is built once per refresh, a scrape only sends the ready bytes.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import sys
+import time
+import argparse
+import threading
+
+from pyfdfs.structs import StorageInfo
+from pyfdfs.enums import FDFS_STORAGE_STATUS_ACTIVE
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+MB = 1024 * 1024
+
+
+def _counters():
+    """
+    :return: [(attribute, operation, kind, result)] of the StorageInfo counters,
+             e.g. ("success_upload_bytes", "upload", "bytes", "success")
+    """
+    counters = []
+    for attr in StorageInfo.attributes:
+        result, _, rest = attr.partition("_")
+        operation, _, kind = rest.rpartition("_")
+        if result in ("total", "success") and kind in ("count", "bytes"):
+            counters.append((attr, operation, kind, "all" if result == "total" else "success"))
+    return counters
+
+
+COUNTERS = _counters()
+
+TIMESTAMPS = ("join_time", "up_time", "last_source_update", "last_sync_update", "last_synced_timestamp",
+              "last_heart_beat_time")
+
+
+def _label_value(value):
+    return ("%s" % value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return "%d" % value
+
+
+class _Page(object):
+    """
+    metrics of one refresh, rendered in the prometheus text format
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.order = []
+
+    def add(self, name, metric_type, help_text, labels, value):
+        samples = self.metrics.get(name)
+        if samples is None:
+            samples = self.metrics[name] = ["# HELP %s %s" % (name, help_text), "# TYPE %s %s" % (name, metric_type)]
+            self.order.append(name)
+        samples.append("%s{%s} %s" % (name, labels, _format_value(value)) if labels else
+                       "%s %s" % (name, _format_value(value)))
+
+    def render(self):
+        return ("\n".join("\n".join(self.metrics[name]) for name in self.order) + "\n").encode("utf-8")
+
+
+class ClusterExporter(object):
+    description_format = "ClusterExporter<servers=%(servers)d,refreshed_at=%(refreshed_at)s>"
+
+    def __init__(self, tracker, interval=15):
+        """
+        :param tracker: Tracker, or FdfsClient, answering list_groups and list_servers
+        :param interval: seconds between two refreshes
+        """
+        self.tracker = tracker
+        self.interval = interval
+        self.refreshed_at = None
+        self.refresh_duration = 0
+        self.errors = 0
+        self.last_error = None
+        self.page = _Page().render()
+        self._previous = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return self.description_format % {"servers": len(self._previous), "refreshed_at": self.refreshed_at}
+
+    def start(self):
+        """
+        refresh in a background thread every interval seconds
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pyfdfs-exporter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Error: exporter refresh %s" % e)
+            self._stop_event.wait(self.interval)
+
+    def refresh(self):
+        """
+        ask the tracker for the cluster state and rebuild the page
+        """
+        started = time.time()
+        try:
+            groups = [(group, self.tracker.list_servers(group.group_name)) for group in self.tracker.list_groups()]
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self.last_error = e
+                self.page = self._build([], ok=False)
+            raise
+        with self._lock:
+            self.refresh_duration = time.time() - started
+            self.refreshed_at = started
+            self.last_error = None
+            self.page = self._build(groups, ok=True)
+
+    def _build(self, groups, ok):
+        """
+        :param groups: [(GroupInfo, [StorageInfo])]
+        :return: page bytes, the counters of the previous refresh are replaced by these ones
+        """
+        page = _Page()
+        previous = self._previous if ok else {}
+        current = {}
+        for group, servers in groups:
+            labels = 'group="%s"' % _label_value(group.group_name)
+            page.add("fdfs_group_total_bytes", "gauge", "group capacity", labels, group.get_raw("total_mb", 0) * MB)
+            page.add("fdfs_group_free_bytes", "gauge", "group free space", labels, group.get_raw("free_mb", 0) * MB)
+            page.add("fdfs_group_trunk_free_bytes", "gauge", "group free trunk space", labels,
+                     group.get_raw("trunk_free_mb", 0) * MB)
+            page.add("fdfs_group_storage_servers", "gauge", "storage servers of the group", labels, group.count)
+            page.add("fdfs_group_active_storage_servers", "gauge", "active storage servers of the group", labels,
+                     group.active_count)
+            for server in servers:
+                self._add_server(page, group.group_name, server, previous, current)
+        if ok:
+            self._previous = current
+        page.add("fdfs_exporter_up", "gauge", "1 if the last refresh succeeded", "", 1 if ok else 0)
+        page.add("fdfs_exporter_refresh_duration_seconds", "gauge", "duration of the last refresh", "",
+                 float(self.refresh_duration))
+        page.add("fdfs_exporter_last_refresh_timestamp_seconds", "gauge", "time of the last successful refresh", "",
+                 float(self.refreshed_at or 0))
+        page.add("fdfs_exporter_refresh_errors_total", "counter", "failed refreshes", "", self.errors)
+        return page.render()
+
+    def _add_server(self, page, group_name, server, previous, current):
+        key = (group_name, server.ip_addr, server.storage_port)
+        labels = 'group="%s",server="%s:%d"' % (_label_value(group_name), _label_value(server.ip_addr),
+                                                server.storage_port)
+        page.add("fdfs_storage_status", "gauge", "storage server status code", labels, server.status)
+        page.add("fdfs_storage_active", "gauge", "1 if the storage server is active", labels,
+                 1 if server.status == FDFS_STORAGE_STATUS_ACTIVE else 0)
+        page.add("fdfs_storage_total_bytes", "gauge", "storage server capacity", labels,
+                 server.get_raw("total_mb", 0) * MB)
+        page.add("fdfs_storage_free_bytes", "gauge", "storage server free space", labels,
+                 server.get_raw("free_mb", 0) * MB)
+        for state in ("alloc", "current", "max"):
+            page.add("fdfs_storage_connections", "gauge", "connections of the storage server",
+                     '%s,state="%s"' % (labels, state), server.get_raw("%s_count" % state, 0))
+        for attr in TIMESTAMPS:
+            page.add("fdfs_storage_%s_timestamp_seconds" % attr.replace("_timestamp", "").replace("_time", ""),
+                     "gauge", attr.replace("_", " "), labels, server.get_raw(attr, 0))
+        # the tracker gets the counters with the heartbeats: rates are taken between two heartbeats, and a
+        # refresh that sees no new heartbeat keeps the previous rates instead of dropping to 0
+        beat = server.get_raw("last_heart_beat_time", 0)
+        values = dict((attr, server.get_raw(attr, 0)) for attr, _, _, _ in COUNTERS)
+        last = previous.get(key)
+        if last is not None and beat == last[0]:
+            current[key] = last
+            rates = last[2]
+        else:
+            rates = None
+            if last is not None and beat > last[0]:
+                rates = {}
+                for attr, _, _, _ in COUNTERS:
+                    delta = values[attr] - last[1][attr]
+                    # a restarted server starts its counters over
+                    rates[attr] = (delta if delta >= 0 else values[attr]) / float(beat - last[0])
+            current[key] = (beat, values, rates)
+        for attr, operation, kind, result in COUNTERS:
+            name = "fdfs_storage_%s%s" % (operation, "_bytes" if kind == "bytes" else "")
+            result_labels = '%s,result="%s"' % (labels, result)
+            page.add(name + "_total", "counter", "%s %s of the storage server" % (operation, kind), result_labels,
+                     values[attr])
+            if rates is not None:
+                page.add(name + "_per_second", "gauge", "%s %s per second between heartbeats" % (operation, kind),
+                         result_labels, rates[attr])
+
+    def render(self):
+        """
+        :return: prometheus text page of the last refresh, bytes
+        """
+        return self.page
+
+    def __call__(self, environ, start_response):
+        """
+        WSGI application answering every path with the page
+        """
+        page = self.page
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE), ("Content-Length", "%d" % len(page))])
+        return [page]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyfdfs.exporter",
+                                     description="export fast dfs cluster statistics to prometheus")
+    parser.add_argument("-t", "--tracker", required=True, action="append",
+                        help="tracker host:port, can be repeated or comma separated")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=9400, help="port to listen on")
+    parser.add_argument("--interval", type=int, default=15, help="seconds between two refreshes")
+    parser.add_argument("--timeout", type=int, default=10, help="socket timeout in seconds")
+    args = parser.parse_args(argv)
+
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+    from pyfdfs.client import FdfsClient
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    host_list = [host for item in args.tracker for host in item.split(",") if host]
+    exporter = ClusterExporter(FdfsClient(host_list, timeout=args.timeout), interval=args.interval)
+    exporter.start()
+    make_server(args.host, args.port, exporter, handler_class=QuietHandler).serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# coding=utf-8
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import copy
+import time
+import heapq
+import random
+import socket
+import threading
+from collections import deque
+
+from pyfdfs.deadline import get_deadline, deadline
+
+
+class _AttemptPool(object):
+    """
+    Wraps the pool of a storage server for a single hedged attempt, to know
+    which connection the attempt is using and disconnect it when it loses
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        conn = self.pool.get_connection()
+        with self._lock:
+            if not self.cancelled:
+                self.conn = conn
+                return conn
+        self.pool.release(conn)
+        raise Exception("Error: hedged read cancelled")
+
+    def release(self, connection, ok=None):
+        with self._lock:
+            self.conn = None
+            if self.cancelled:
+                # cancel() may have shut the socket down after the command was done with it:
+                # never give it back to the pool as idle
+                connected = bool(connection.sock)
+                connection.disconnect()
+                if ok is None:
+                    ok = connected
+        self.pool.release(connection, ok)
+
+    def cancel(self):
+        """
+        abort the attempt: its socket is shut down, not closed, so the blocked
+        send/recv of the attempt fails right away and the connection is then
+        disconnected and dropped from the pool by the attempt itself
+        """
+        with self._lock:
+            self.cancelled = True
+            sock = self.conn.sock if self.conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class _Attempt(object):
+    def __init__(self, storage):
+        self.pool = _AttemptPool(storage.pool)
+        self.storage = copy.copy(storage)
+        self.storage.pool = self.pool
+        self.finished = threading.Event()
+        self.ok = False
+        self.result = None
+        self.error = None
+
+    def run(self, func):
+        try:
+            self.result = func(self.storage)
+            self.ok = True
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def cancel(self):
+        self.pool.cancel()
+
+
+class _Timer(object):
+    def __init__(self, deadline, func, args):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.state = "pending"
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+# guards the start of the scheduler thread, once per process
+_scheduler_lock = threading.Lock()
+
+
+class _Scheduler(object):
+    """
+    One thread firing the hedge timers, so a read that answers before its
+    hedge delay never pays for a thread
+    """
+
+    def __init__(self):
+        self.pid = None
+        self._timers = []
+        self._cond = None
+        self._thread = None
+
+    def _check_pid(self):
+        if self.pid == os.getpid():
+            return
+        with _scheduler_lock:
+            if self.pid != os.getpid():
+                self._timers = []
+                self._cond = threading.Condition(threading.Lock())
+                self._thread = threading.Thread(target=self._run, name="pyfdfs-hedge")
+                self._thread.daemon = True
+                self._thread.start()
+                # set last: a thread seeing the pid skips the lock and uses _cond at once
+                self.pid = os.getpid()
+
+    def schedule(self, delay, func, *args):
+        """
+        :return: timer, run func(*args) in a new thread after delay seconds unless cancelled
+        """
+        self._check_pid()
+        timer = _Timer(time.time() + delay, func, args)
+        with self._cond:
+            heapq.heappush(self._timers, timer)
+            self._cond.notify()
+        return timer
+
+    def cancel(self, timer):
+        """
+        :return: True if the timer was prevented from firing
+        """
+        with self._cond:
+            if timer.state != "pending":
+                return False
+            timer.state = "cancelled"
+            return True
+
+    def _run(self, _time=time.time, _heappop=heapq.heappop, _thread_cls=threading.Thread):
+        # module globals are bound as defaults: python 2 clears them while
+        # this daemon thread still runs at interpreter shutdown
+        while 1:
+            with self._cond:
+                while not self._timers or self._timers[0].deadline > _time():
+                    self._cond.wait(self._timers[0].deadline - _time() if self._timers else None)
+                timer = _heappop(self._timers)
+                if timer.state != "pending":
+                    continue
+                timer.state = "fired"
+            worker = _thread_cls(target=timer.func, args=timer.args, name="pyfdfs-hedge-attempt")
+            worker.daemon = True
+            worker.start()
+
+
+_scheduler = _Scheduler()
+
+
+class HedgePolicy(object):
+    """
+    Hedged reads: a read is sent to one replica, and if it has not answered
+    after the hedge delay the same read is sent to another replica. The first
+    answer wins, the connection of the other attempt is disconnected.
+
+    The delay is either fixed, or adaptive: the given percentile of the recent
+    read latencies, bounded by min_delay and max_delay.
+    """
+    description_format = "HedgePolicy<delay=%(delay)s,adaptive=%(adaptive)s,hedged=%(hedged)d/%(reads)d>"
+
+    def __init__(self, delay=0.05, adaptive=False, percentile=95, min_delay=0.001, max_delay=1.0,
+                 window=256, min_samples=20):
+        """
+        :param delay: seconds before hedging, used until enough latencies are known when adaptive
+        :param adaptive: derive the delay from the observed latencies
+        :param percentile: latency percentile used as adaptive delay
+        :param window: number of recent latencies kept
+        """
+        self.delay = delay
+        self.adaptive = adaptive
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.reads = 0
+        self.hedged = 0
+        self._latencies = deque(maxlen=window)
+        self._cached_delay = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {
+            "delay": self.get_delay(),
+            "adaptive": self.adaptive,
+            "hedged": self.hedged,
+            "reads": self.reads
+        }
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._cached_delay = None
+
+    def get_delay(self):
+        """
+        :return: seconds to wait before sending the hedged request
+        """
+        if not self.adaptive or len(self._latencies) < self.min_samples:
+            return self.delay
+        with self._lock:
+            if self._cached_delay is None:
+                latencies = sorted(self._latencies)
+                idx = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+                self._cached_delay = min(max(latencies[idx], self.min_delay), self.max_delay)
+            return self._cached_delay
+
+    def run(self, storages, func):
+        """
+        :param storages: Storage objects holding the file, the first one is tried first
+        :param func: func(storage) performing the read
+        :return: result of the first successful attempt
+        """
+        with self._lock:
+            self.reads += 1
+        if len(storages) < 2:
+            return func(storages[0])
+        started = time.time()
+        primary = _Attempt(storages[0])
+        backup = _Attempt(random.choice(storages[1:]))
+        winner = []
+        winner_lock = threading.Lock()
+        call_deadline = get_deadline()
+
+        def claim(attempt, loser):
+            with winner_lock:
+                if winner:
+                    return False
+                winner.append(attempt)
+            loser.cancel()
+            return True
+
+        def run_backup():
+            with self._lock:
+                self.hedged += 1
+            with deadline(call_deadline):
+                backup.run(func)
+            if backup.ok and claim(backup, primary):
+                self.record(time.time() - started)
+
+        timer = _scheduler.schedule(self.get_delay(), run_backup)
+        primary.run(func)
+        if primary.ok:
+            if _scheduler.cancel(timer) or claim(primary, backup):
+                self.record(time.time() - started)
+            return primary.result
+        if _scheduler.cancel(timer):
+            # failed before the hedge delay: fail over to the other replica right away
+            return func(backup.storage)
+        backup.finished.wait()
+        if backup.ok:
+            return backup.result
+        raise primary.error
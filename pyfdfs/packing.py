@@ -0,0 +1,321 @@
+# coding=utf-8
+"""
+Small objects packed into bundles.
+
+A storage server spends about as much on a 2 KB file as on a 2 MB one, and
+every upload asks the tracker first. A Packer gathers small objects into a
+bundle of bundle_size bytes, uploads it as one file, and gives each object a
+packed id naming its bytes in the bundle:
+
+    group1/M00/00/00/wKgAUVr0Ku6AQk9BAAAAAAAAAAA123.pak#4096+1024
+
+An object is read with a ranged download of the bundle, bundles are uploaded
+uncompressed even by a client with a compressor. The bundle ends with
+an index of its objects, so a bundle describes itself:
+
+    @ objects, one after the other
+    @ count * (8 bytes: offset, 4 bytes: length)
+    @ 4 bytes: count, 4 bytes: MAGIC
+
+Bundles are never rewritten in place. delete() only records a tombstone in
+the meta data of the bundle, its bytes stay until compact() copies the live
+objects of a bundle to a new one, deletes the old bundle and returns the new
+packed ids, for the caller to update the references it holds.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import re
+import time
+import struct
+import threading
+
+from pyfdfs.compat import buffer_size
+
+MAGIC = b"FPK1"
+
+INDEX_ENTRY = struct.Struct("!Q I")
+FOOTER = struct.Struct("!I 4s")
+
+PACKED_ID = re.compile(r"^([^/]+)/(.+)#(\d+)\+(\d+)$")
+
+# meta data name of the tombstone of the object at an offset, its value is the length
+TOMBSTONE = "deleted_%d"
+
+
+def packed_id(group_name, file_name, offset, length):
+    """
+    :return: packed id of the length bytes at offset of the bundle group_name/file_name
+    """
+    return "%s/%s#%d+%d" % (group_name, file_name, offset, length)
+
+
+def parse_packed_id(value):
+    """
+    :return: (group_name, file_name, offset, length)
+    raise ValueError when value is not a packed id
+    """
+    match = PACKED_ID.match(value)
+    if match is None:
+        raise ValueError("Error: %s is not a packed id" % value)
+    group_name, file_name, offset, length = match.groups()
+    return group_name, file_name, int(offset), int(length)
+
+
+def parse_index(bundle):
+    """
+    :param bundle: whole content of a bundle
+    :return: [(offset, length)] of its objects
+    """
+    if len(bundle) < FOOTER.size:
+        raise ValueError("Error: not a bundle, %d bytes" % len(bundle))
+    count, magic = FOOTER.unpack(bytes(bundle[-FOOTER.size:]))
+    start = len(bundle) - FOOTER.size - count * INDEX_ENTRY.size
+    if magic != MAGIC or start < 0:
+        raise ValueError("Error: not a bundle, bad footer")
+    return [INDEX_ENTRY.unpack(bytes(bundle[start + idx * INDEX_ENTRY.size:start + (idx + 1) * INDEX_ENTRY.size]))
+            for idx in range(count)]
+
+
+class PackedObject(object):
+    """
+    Object added to a Packer, its packed id is known once its bundle is uploaded.
+    """
+    description_format = "PackedObject<%(id)s>"
+
+    def __init__(self, offset, length):
+        """
+        :param offset: position of the object in its bundle
+        """
+        self.offset = offset
+        self.length = length
+        self.packed_id = None
+        self.error = None
+        self._event = threading.Event()
+
+    def __repr__(self):
+        return self.description_format % {"id": self.packed_id or "pending +%d" % self.length}
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: seconds to wait for the upload of the bundle, None to wait until done
+        :return: packed id, None if the bundle is still not uploaded
+        raise the error of the upload of the bundle
+        """
+        self._event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.packed_id
+
+    def _done(self, value, error=None):
+        self.packed_id = value
+        self.error = error
+        self._event.set()
+
+
+class _Bundle(object):
+    def __init__(self):
+        self.chunks = []
+        self.objects = []
+        self.size = 0
+        self.created_at = time.time()
+
+    def add(self, content):
+        obj = PackedObject(self.size, buffer_size(content))
+        self.chunks.append(content)
+        self.objects.append(obj)
+        self.size += obj.length
+        return obj
+
+    def content(self):
+        index = [INDEX_ENTRY.pack(obj.offset, obj.length) for obj in self.objects]
+        chunks = [chunk.tobytes() if isinstance(chunk, memoryview) else bytes(chunk) for chunk in self.chunks]
+        return b"".join(chunks + index +
+                        [FOOTER.pack(len(self.objects), MAGIC)])
+
+
+class Packer(object):
+    description_format = "Packer<bundle_size=%(bundle_size)d,pending=%(pending)d,bundles=%(bundles)d>"
+
+    def __init__(self, client, bundle_size=4 * 1024 * 1024, group_name=None, ext="pak", max_delay=None,
+                 max_object_size=None):
+        """
+        :param client: FdfsClient
+        :param bundle_size: bytes of objects after which a bundle is uploaded
+        :param group_name: group of the bundles, can be null
+        :param ext: file ext name of the bundles
+        :param max_delay: seconds an object may wait in an open bundle, a background thread uploads older
+                          bundles; None to upload a bundle only once full or on flush()
+        :param max_object_size: larger objects are uploaded as their own file, default bundle_size / 4
+        """
+        self.client = client
+        self.bundle_size = bundle_size
+        self.group_name = group_name
+        self.ext = ext
+        self.max_delay = max_delay
+        self.max_object_size = max_object_size or bundle_size // 4
+        self._bundle = _Bundle()
+        self._lock = threading.Lock()
+        # bundles uploaded, and objects uploaded as their own file
+        self.bundles = 0
+        self.unpacked = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+        if max_delay:
+            self._thread = threading.Thread(target=self._run, name="pyfdfs-packer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __repr__(self):
+        return self.description_format % {"bundle_size": self.bundle_size, "pending": len(self._bundle.objects),
+                                          "bundles": self.bundles}
+
+    def add(self, content):
+        """
+        :param content: bytes, bytearray or memoryview, kept until its bundle is uploaded
+        :return: PackedObject, wait() for its packed id
+        function: add an object to the open bundle, the bundle is uploaded by the call that fills it
+        """
+        if buffer_size(content) > self.max_object_size:
+            obj = PackedObject(0, buffer_size(content))
+            try:
+                sr = self.client.upload_file_by_buffer(content, self.ext, self.group_name)
+            except Exception as e:
+                obj._done(None, e)
+                raise
+            with self._lock:
+                self.unpacked += 1
+            obj._done("%s/%s" % (sr.group_name, sr.filename))
+            return obj
+        with self._lock:
+            obj = self._bundle.add(content)
+            full = self._bundle if self._bundle.size >= self.bundle_size else None
+            if full is not None:
+                self._bundle = _Bundle()
+        if full is not None:
+            self._upload(full)
+        return obj
+
+    def pack(self, contents):
+        """
+        :param contents: iterable of bytes-like objects
+        :return: [packed id], in the order of contents
+        function: add every object and upload them, the last bundle too
+        """
+        objects = [self.add(content) for content in contents]
+        self.flush()
+        return [obj.wait() for obj in objects]
+
+    def flush(self):
+        """
+        upload the open bundle, even if not full
+        """
+        with self._lock:
+            bundle, self._bundle = self._bundle, _Bundle()
+        if bundle.objects:
+            self._upload(bundle)
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _upload(self, bundle):
+        try:
+            sr = self.client.upload_file_by_buffer(bundle.content(), self.ext, self.group_name, compress=False)
+        except Exception as e:
+            for obj in bundle.objects:
+                obj._done(None, e)
+            raise
+        with self._lock:
+            self.bundles += 1
+        for obj in bundle.objects:
+            obj._done(packed_id(sr.group_name, sr.filename, obj.offset, obj.length))
+
+    def _run(self):
+        while not self._stop_event.wait(min(self.max_delay, 1.0)):
+            with self._lock:
+                bundle = self._bundle
+                if not bundle.objects or time.time() - bundle.created_at < self.max_delay:
+                    continue
+                self._bundle = _Bundle()
+            try:
+                self._upload(bundle)
+            except Exception as e:
+                print("Error: bundle upload failed, %s" % e)
+
+    def read(self, value):
+        """
+        :param value: packed id, or the file id of an object uploaded as its own file
+        :return: content of the object
+        """
+        if "#" not in value:
+            group_name, file_name = value.split("/", 1)
+            return self.client.download_to_buffer(group_name, file_name)
+        group_name, file_name, offset, length = parse_packed_id(value)
+        if length == 0:
+            return b""
+        self._stored_as_is(group_name, file_name)
+        return self.client.download_to_buffer(group_name, file_name, offset, length)
+
+    def _stored_as_is(self, group_name, file_name):
+        """
+        bundles are never compressed, so that objects are ranged reads: a compressor of the client
+        is told so, instead of asking the meta data of the bundle for its codec
+        """
+        compressor = getattr(self.client, "compressor", None)
+        if compressor is not None:
+            compressor.remember("%s/%s" % (group_name, file_name), None)
+
+    def delete(self, value):
+        """
+        :param value: packed id, or the file id of an object uploaded as its own file
+        function: tombstone the object in the meta data of its bundle, see compact()
+        """
+        if "#" not in value:
+            group_name, file_name = value.split("/", 1)
+            return self.client.delete_file(group_name, file_name)
+        group_name, file_name, offset, length = parse_packed_id(value)
+        self.client.set_meta(file_name, {TOMBSTONE % offset: "%d" % length}, group_name, overwrite=False)
+
+    def garbage(self, group_name, file_name):
+        """
+        :return: {offset: length} of the deleted objects of the bundle
+        """
+        prefix = TOMBSTONE.split("%")[0]
+        return dict((int(name[len(prefix):]), int(value))
+                    for name, value in self.client.get_meta(group_name, file_name).items()
+                    if name.startswith(prefix))
+
+    def compact(self, bundle_id, min_garbage=0.5):
+        """
+        :param bundle_id: group_name/file_name of a bundle
+        :param min_garbage: share of deleted bytes under which the bundle is left as it is
+        :return: {old packed id: new packed id} of the objects moved, empty when the bundle was left
+        function: copy the live objects of the bundle to a new bundle and delete the old one;
+                  a bundle of deleted objects only is just deleted
+        """
+        group_name, file_name = bundle_id.split("/", 1)
+        deleted = self.garbage(group_name, file_name)
+        if not deleted:
+            return {}
+        self._stored_as_is(group_name, file_name)
+        bundle = self.client.download_to_buffer(group_name, file_name)
+        index = parse_index(bundle)
+        total = sum(length for offset, length in index) or 1
+        if sum(deleted.values()) < min_garbage * total:
+            return {}
+        view = memoryview(bundle)
+        live = [(offset, length) for offset, length in index if offset not in deleted]
+        moved = {}
+        if live:
+            new = _Bundle()
+            objects = [new.add(view[offset:offset + length]) for offset, length in live]
+            self._upload(new)
+            for (offset, length), obj in zip(live, objects):
+                moved[packed_id(group_name, file_name, offset, length)] = obj.packed_id
+        self.client.delete_file(group_name, file_name)
+        return moved
@@ -0,0 +1,253 @@
+# coding=utf-8
+"""
+Group rebalancing: move files out of the fullest groups.
+
+    python -m pyfdfs.rebalance -t 192.168.0.81:22122 -i files.txt -m moves.jsonl --delete
+
+The tracker cannot list files, the candidates are read from --input: one
+file id "group/remote_file_name" per line, or a pyfdfs.bulk manifest. With
+the free space of every group from list_groups, a group whose free ratio is
+more than `tolerance` below the cluster one gives files to the group with
+the highest free ratio, until it is back at the cluster ratio. Each move is
+a FdfsClient.copy_file, run by a pool of threads at background priority,
+and appended to the manifest as a json line
+{"file_id": ..., "new_file_id": ..., "size": ...}; running the same command
+again skips the files already moved.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+
+from pyfdfs.client import FdfsClient
+from pyfdfs.throttle import TransferScheduler, priority, PRIORITY_BACKGROUND
+
+MB = 1024 * 1024
+
+
+def read_file_ids(path, done=None):
+    """
+    :param path: one file id per line, or json lines with "file_id" and optionally "size"
+    :param done: set of file ids to skip
+    :return: generator of (file_id, size or None)
+    """
+    done = done or set()
+    with open(path) as f_obj:
+        for line in f_obj:
+            line = line.strip()
+            if not line:
+                continue
+            size = None
+            if line.startswith("{"):
+                try:
+                    item = json.loads(line)
+                    line, size = item["file_id"], item.get("size")
+                except (ValueError, KeyError):
+                    continue
+            if line and line not in done:
+                yield line, size
+
+
+def load_manifest(manifest):
+    """
+    :return: set of the file ids already moved
+    """
+    done = set()
+    if not os.path.exists(manifest):
+        return done
+    with open(manifest) as f_obj:
+        for line in f_obj:
+            try:
+                done.add(json.loads(line)["file_id"])
+            except (ValueError, KeyError):
+                # torn last line of an interrupted run
+                continue
+    return done
+
+
+def plan_moves(groups, files, size_of, tolerance=0.05, max_bytes=None):
+    """
+    :param groups: List<GroupInfo>
+    :param files: iterable of (file_id, size or None)
+    :param size_of: size_of(file_id) for the files without a size, only asked for files of a group to drain
+    :param tolerance: free ratio below the cluster one tolerated before a group is drained
+    :param max_bytes: bytes moved at most, None for no limit
+    :return: generator of (file_id, size, target group name), consumed while files is read
+    """
+    total = dict((group.group_name, group.get_raw("total_mb", 0) * MB) for group in groups if group.get_raw("total_mb"))
+    free = dict((group.group_name, group.get_raw("free_mb", 0) * MB) for group in groups if group.group_name in total)
+    if len(total) < 2:
+        return
+    target_ratio = float(sum(free.values())) / sum(total.values())
+
+    def ratio(group_name):
+        return float(free[group_name]) / total[group_name]
+
+    moved = 0
+    for file_id, size in files:
+        group_name = file_id.split("/", 1)[0]
+        if group_name not in total or ratio(group_name) >= target_ratio - tolerance:
+            continue
+        if size is None:
+            size = size_of(file_id)
+        target = max((name for name in total if name != group_name), key=ratio)
+        if (free[target] - size) / float(total[target]) < target_ratio:
+            continue
+        if max_bytes is not None and moved + size > max_bytes:
+            return
+        free[group_name] += size
+        free[target] -= size
+        moved += size
+        yield file_id, size, target
+
+
+def _move(client, file_id, target, delete_source):
+    """
+    :return: new file id, or the error
+    """
+    group_name, file_name = file_id.split("/", 1)
+    try:
+        with priority(PRIORITY_BACKGROUND):
+            sr = client.copy_file(group_name, file_name, target, delete_source=delete_source)
+        return "%s/%s" % (sr.group_name, sr.filename), None
+    except Exception as e:
+        return None, "%s" % e
+
+
+class RebalanceStats(object):
+    description_format = "files=%(files)d bytes=%(bytes)d failed=%(failed)d rate=%(bytes_rate).2f MB/s"
+
+    def __init__(self):
+        self.started = time.time()
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+
+    def __str__(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return self.description_format % {
+            "files": self.files,
+            "bytes": self.bytes,
+            "failed": self.failed,
+            "bytes_rate": self.bytes / elapsed / MB,
+        }
+
+
+class Rebalancer(object):
+    """
+    Runs the moves of plan_moves over a pool of threads, at most
+    `workers * queue_factor` moves are planned ahead of the copies.
+    """
+
+    def __init__(self, client, manifest, workers=8, delete_source=False, tolerance=0.05, max_bytes=None,
+                 queue_factor=2, report_interval=10, out=sys.stderr):
+        self.client = client
+        self.manifest = manifest
+        self.workers = workers
+        self.delete_source = delete_source
+        self.tolerance = tolerance
+        self.max_bytes = max_bytes
+        self.queue_factor = queue_factor
+        self.report_interval = report_interval
+        self.out = out
+        self.stats = RebalanceStats()
+        self._lock = threading.Lock()
+
+    def report(self):
+        self.out.write("%s\n" % self.stats)
+        self.out.flush()
+
+    def _size_of(self, file_id):
+        group_name, file_name = file_id.split("/", 1)
+        return self.client.query_file_info(group_name, file_name).file_size
+
+    def run(self, input_path, dry_run=False):
+        """
+        :param input_path: candidate file ids, see read_file_ids
+        :param dry_run: only write the plan to out
+        :return: RebalanceStats
+        """
+        files = read_file_ids(input_path, load_manifest(self.manifest))
+        moves = plan_moves(self.client.list_groups(), files, self._size_of, self.tolerance, self.max_bytes)
+        if dry_run:
+            for file_id, size, target in moves:
+                self.out.write("%s %d -> %s\n" % (file_id, size, target))
+            return self.stats
+        slots = threading.BoundedSemaphore(self.workers * self.queue_factor)
+        pool = ThreadPool(self.workers)
+        last_report = time.time()
+        with open(self.manifest, "a") as manifest:
+            def on_result(file_id, size):
+                def record(result):
+                    try:
+                        self._record(manifest, file_id, size, *result)
+                    finally:
+                        slots.release()
+                return record
+
+            try:
+                for file_id, size, target in moves:
+                    slots.acquire()
+                    pool.apply_async(_move, (self.client, file_id, target, self.delete_source),
+                                     callback=on_result(file_id, size))
+                    if time.time() - last_report >= self.report_interval:
+                        self.report()
+                        last_report = time.time()
+                pool.close()
+                pool.join()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                manifest.flush()
+        self.report()
+        return self.stats
+
+    def _record(self, manifest, file_id, size, new_file_id, error):
+        with self._lock:
+            if error is not None:
+                self.stats.failed += 1
+                self.out.write("Error: %s %s\n" % (file_id, error))
+                return
+            self.stats.files += 1
+            self.stats.bytes += size
+            manifest.write("%s\n" % json.dumps({"file_id": file_id, "new_file_id": new_file_id, "size": size}))
+            manifest.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyfdfs.rebalance",
+                                     description="move files out of the fullest fast dfs groups")
+    parser.add_argument("-t", "--tracker", required=True, action="append",
+                        help="tracker host:port, can be repeated or comma separated")
+    parser.add_argument("-i", "--input", required=True, help="candidate file ids, one per line or a bulk manifest")
+    parser.add_argument("-m", "--manifest", required=True, help="resumable manifest of the moves, one json line each")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="parallel copies")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="free ratio gap tolerated between groups")
+    parser.add_argument("--max-gb", type=float, default=None, help="GB moved at most, default unlimited")
+    parser.add_argument("--delete", action="store_true", help="delete the files once copied")
+    parser.add_argument("--dry-run", action="store_true", help="print the planned moves only")
+    parser.add_argument("--timeout", type=int, default=60, help="socket timeout in seconds")
+    parser.add_argument("--rate", type=float, default=None, help="bandwidth limit in MB/s, default unlimited")
+    parser.add_argument("--report-interval", type=int, default=10, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    host_list = [host for item in args.tracker for host in item.split(",") if host]
+    client = FdfsClient(host_list, timeout=args.timeout,
+                        scheduler=TransferScheduler(args.rate * MB) if args.rate else None)
+    rebalancer = Rebalancer(client, args.manifest, workers=args.workers, delete_source=args.delete,
+                            tolerance=args.tolerance, max_bytes=int(args.max_gb * 1024 * MB) if args.max_gb else None,
+                            report_interval=args.report_interval)
+    stats = rebalancer.run(args.input, dry_run=args.dry_run)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
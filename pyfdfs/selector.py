@@ -0,0 +1,136 @@
+# coding=utf-8
+"""
+Adaptive replica selection for reads.
+
+Every storage command reports its latency (time to the response header) and,
+for large responses, its throughput to the ReplicaSelector of the client. The
+selector keeps an exponentially weighted moving average of both per storage
+server endpoint and sends each read to the replica with the lowest expected
+time, latency + size / throughput. With probability `explore` a random replica
+is used instead, so a replica that got slow and recovered gets traffic back.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import time
+import random
+import threading
+from collections import OrderedDict
+
+
+class EndpointStats(object):
+    description_format = "EndpointStats<latency=%(latency).4f,throughput=%(throughput).0f,samples=%(samples)d," \
+                         "failures=%(failures)d>"
+
+    def __init__(self):
+        self.latency = None
+        self.throughput = None
+        self.samples = 0
+        self.failures = 0
+
+    def __repr__(self):
+        return self.description_format % {
+            "latency": self.latency or 0,
+            "throughput": self.throughput or 0,
+            "samples": self.samples,
+            "failures": self.failures
+        }
+
+
+def _ewma(average, value, alpha):
+    return value if average is None else average + alpha * (value - average)
+
+
+class ReplicaSelector(object):
+    description_format = "ReplicaSelector<endpoints=%(endpoints)d,explore=%(explore)s>"
+
+    def __init__(self, alpha=0.2, explore=0.05, failure_penalty=1.0, min_transfer_size=64 * 1024,
+                 expected_size=256 * 1024, replicas_ttl=60, replicas_max_size=10000):
+        """
+        :param alpha: weight of a new sample in the moving averages
+        :param explore: probability of sending a read to a random replica
+        :param failure_penalty: seconds counted as latency for a failed command
+        :param min_transfer_size: responses from this many bytes update the throughput
+        :param expected_size: bytes assumed for a read when ranking the replicas
+        :param replicas_ttl: seconds the replicas of a file are cached
+        :param replicas_max_size: files whose replicas are cached at most
+        """
+        self.alpha = alpha
+        self.explore = explore
+        self.failure_penalty = failure_penalty
+        self.min_transfer_size = min_transfer_size
+        self.expected_size = expected_size
+        self.replicas_ttl = replicas_ttl
+        self.replicas_max_size = replicas_max_size
+        self.endpoints = {}
+        self._replicas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {"endpoints": len(self.endpoints), "explore": self.explore}
+
+    def record(self, endpoint, latency, transfer_time=0, nbytes=0, ok=True):
+        """
+        :param endpoint: (ip, port) of the storage server
+        :param latency: seconds until the response header was received
+        :param transfer_time: seconds spent receiving the response body
+        :param nbytes: bytes of the response body
+        :param ok: False when the command failed
+        """
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.samples += 1
+            if not ok:
+                stats.failures += 1
+                latency = max(latency, self.failure_penalty)
+            stats.latency = _ewma(stats.latency, latency, self.alpha)
+            if ok and nbytes >= self.min_transfer_size and transfer_time > 0:
+                stats.throughput = _ewma(stats.throughput, nbytes / transfer_time, self.alpha)
+
+    def expected_time(self, endpoint, nbytes=None):
+        """
+        :return: expected seconds to read nbytes from endpoint, 0 for an endpoint never used
+        """
+        stats = self.endpoints.get(endpoint)
+        if stats is None or stats.latency is None:
+            return 0
+        nbytes = self.expected_size if nbytes is None else nbytes
+        return stats.latency + (nbytes / stats.throughput if stats.throughput else 0)
+
+    def rank(self, storage_infos, nbytes=None):
+        """
+        :param storage_infos: List<BasicStorageInfo> of the replicas
+        :return: the same list, best replica first
+        """
+        ranked = sorted(storage_infos, key=lambda si: self.expected_time((si.ip_addr, si.storage_port), nbytes))
+        if len(ranked) > 1 and random.random() < self.explore:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def replicas(self, tracker, group_name, file_name):
+        """
+        :return: List<BasicStorageInfo>, query_fetch_all of the tracker, cached for replicas_ttl seconds
+        """
+        key = (group_name, file_name)
+        now = time.time()
+        with self._lock:
+            cached = self._replicas.pop(key, None)
+            if cached is not None and cached[0] > now:
+                self._replicas[key] = cached
+                return cached[1]
+        storage_infos = tracker.query_fetch_all(group_name, file_name)
+        with self._lock:
+            self._replicas[key] = (now + self.replicas_ttl, storage_infos)
+            while len(self._replicas) > self.replicas_max_size:
+                self._replicas.popitem(last=False)
+        return storage_infos
+
+    def discard(self, group_name, file_name):
+        """
+        forget the cached replicas of a file, e.g. once it is deleted
+        """
+        with self._lock:
+            self._replicas.pop((group_name, file_name), None)
@@ -0,0 +1,97 @@
+# coding=utf-8
+"""
+Request coalescing. Concurrent calls with the same key share one execution:
+the first caller runs it, the others wait for its result (or its error)
+instead of taking a connection of their own each. A shared bytearray result
+is turned once into bytes, so every caller gets the same read-only buffer;
+every caller gets its own copy of a dict or list result, e.g. of get_meta.
+
+Followers wait at most until the deadline of their thread, see pyfdfs.deadline.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import threading
+
+from pyfdfs.deadline import get_deadline, DeadlineExceeded
+
+
+def _private(result):
+    """
+    :return: a copy of a mutable dict or list result, the result itself otherwise
+    """
+    if isinstance(result, dict):
+        return dict(result)
+    if isinstance(result, list):
+        return list(result)
+    return result
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+        self.finished = False
+
+
+class SingleFlight(object):
+    description_format = "SingleFlight<in_flight=%(in_flight)d,shared=%(shared)d>"
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        # calls answered from the execution of another caller
+        self.shared = 0
+
+    def __repr__(self):
+        return self.description_format % {"in_flight": len(self._calls), "shared": self.shared}
+
+    def do(self, key, func):
+        """
+        :param key: hashable identifying the call, e.g. (command, group name, file name)
+        :param func: func() running the call
+        :return: result of func, run by this caller or by a concurrent one with the same key
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.followers += 1
+                self.shared += 1
+                leader = False
+        if not leader:
+            return self._wait(call)
+        result = None
+        try:
+            result = func()
+            call.finished = True
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followers = call.followers
+            if followers and isinstance(result, bytearray):
+                result = bytes(result)
+            # followers copy this one, whatever the leader does with its result
+            call.result = _private(result)
+            call.done.set()
+        return result
+
+    @staticmethod
+    def _wait(call):
+        deadline = get_deadline()
+        if not call.done.wait(deadline.check() if deadline is not None else None):
+            raise DeadlineExceeded("Error: deadline of %ss exceeded waiting for a shared call" % deadline.seconds)
+        if call.error is not None:
+            raise call.error
+        if not call.finished:
+            # the leader was interrupted, e.g. KeyboardInterrupt
+            raise Exception("Error: shared call interrupted")
+        return _private(call.result)
@@ -0,0 +1,461 @@
+# coding=utf-8
+"""
+Write-behind upload spool.
+
+UploadSpool.upload_file_by_buffer appends the content to a local journal and
+returns a handle at once, without a network round-trip; worker threads then
+upload the journal to the cluster, a batch at a time, retrying failed uploads
+with a growing delay, during which the workers go on with the other records.
+The file id of a handle is given to the callback and by result(). The
+journal is made of segment files:
+
+    spool-00000001.log   records, appended: header, meta data (json), content
+    spool-00000001.done  one line per record uploaded: handle group_name/file_name,
+                         or handle !error when it was given up
+
+A record is durable once upload_file_by_buffer returns (fsync unless sync is
+off) and uploaded at least once: a spool opened again on the same directory
+uploads the records of the previous process that have no done line, and a
+torn record at the end of a segment, from a crash in the middle of a write,
+is cut off. A write failing in the process, e.g. on a full disk, is cut off
+before upload_file_by_buffer raises. A segment and its done file are removed once every record of it
+is done and a newer segment is being written; result() of handles in removed
+segments are only kept in memory, by the process that uploaded them.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import io
+import os
+import re
+import time
+import uuid
+import json
+import heapq
+import struct
+import binascii
+import threading
+from itertools import count
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from pyfdfs.checksum import Checksum
+from pyfdfs.compat import to_bytes, to_str, buffer_size
+from pyfdfs.structs import StorageResponseInfo
+from pyfdfs.enums import FDFS_FILE_EXT_NAME_MAX_LEN, FDFS_GROUP_NAME_MAX_LEN
+
+MAGIC = b"FSP1"
+
+# magic, handle, ext, group name, meta data size, content size, crc32 of meta data and content
+RECORD_HEADER = struct.Struct("!4s 16s %ds %ds I Q I" % (FDFS_FILE_EXT_NAME_MAX_LEN, FDFS_GROUP_NAME_MAX_LEN))
+
+SEGMENT_NAME = re.compile(r"^spool-(\d{8})\.log$")
+
+
+class SpoolError(Exception):
+    pass
+
+
+class SpoolRecord(object):
+    description_format = "SpoolRecord<%(handle)s,%(size)d bytes,attempts=%(attempts)d>"
+
+    def __init__(self, handle, segment, offset, ext, group_name, meta_size, file_size, crc32):
+        """
+        :param handle: hex string returned to the writer
+        :param segment: _Segment holding the record
+        :param offset: position of the record header in the segment file
+        """
+        self.handle = handle
+        self.segment = segment
+        self.offset = offset
+        self.ext = ext
+        self.group_name = group_name
+        self.meta_size = meta_size
+        self.file_size = file_size
+        self.crc32 = crc32
+        self.attempts = 0
+        # time before which a failed record is not uploaded again
+        self.not_before = 0
+
+    def __repr__(self):
+        return self.description_format % {"handle": self.handle, "size": self.file_size, "attempts": self.attempts}
+
+
+class _Segment(object):
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, "spool-%08d.log" % number)
+        self.done_path = os.path.join(directory, "spool-%08d.done" % number)
+        self.size = 0
+        # records not done yet, and whether records may still be appended
+        self.pending = 0
+        self.sealed = False
+
+    def remove(self):
+        for path in (self.path, self.done_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class UploadSpool(object):
+    description_format = "UploadSpool<%(path)s,pending=%(pending)d>"
+
+    def __init__(self, client, path, workers=2, batch_size=16, sync=True, segment_size=64 * 1024 * 1024,
+                 max_attempts=None, retry_delay=1.0, max_retry_delay=60.0, callback=None, max_results=100000):
+        """
+        :param client: FdfsClient the journal is uploaded with
+        :param path: directory of the journal, created if missing
+        :param workers: upload threads, 0 to only journal (the next spool opened on path uploads)
+        :param batch_size: records a worker takes from the queue at once, their done lines share one fsync
+        :param sync: fsync every record before returning its handle
+        :param segment_size: bytes after which a new segment file is started
+        :param max_attempts: uploads of a record before it is given up, None to retry until it succeeds
+        :param retry_delay: seconds before the first retry, doubled at each attempt up to max_retry_delay
+        :param callback: callback(handle, StorageResponseInfo, None) once uploaded,
+                         callback(handle, None, SpoolError) once given up; called from the workers
+        :param max_results: results kept for result(), the oldest are forgotten
+        """
+        self.client = client
+        self.path = path
+        self.batch_size = batch_size
+        self.sync = sync
+        self.segment_size = segment_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.callback = callback
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._done = threading.Condition(threading.Lock())
+        self._queue = queue.Queue()
+        # failed records waiting for their retry time: heap of (not_before, seq, SpoolRecord)
+        self._delayed = []
+        self._delayed_seq = count()
+        self._delayed_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._results = OrderedDict()
+        self._segments = {}
+        self._pending = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._recover()
+        self._active = None
+        self._writer = None
+        self._open_segment(max(list(self._segments.keys()) or [0]) + 1)
+        self._threads = []
+        for idx in range(workers):
+            thread = threading.Thread(target=self._work, name="pyfdfs-spool-%d" % idx)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __repr__(self):
+        return self.description_format % {"path": self.path, "pending": self._pending}
+
+    @property
+    def pending(self):
+        """
+        :return: records journaled and not done yet
+        """
+        return self._pending
+
+    def upload_file_by_buffer(self, file_buffer, ext, group_name=None, meta_data=None):
+        """
+        :param file_buffer: bytes, bytearray or memoryview
+        :param ext: file ext name
+        :param group_name: which group, can be null
+        :param meta_data: dictionary, store metadata in it, can be null
+        :return: handle, see result()
+        function: journal the upload, the workers send it to the cluster later
+        """
+        handle = uuid.uuid4().hex
+        meta = json.dumps(meta_data, sort_keys=True).encode() if meta_data else b""
+        file_size = buffer_size(file_buffer)
+        checksum = Checksum()
+        checksum.update(meta)
+        checksum.update(file_buffer)
+        header = RECORD_HEADER.pack(MAGIC, binascii.unhexlify(handle), to_bytes(ext or ""),
+                                    to_bytes(group_name or ""), len(meta), file_size, checksum.crc32)
+        with self._lock:
+            segment = self._active
+            record = SpoolRecord(handle, segment, segment.size, ext or "", group_name, len(meta), file_size,
+                                 checksum.crc32)
+            try:
+                self._writer.write(header)
+                self._writer.write(meta)
+                self._writer.write(file_buffer)
+                self._writer.flush()
+                if self.sync:
+                    os.fsync(self._writer.fileno())
+            except Exception:
+                self._rewind(segment)
+                raise
+            segment.size += RECORD_HEADER.size + len(meta) + file_size
+            segment.pending += 1
+            if segment.size >= self.segment_size:
+                self._open_segment(segment.number + 1)
+        with self._done:
+            self._pending += 1
+        self._queue.put(record)
+        return handle
+
+    def result(self, handle, timeout=0):
+        """
+        :param handle: returned by upload_file_by_buffer
+        :param timeout: seconds to wait for the upload, None to wait until it is done
+        :return: StorageResponseInfo, None while the upload is pending or for an unknown handle
+        raise SpoolError when the upload was given up
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._done:
+            while handle not in self._results:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._done.wait(remaining)
+            result = self._results[handle]
+        if isinstance(result, SpoolError):
+            raise result
+        return result
+
+    def flush(self, timeout=None):
+        """
+        :param timeout: seconds to wait, None to wait until every record is done
+        :return: True when no record is pending
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._done:
+            while self._pending > 0:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+        return True
+
+    def close(self, timeout=0):
+        """
+        :param timeout: seconds to let the workers drain the journal first, None to wait until done
+        stop the workers, the records left are uploaded by the next spool opened on the same directory
+        """
+        if self._threads and timeout != 0:
+            self.flush(timeout)
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _open_segment(self, number):
+        """
+        seal the active segment and start writing a new one, the lock is held
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._active.sealed = True
+            self._reclaim(self._active)
+        self._active = _Segment(self.path, number)
+        self._segments[number] = self._active
+        self._writer = io.open(self._active.path, "ab")
+
+    def _rewind(self, segment):
+        """
+        cut off what a failed write left after segment.size, so the next records keep their offsets;
+        a segment that can not be cut is sealed for a new one. The lock is held
+        """
+        try:
+            self._writer.close()
+        except (IOError, OSError):
+            # the bytes still buffered by the writer are dropped
+            pass
+        try:
+            with io.open(segment.path, "r+b") as f_obj:
+                f_obj.truncate(segment.size)
+            self._writer = io.open(segment.path, "ab")
+        except (IOError, OSError) as e:
+            print("Error: can not cut the torn record off %s, %s" % (segment.path, e))
+            self._open_segment(segment.number + 1)
+
+    def _reclaim(self, segment):
+        if segment.sealed and segment.pending == 0 and self._segments.pop(segment.number, None) is not None:
+            segment.remove()
+
+    def _recover(self):
+        """
+        load the segments left by a previous process and queue their records with no done line
+        """
+        numbers = sorted(int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(self.path)) if match)
+        for number in numbers:
+            segment = _Segment(self.path, number)
+            segment.sealed = True
+            self._segments[number] = segment
+            done = self._read_done(segment)
+            for record in self._scan(segment):
+                if record.handle in done:
+                    self._set_result(record.handle, done[record.handle])
+                else:
+                    segment.pending += 1
+                    self._pending += 1
+                    self._queue.put(record)
+            self._reclaim(segment)
+
+    def _read_done(self, segment):
+        """
+        :return: {handle: StorageResponseInfo or SpoolError} of the done file of segment
+        """
+        done = {}
+        if not os.path.exists(segment.done_path):
+            return done
+        with io.open(segment.done_path, "rb") as f_obj:
+            for line in f_obj:
+                fields = to_str(line).rstrip("\n").split(" ", 1)
+                if len(fields) != 2:
+                    # torn last line, the record is uploaded again
+                    continue
+                handle, value = fields
+                if value.startswith("!"):
+                    done[handle] = SpoolError(value[1:])
+                else:
+                    sr = StorageResponseInfo()
+                    sr.group_name, sr.filename = value.split("/", 1)
+                    done[handle] = sr
+        return done
+
+    def _scan(self, segment):
+        """
+        :return: [SpoolRecord] of the segment file, cut off at the first torn record
+        """
+        records = []
+        file_size = os.path.getsize(segment.path)
+        offset = 0
+        with io.open(segment.path, "rb") as f_obj:
+            while offset < file_size:
+                header = f_obj.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, handle, ext, group_name, meta_size, size, crc32 = RECORD_HEADER.unpack(header)
+                end = offset + RECORD_HEADER.size + meta_size + size
+                if magic != MAGIC or end > file_size:
+                    break
+                records.append(SpoolRecord(to_str(binascii.hexlify(handle)), segment, offset,
+                                           to_str(ext).rstrip("\x00"), to_str(group_name).rstrip("\x00") or None,
+                                           meta_size, size, crc32))
+                offset = end
+                f_obj.seek(offset)
+        if offset < file_size:
+            print("Error: torn record at %d of %s, cut off" % (offset, segment.path))
+            with io.open(segment.path, "r+b") as f_obj:
+                f_obj.truncate(offset)
+        segment.size = offset
+        return records
+
+    def _read(self, record):
+        """
+        :return: (content, meta data) of the record, read back from its segment
+        """
+        with io.open(record.segment.path, "rb") as f_obj:
+            f_obj.seek(record.offset + RECORD_HEADER.size)
+            meta = f_obj.read(record.meta_size)
+            content = f_obj.read(record.file_size)
+        checksum = Checksum()
+        checksum.update(meta)
+        checksum.update(content)
+        if checksum.size != record.meta_size + record.file_size or checksum.crc32 != record.crc32:
+            raise SpoolError("Error: record %s of %s is corrupt" % (record.handle, record.segment.path))
+        return content, json.loads(to_str(meta)) if meta else None
+
+    def _work(self):
+        while not self._stop_event.is_set():
+            self._requeue_due()
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = []
+            retry = []
+            for record in batch:
+                try:
+                    content, meta_data = self._read(record)
+                    done.append((record, self.client.upload_file_by_buffer(content, record.ext, record.group_name,
+                                                                           meta_data)))
+                except SpoolError as e:
+                    done.append((record, e))
+                except Exception as e:
+                    record.attempts += 1
+                    if self.max_attempts is not None and record.attempts >= self.max_attempts:
+                        done.append((record, SpoolError("Error: given up after %d attempts, %s" %
+                                                        (record.attempts, e))))
+                    else:
+                        print("Error: upload of %s failed, %s" % (record.handle, e))
+                        retry.append(record)
+            self._complete(done)
+            # retried later, the worker goes on with the queue meanwhile
+            with self._delayed_lock:
+                for record in retry:
+                    record.not_before = time.time() + min(self.retry_delay * 2 ** (record.attempts - 1),
+                                                          self.max_retry_delay)
+                    heapq.heappush(self._delayed, (record.not_before, next(self._delayed_seq), record))
+
+    def _requeue_due(self):
+        """
+        put the failed records whose retry time has come back in the queue
+        """
+        now = time.time()
+        with self._delayed_lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                self._queue.put(heapq.heappop(self._delayed)[2])
+
+    def _complete(self, done):
+        """
+        :param done: [(SpoolRecord, StorageResponseInfo or SpoolError)]
+        write the done lines, one fsync per segment, then tell the waiters and the callback
+        """
+        if not done:
+            return
+        by_segment = OrderedDict()
+        for record, result in done:
+            if isinstance(result, SpoolError):
+                line = "%s !%s\n" % (record.handle, str(result).replace("\n", " "))
+            else:
+                line = "%s %s/%s\n" % (record.handle, result.group_name, result.filename)
+            by_segment.setdefault(record.segment, []).append(line.encode("utf-8"))
+        with self._lock:
+            for segment, lines in by_segment.items():
+                with io.open(segment.done_path, "ab") as f_obj:
+                    f_obj.write(b"".join(lines))
+                    f_obj.flush()
+                    if self.sync:
+                        os.fsync(f_obj.fileno())
+                segment.pending -= len(lines)
+                self._reclaim(segment)
+        with self._done:
+            for record, result in done:
+                self._set_result(record.handle, result)
+            self._pending -= len(done)
+            self._done.notify_all()
+        if self.callback is not None:
+            for record, result in done:
+                try:
+                    if isinstance(result, SpoolError):
+                        self.callback(record.handle, None, result)
+                    else:
+                        self.callback(record.handle, result, None)
+                except Exception as e:
+                    print("Error: spool callback %s" % e)
+
+    def _set_result(self, handle, result):
+        self._results[handle] = result
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
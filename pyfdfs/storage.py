@@ -7,16 +7,33 @@ import os
 
 from pyfdfs.connection import ConnectionPool, Connection
 from pyfdfs.command import CommandHeader, Command
-from pyfdfs.structs import StorageResponseInfo
+from pyfdfs.structs import StorageResponseInfo, FileInfo
+from pyfdfs.compat import to_bytes, to_str, buffer_size
 from pyfdfs.enums import TRACKER_PROTO_PKG_LEN_SIZE, FDFS_RECORD_SEPARATOR, FDFS_FIELD_SEPARATOR, \
     STORAGE_PROTO_CMD_UPLOAD_FILE, FDFS_GROUP_NAME_MAX_LEN, FDFS_FILE_EXT_NAME_MAX_LEN, \
     STORAGE_PROTO_CMD_DELETE_FILE, STORAGE_SET_METADATA_FLAG_OVERWRITE, \
-    STORAGE_PROTO_CMD_SET_METADATA, STORAGE_PROTO_CMD_GET_METADATA
+    STORAGE_PROTO_CMD_SET_METADATA, STORAGE_PROTO_CMD_GET_METADATA, STORAGE_PROTO_CMD_CREATE_LINK, \
+    FDFS_FILE_PREFIX_MAX_LEN, STORAGE_PROTO_CMD_DOWNLOAD_FILE, STORAGE_PROTO_CMD_QUERY_FILE_INFO, \
+    STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG
 
 
 class Storage(object):
-    def __init__(self, host, port, pool_cls=ConnectionPool, conn_cls=Connection, timeout=60, max_conn=2 ** 31):
-        self.pool = pool_cls(hosts=(host, port,), conn_cls=conn_cls, timeout=timeout, max_conn=max_conn)
+    def __init__(self, host, port, pool_cls=ConnectionPool, conn_cls=Connection, timeout=60, max_conn=2 ** 31,
+                 connect_timeout=None, read_timeout=None, min_idle=None, wait_timeout=None, scheduler=None,
+                 group_name=None, observer=None, breaker=None, buffer_pool=None, budget=None):
+        """
+        :param scheduler: TransferScheduler pacing the transfers, see pyfdfs.throttle
+        :param group_name: group of the storage server, picks the group rate of the scheduler
+        :param observer: callable getting the timings of every command, see Command.observe
+        :param breaker: CircuitBreaker of the storage server, see pyfdfs.breaker
+        :param buffer_pool: BufferPool of the commands, see pyfdfs.buffers
+        :param budget: MemoryBudget of the commands, see pyfdfs.budget
+        """
+        self.group_name = group_name
+        self.pool = pool_cls(hosts=[(host, port,)], conn_cls=conn_cls, timeout=timeout, max_conn=max_conn,
+                             connect_timeout=connect_timeout, read_timeout=read_timeout, min_idle=min_idle,
+                             wait_timeout=wait_timeout, scheduler=scheduler, group_name=group_name,
+                             observer=observer, breaker=breaker, buffer_pool=buffer_pool, budget=budget)
 
     @staticmethod
     def get_ext(file_name, double_ext=True):
@@ -32,19 +49,37 @@ class Storage(object):
                     return '%s.%s' % (li[-2], li[-1])
         return li[-1]
 
+    @staticmethod
+    def _meta_bytes(value):
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value)
+        return to_bytes("%s" % value)
+
     @staticmethod
     def pack_meta(meta_data):
         if not meta_data:
-            return ""
-        meta_list = ['%s%c%s' % (k, FDFS_FIELD_SEPARATOR, v) for k, v in meta_data.items()]
+            return b""
+        meta_list = [FDFS_FIELD_SEPARATOR.join((Storage._meta_bytes(k), Storage._meta_bytes(v)))
+                     for k, v in meta_data.items()]
         return FDFS_RECORD_SEPARATOR.join(meta_list)
 
-    def upload_file_by_buffer(self, file_buffer, current_write_path, meta_data, ext):
+    @staticmethod
+    def unpack_meta(meta_str):
+        meta_data = {}
+        if not meta_str:
+            return meta_data
+        for item in meta_str.split(FDFS_RECORD_SEPARATOR):
+            k, v = item.split(FDFS_FIELD_SEPARATOR, 1)
+            meta_data[to_str(k)] = to_str(v)
+        return meta_data
+
+    def upload_file_by_buffer(self, file_buffer, current_write_path, meta_data, ext, checksum=None):
         """
         :param file_buffer: file buffer for send
         :param current_write_path: store path index on the storage server
         :param meta_data: dictionary, store metadata in it
         :param ext: file ext name
+        :param checksum: Checksum computed on the buffer as it is sent, kept as sr.checksum
         :return: StorageResponseInfo
 
          * STORAGE_PROTO_CMD_UPLOAD_FILE
@@ -60,25 +95,28 @@ class Storage(object):
             # response body: StorageResponseInfo
         """
         meta_str = self.pack_meta(meta_data)
-        pkg_len = TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + \
-                  FDFS_FILE_EXT_NAME_MAX_LEN + len(meta_str) + len(file_buffer)
+        file_size = buffer_size(file_buffer)
+        pkg_len = 1 + TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + \
+                  FDFS_FILE_EXT_NAME_MAX_LEN + len(meta_str) + file_size
         header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
-        cmd = Command(pool=self.pool, header=header, fmt="!B %ds %ds %ds %ds %ds" % (TRACKER_PROTO_PKG_LEN_SIZE,
-                                                                                     TRACKER_PROTO_PKG_LEN_SIZE,
-                                                                                     FDFS_FILE_EXT_NAME_MAX_LEN,
-                                                                                     len(meta_str), len(file_buffer)))
-        cmd.pack(current_write_path, len(meta_str), len(file_buffer), ext, meta_str, file_buffer)
-        resp, resp_pkg_len = cmd.execute()
+        cmd = Command(pool=self.pool, header=header, fmt="!B Q Q %ds %ds" % (FDFS_FILE_EXT_NAME_MAX_LEN,
+                                                                             len(meta_str)))
+        cmd.pack(current_write_path, len(meta_str), file_size, ext, meta_str)
+        cmd.append(file_buffer)
+        cmd.send_checksum = checksum
         sr = StorageResponseInfo()
-        fmt = "!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_pkg_len - FDFS_GROUP_NAME_MAX_LEN)
-        sr.group_name, sr.filename = cmd.unpack(fmt, resp)
+        with cmd.response() as (resp, resp_pkg_len):
+            fmt = "!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_pkg_len - FDFS_GROUP_NAME_MAX_LEN)
+            sr.group_name, sr.filename = cmd.unpack(fmt, resp)
+        sr.checksum = checksum
         return sr
 
-    def upload_file_by_filename(self, file_path, current_write_path, meta_data):
+    def upload_file_by_filename(self, file_path, current_write_path, meta_data, checksum=None):
         """
         :param file_path: file path for send
         :param current_write_path: store path index on the storage server
         :param meta_data: dictionary, store metadata in it
+        :param checksum: Checksum computed on the file as it is sent, kept as sr.checksum
         :return: StorageResponseInfo
 
          * STORAGE_PROTO_CMD_UPLOAD_FILE
@@ -96,18 +134,44 @@ class Storage(object):
         file_size = os.stat(file_path).st_size
         meta_str = self.pack_meta(meta_data)
         ext = self.get_ext(file_path)
-        pkg_len = TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + \
+        pkg_len = 1 + TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + \
                   FDFS_FILE_EXT_NAME_MAX_LEN + len(meta_str) + file_size
         header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
-        cmd = Command(pool=self.pool, header=header, fmt="!B %ds %ds %ds %ds" % (TRACKER_PROTO_PKG_LEN_SIZE,
-                                                                                 TRACKER_PROTO_PKG_LEN_SIZE,
-                                                                                 FDFS_FILE_EXT_NAME_MAX_LEN,
-                                                                                 len(meta_str)))
+        cmd = Command(pool=self.pool, header=header, fmt="!B Q Q %ds %ds" % (FDFS_FILE_EXT_NAME_MAX_LEN,
+                                                                             len(meta_str)))
         cmd.pack(current_write_path, len(meta_str), file_size, ext, meta_str)
+        cmd.send_checksum = checksum
         resp, resp_pkg_len = cmd.send_file(file_path)
         sr = StorageResponseInfo()
         fmt = "!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_pkg_len - FDFS_GROUP_NAME_MAX_LEN)
         sr.group_name, sr.filename = cmd.unpack(fmt, resp)
+        sr.checksum = checksum
+        return sr
+
+    def upload_stream(self, chunks, file_size, current_write_path, meta_data, ext, checksum=None):
+        """
+        :param chunks: iterable of bytes-like objects adding up to file_size bytes, sent as they come
+        :param file_size: file size
+        :param current_write_path: store path index on the storage server
+        :param meta_data: dictionary, store metadata in it
+        :param ext: file ext name
+        :param checksum: Checksum computed on the chunks as they are sent, kept as sr.checksum
+        :return: StorageResponseInfo
+        function: same request as upload_file_by_buffer, the content does not need to be in memory
+        """
+        meta_str = self.pack_meta(meta_data)
+        pkg_len = 1 + TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + \
+                  FDFS_FILE_EXT_NAME_MAX_LEN + len(meta_str) + file_size
+        header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_UPLOAD_FILE)
+        cmd = Command(pool=self.pool, header=header, fmt="!B Q Q %ds %ds" % (FDFS_FILE_EXT_NAME_MAX_LEN,
+                                                                             len(meta_str)))
+        cmd.pack(current_write_path, len(meta_str), file_size, ext, meta_str)
+        cmd.send_checksum = checksum
+        resp, resp_pkg_len = cmd.send_chunks(chunks)
+        sr = StorageResponseInfo()
+        fmt = "!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_pkg_len - FDFS_GROUP_NAME_MAX_LEN)
+        sr.group_name, sr.filename = cmd.unpack(fmt, resp)
+        sr.checksum = checksum
         return sr
 
     def delete_file(self, group_name, file_name):
@@ -123,13 +187,86 @@ class Storage(object):
              @ filename bytes: filename
            # response body: none
         """
-        file_name_len = len(file_name)
+        file_name_len = len(to_bytes(file_name))
         header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_len,
                                cmd=STORAGE_PROTO_CMD_DELETE_FILE)
         cmd = Command(pool=self.pool, header=header, fmt="! %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
         cmd.pack(group_name, file_name)
         cmd.execute()
 
+    def download_to_buffer(self, group_name, file_name, offset=0, download_bytes=0, checksum=None):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :param offset: first byte to download
+        :param download_bytes: bytes to download, 0 for up to the end of the file
+        :param checksum: Checksum computed on the content as it is received
+        :return: file content
+
+        * STORAGE_PROTO_CMD_DOWNLOAD_FILE
+           # function: download file from storage server
+           # request body:
+             @ TRACKER_PROTO_PKG_LEN_SIZE bytes: file offset
+             @ TRACKER_PROTO_PKG_LEN_SIZE bytes: download file bytes
+             @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+             @ filename bytes: filename
+           # response body:
+             @ file content
+        """
+        resp, resp_size = self._download_command(group_name, file_name, offset, download_bytes, checksum).execute()
+        return resp
+
+    def download_to_file(self, group_name, file_name, fd, offset=0, download_bytes=0, checksum=None,
+                         use_splice=True):
+        """
+        :param fd: file descriptor the content is written to, from its current position
+        :param use_splice: move the content from the socket to the file with os.splice when available
+        :return: bytes written
+        function: same request as download_to_buffer, the content goes to a file without a python string
+        """
+        written, resp_size = self._download_command(group_name, file_name, offset, download_bytes,
+                                                    checksum).execute_to_file(fd, use_splice)
+        return written
+
+    def download_stream(self, group_name, file_name, offset=0, download_bytes=0, chunk_size=64 * 1024,
+                        checksum=None):
+        """
+        :param chunk_size: bytes read from the socket at a time
+        :param checksum: Checksum computed on the content as the stream is consumed
+        :return: ResponseStream, its length is the size of the downloaded range
+        function: same request as download_to_buffer, the content is read while the stream is consumed
+        """
+        return self._download_command(group_name, file_name, offset, download_bytes, checksum).stream(chunk_size)
+
+    def _download_command(self, group_name, file_name, offset, download_bytes, checksum=None):
+        file_name_len = len(to_bytes(file_name))
+        header = CommandHeader(req_pkg_len=TRACKER_PROTO_PKG_LEN_SIZE * 2 + FDFS_GROUP_NAME_MAX_LEN + file_name_len,
+                               cmd=STORAGE_PROTO_CMD_DOWNLOAD_FILE)
+        cmd = Command(pool=self.pool, header=header, fmt="!Q Q %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
+        cmd.pack(offset, download_bytes, group_name, file_name)
+        cmd.recv_checksum = checksum
+        return cmd
+
+    def query_file_info(self, group_name, file_name):
+        """
+        :param group_name: group name
+        :param file_name: file name
+        :return: FileInfo
+
+        * STORAGE_PROTO_CMD_QUERY_FILE_INFO
+           # function: query file size, create time, crc32 and source server
+           # request body:
+             @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+             @ filename bytes: filename
+           # response body: FileInfo
+        """
+        file_name_len = len(to_bytes(file_name))
+        header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_len,
+                               cmd=STORAGE_PROTO_CMD_QUERY_FILE_INFO)
+        cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
+        cmd.pack(group_name, file_name)
+        return cmd.fetch_one(FileInfo)
+
     def set_meta(self, file_name, group_name, meta_data, operation_flag=STORAGE_SET_METADATA_FLAG_OVERWRITE):
         """
         :param file_name: file name
@@ -153,16 +290,15 @@ class Storage(object):
                                  name and value seperated by \x02
            # response body: none
         """
-        file_name_len = len(file_name)
+        file_name_len = len(to_bytes(file_name))
         meta_str = self.pack_meta(meta_data)
         meta_len = len(meta_str)
         pkg_len = TRACKER_PROTO_PKG_LEN_SIZE + TRACKER_PROTO_PKG_LEN_SIZE + 1 + FDFS_GROUP_NAME_MAX_LEN + \
                   file_name_len + meta_len
         header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_SET_METADATA)
-        cmd_fmt = "!%ds %ds c %ds %ds %ds" %(TRACKER_PROTO_PKG_LEN_SIZE, TRACKER_PROTO_PKG_LEN_SIZE,
-                                             FDFS_GROUP_NAME_MAX_LEN, file_name_len, meta_len)
+        cmd_fmt = "!Q Q c %ds %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len, meta_len)
         cmd = Command(pool=self.pool, header=header, fmt=cmd_fmt)
-        cmd.pack(file_name_len, meta_len, operation_flag, group_name, meta_str)
+        cmd.pack(file_name_len, meta_len, operation_flag, group_name, file_name, meta_str)
         cmd.execute()
 
     def get_meta(self, group_name, file_name):
@@ -179,13 +315,67 @@ class Storage(object):
             # response body
               @ meta data buff, each meta data seperated by \x01, name and value seperated by \x02
         """
-        header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + len(file_name), cmd=STORAGE_PROTO_CMD_GET_METADATA)
-        cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, len(file_name)))
+        file_name_len = len(to_bytes(file_name))
+        header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_len, cmd=STORAGE_PROTO_CMD_GET_METADATA)
+        cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_len))
         cmd.pack(group_name, file_name)
         resp, resp_size = cmd.execute()
-        meta_data = {}
-        for item in resp.split(FDFS_RECORD_SEPARATOR):
-            k, v = item.split(FDFS_FIELD_SEPARATOR)
-            meta_data[k] = v
-        return meta_data
+        return self.unpack_meta(resp)
 
+
+    def create_link(self, group_name, src_file_name, signature, ext):
+        """
+        :param group_name: group name
+        :param src_file_name: existing file on this storage server, without group name
+        :param signature: source file signature
+        :param ext: file ext name of the link
+        :return: StorageResponseInfo
+
+        * STORAGE_PROTO_CMD_CREATE_LINK
+           # function: create a new file id linked to an existing file
+           # request body:
+             @ TRACKER_PROTO_PKG_LEN_SIZE bytes: master filename length
+             @ TRACKER_PROTO_PKG_LEN_SIZE bytes: source filename length
+             @ TRACKER_PROTO_PKG_LEN_SIZE bytes: source file signature length
+             @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+             @ FDFS_FILE_PREFIX_MAX_LEN bytes: filename prefix, empty for a master file
+             @ FDFS_FILE_EXT_NAME_MAX_LEN bytes: file ext name, do not include dot (.)
+             @ master filename bytes: master filename, empty for a master file
+             @ source filename bytes: source filename
+             @ source file signature bytes: source file signature
+           # response body: StorageResponseInfo
+        """
+        src_len = len(to_bytes(src_file_name))
+        signature_len = len(to_bytes(signature))
+        pkg_len = TRACKER_PROTO_PKG_LEN_SIZE * 3 + FDFS_GROUP_NAME_MAX_LEN + FDFS_FILE_PREFIX_MAX_LEN + \
+                  FDFS_FILE_EXT_NAME_MAX_LEN + src_len + signature_len
+        header = CommandHeader(req_pkg_len=pkg_len, cmd=STORAGE_PROTO_CMD_CREATE_LINK)
+        cmd_fmt = "!Q Q Q %ds %ds %ds %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, FDFS_FILE_PREFIX_MAX_LEN,
+                                                 FDFS_FILE_EXT_NAME_MAX_LEN, src_len, signature_len)
+        cmd = Command(pool=self.pool, header=header, fmt=cmd_fmt)
+        cmd.pack(0, src_len, signature_len, group_name, "", ext, src_file_name, signature)
+        sr = StorageResponseInfo()
+        with cmd.response() as (resp, resp_pkg_len):
+            fmt = "!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, resp_pkg_len - FDFS_GROUP_NAME_MAX_LEN)
+            sr.group_name, sr.filename = cmd.unpack(fmt, resp)
+        return sr
+
+    def fetch_one_path_binlog(self, group_name, store_path_index, chunk_size=64 * 1024):
+        """
+        :param group_name: group name
+        :param store_path_index: store path index on the storage server
+        :param chunk_size: bytes read from the socket at a time
+        :return: ResponseStream over the binlog records, see pyfdfs.binlog
+
+        * STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG
+           # function: fetch the binlog records of the files of one store path
+           # request body:
+             @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+             @ 1 byte: store path index
+           # response body:
+             @ binlog records, one per line: timestamp op_type filename [source filename]
+        """
+        header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + 1, cmd=STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG)
+        cmd = Command(pool=self.pool, header=header, fmt="!%ds B" % FDFS_GROUP_NAME_MAX_LEN)
+        cmd.pack(group_name, store_path_index)
+        return cmd.stream(chunk_size)
@@ -0,0 +1,137 @@
+# coding=utf-8
+"""
+Source storage server of a file, from its name.
+
+The name a storage server gives to a file starts, after the store path and
+the two sub directories, with 27 characters of base64 (with "-" and "_" for
+"+" and "/") encoding 20 bytes:
+
+    @ 4 bytes: source server, its ip address or, with use_storage_id, its numeric id,
+               little endian: the server writes htonl() of it as a big endian int
+    @ 4 bytes: create timestamp
+    @ 8 bytes: file size, the high bits flag appender, trunk and slave files
+    @ 4 bytes: crc32 of the content
+
+A value up to FDFS_MAX_SERVER_ID is a server id, mapped to an ip address by
+the storage_ids.conf of the tracker, TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS;
+any other value is the ip address itself. StorageIdMap keeps that table with
+the storage servers of every group and refreshes them in a background thread,
+so reads and updates go straight to the source server of a file without a
+tracker round-trip. The source server always has the file, unlike a replica
+the file may not be synced to yet.
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import re
+import base64
+import struct
+import binascii
+
+from pyfdfs.compat import to_str, to_bytes
+from pyfdfs.command import ServerError
+from pyfdfs.topology import ClusterTopology
+from pyfdfs.enums import FDFS_FILENAME_BASE64_LENGTH, FDFS_MAX_SERVER_ID, FDFS_ID_TYPE_SERVER_ID, \
+    FDFS_ID_TYPE_IP_ADDRESS
+
+BASE64_NAME = re.compile(r"^[A-Za-z0-9_-]{%d}" % FDFS_FILENAME_BASE64_LENGTH)
+
+
+class FileNameInfo(object):
+    description_format = "FileNameInfo<source=%(source)s,timestamp=%(timestamp)d>"
+
+    def __init__(self, source, timestamp, file_size, crc32):
+        """
+        :param source: the first 4 bytes of the name, as an unsigned int
+        """
+        if 0 < source <= FDFS_MAX_SERVER_ID:
+            self.id_type = FDFS_ID_TYPE_SERVER_ID
+            self.source_id = "%d" % source
+            self.source_ip = None
+        else:
+            self.id_type = FDFS_ID_TYPE_IP_ADDRESS
+            self.source_id = None
+            self.source_ip = ".".join("%d" % byte for byte in bytearray(struct.pack("<I", source)))
+        self.timestamp = timestamp
+        self.file_size = file_size
+        self.crc32 = crc32
+
+    def __repr__(self):
+        return self.description_format % {"source": self.source_id or self.source_ip, "timestamp": self.timestamp}
+
+
+def decode_file_name(file_name):
+    """
+    :param file_name: remote file name, with or without its group name
+    :return: FileNameInfo, None if file_name was not made by a storage server
+    """
+    name = to_str(file_name).rsplit("/", 1)[-1]
+    if not BASE64_NAME.match(name):
+        return None
+    try:
+        raw = base64.b64decode(to_bytes(name[:FDFS_FILENAME_BASE64_LENGTH] + "="), b"-_")
+    except (binascii.Error, TypeError, ValueError):
+        return None
+    source, timestamp, file_size, crc32 = struct.unpack("<I", raw[:4]) + struct.unpack("!I Q I", raw[4:])
+    return FileNameInfo(source, timestamp, file_size, crc32)
+
+
+class StorageIdMap(ClusterTopology):
+    """
+    ClusterTopology with the storage ids of the tracker, answering which server is the source of a file.
+    """
+    description_format = "StorageIdMap<ids=%(ids)d,groups=%(groups)s,refreshed_at=%(refreshed_at)s>"
+
+    def __init__(self, tracker, refresh_interval=300, max_age=None):
+        ClusterTopology.__init__(self, tracker, refresh_interval, max_age)
+        self._ids = {}
+
+    def __repr__(self):
+        return self.description_format % {
+            "ids": len(self._ids),
+            "groups": sorted(self._groups.keys()),
+            "refreshed_at": self.refreshed_at
+        }
+
+    def refresh(self):
+        """
+        reload the storage ids, then the groups and their storage servers
+        """
+        try:
+            ids = dict((info.id, info) for info in self.tracker.fetch_storage_ids())
+        except ServerError:
+            # use_storage_id is off, file names hold ip addresses
+            ids = {}
+        with self._lock:
+            self._ids = ids
+        ClusterTopology.refresh(self)
+
+    def get(self, server_id):
+        """
+        :param server_id: id of a storage server, as in storage_ids.conf
+        :return: StorageIdInfo or None
+        """
+        with self._lock:
+            return self._ids.get(to_str(server_id))
+
+    def pick_source(self, group_name, file_name):
+        """
+        :param group_name: which group
+        :param file_name: which file
+        :return: BasicStorageInfo of the source storage server of the file, None if unknown or not active
+        """
+        info = decode_file_name(file_name)
+        if info is None or not self.is_fresh():
+            return None
+        with self._lock:
+            ip_addr = info.source_ip
+            if info.source_id is not None:
+                id_info = self._ids.get(info.source_id)
+                if id_info is None or id_info.group_name != group_name:
+                    return None
+                ip_addr = id_info.ip_addr
+            for server in self._active_servers(group_name):
+                if server.ip_addr == ip_addr:
+                    return self._to_basic_info(group_name, server)
+        return None
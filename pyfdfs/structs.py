@@ -6,6 +6,7 @@ __author__ = 'mazesoul'
 import struct
 from datetime import datetime
 
+from pyfdfs.compat import to_str
 from pyfdfs.enums import IP_ADDRESS_SIZE, FDFS_STORAGE_ID_MAX_SIZE, FDFS_DOMAIN_NAME_MAX_SIZE, \
     FDFS_VERSION_SIZE, FDFS_SPACE_SIZE_BASE_INDEX, FDFS_GROUP_NAME_MAX_LEN
 
@@ -23,9 +24,11 @@ class BaseAttr(object):
         return obj._data.get(self.name, self.val)
 
     def __set__(self, obj, val):
+        obj._raw[self.name] = val
         obj._data[self.name] = val
 
     def __delete__(self, obj):
+        obj._raw.pop(self.name, None)
         del obj._data[self.name]
 
 
@@ -41,7 +44,8 @@ class StrAttr(BaseAttr):
         super(StrAttr, self).__init__(name, val)
 
     def __set__(self, obj, val):
-        obj._data[self.name] = str(val).strip("\x00")
+        obj._raw[self.name] = val
+        obj._data[self.name] = str(to_str(val)).strip("\x00")
 
 
 class DatetimeAttr(BaseAttr):
@@ -50,6 +54,7 @@ class DatetimeAttr(BaseAttr):
         super(DatetimeAttr, self).__init__(name, val)
 
     def __set__(self, obj, val):
+        obj._raw[self.name] = val
         obj._data[self.name] = datetime.fromtimestamp(val).isoformat()
 
 
@@ -61,6 +66,7 @@ class SpaceAttr(StrAttr):
         super(SpaceAttr, self).__init__(name, val)
 
     def __set__(self, obj, val):
+        obj._raw[self.name] = val
         multiples = 1024.0
         if val < multiples:
             obj._data[self.name] = '{0:d}{1}'.format(val, self.suffix[self.index])
@@ -83,6 +89,14 @@ class BaseInfo(object):
     def get_fmt_size(self):
         return struct.calcsize(getattr(self, "fmt", ""))
 
+    def get_raw(self, name, default=None):
+        """
+        :param name: attribute name
+        :param default: returned when the attribute was never set
+        :return: the value as decoded from the wire, before any formatting
+        """
+        return self._raw.get(name, default)
+
     def set_info(self, byte_stream):
         for idx, info in enumerate(struct.unpack(self.fmt, byte_stream)):
             setattr(self, self.attributes[idx], info)
@@ -110,15 +124,22 @@ class BaseMeta(type):
             new_attrs[item] = attr_obj
         for attr_name, attr in attrs.items():
             new_attrs[attr_name] = attr
-        return super(BaseMeta, cls).__new__(cls, name, (BaseInfo,) + bases, new_attrs)
+        if not any(issubclass(base, BaseInfo) for base in bases):
+            bases = (BaseInfo,) + bases
+        return super(BaseMeta, cls).__new__(cls, name, bases, new_attrs)
 
     def __call__(cls, *args, **kwargs):
         obj = type.__call__(cls, *args, **kwargs)
         obj._data = {}
+        obj._raw = {}
         return obj
 
 
-class StorageInfo(object):
+# python 2 and 3 compatible way of using BaseMeta as metaclass
+BaseStruct = BaseMeta("BaseStruct", (object,), {})
+
+
+class StorageInfo(BaseStruct):
     """
     @ 1 byte: status
     @ FDFS_STORAGE_ID_MAX_SIZE bytes: id
@@ -183,7 +204,6 @@ class StorageInfo(object):
     @ TRACKER_PROTO_PKG_LEN_SIZE bytes: last_heart_beat_time
     @ 1 byte: if_trunk_server
     """
-    __metaclass__ = BaseMeta
     desc = "Storage information"
     fmt = '!B %ds %ds %ds %ds %ds 10Q 3L 42Q B' % (FDFS_STORAGE_ID_MAX_SIZE, IP_ADDRESS_SIZE,
                                                    FDFS_DOMAIN_NAME_MAX_SIZE, FDFS_STORAGE_ID_MAX_SIZE,
@@ -216,22 +236,42 @@ class StorageInfo(object):
     free_mb = SpaceAttr("free_mb", FDFS_SPACE_SIZE_BASE_INDEX)
 
 
-class BasicStorageInfo(object):
+class BasicStorageInfo(BaseStruct):
     """
     @ FDFS_GROUP_NAME_MAX_LEN bytes: group_name
-    @ IP_ADDRESS_SIZE bytes: ip_addr
-    @ TRACKER_PROTO_PKG_LEN_SIZE bytes: current_write_path
+    @ IP_ADDRESS_SIZE - 1 bytes: ip_addr
     @ TRACKER_PROTO_PKG_LEN_SIZE bytes: storage_port
+    @ 1 byte: current_write_path
     """
-    __metaclass__ = BaseMeta
     desc = "BasicStorageInfo information"
-    fmt = '!%ds %ds Q B' % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE)
+    fmt = '!%ds %ds Q B' % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE - 1)
 
-    attributes = ("group_name", "ip_addr", "current_write_path", "storage_port",)
+    attributes = ("group_name", "ip_addr", "storage_port", "current_write_path",)
     str_attrs = ("group_name", "ip_addr",)
 
 
-class GroupInfo(object):
+class StorageIdInfo(BaseStruct):
+    """
+    one line of storage_ids.conf, as sent back by TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS:
+    @ id group_name ip_addr[:port]
+    several ip addresses may be comma separated, the first one is kept
+    port is 0 unless the line has one, the storage port of the group is used then
+    """
+    desc = "Storage id information"
+
+    attributes = ("id", "group_name", "ip_addr", "port",)
+    str_attrs = ("id", "group_name", "ip_addr",)
+
+    def set_line(self, line):
+        self.id, self.group_name, address = to_str(line).split()[:3]
+        address = address.split(",")[0]
+        if address.count(":") == 1:
+            address, port = address.rsplit(":", 1)
+            self.port = int(port)
+        self.ip_addr = address
+
+
+class GroupInfo(BaseStruct):
     """
     @ FDFS_GROUP_NAME_MAX_LEN + 1 bytes: group_name
     @ TRACKER_PROTO_PKG_LEN_SIZE bytes: total_mb
@@ -246,7 +286,6 @@ class GroupInfo(object):
     @ TRACKER_PROTO_PKG_LEN_SIZE bytes: subdir_count_per_path
     @ TRACKER_PROTO_PKG_LEN_SIZE bytes: current_trunk_file_id
     """
-    __metaclass__ = BaseMeta
     desc = "Group information"
     fmt = '!%ds 11Q' % (FDFS_GROUP_NAME_MAX_LEN + 1)
 
@@ -259,13 +298,30 @@ class GroupInfo(object):
     trunk_free_mb = SpaceAttr("trunk_free_mb", FDFS_SPACE_SIZE_BASE_INDEX)
 
 
-class StorageResponseInfo(object):
+class StorageResponseInfo(BaseStruct):
     """
     @ FDFS_GROUP_NAME_MAX_LEN bytes: group_name
     @ filename bytes: filename
+
+    checksum: Checksum of the uploaded content when one was asked for, see pyfdfs.checksum
     """
-    __metaclass__ = BaseMeta
     desc = "StorageResponseInfo information"
 
     attributes = ("group_name", "filename",)
     str_attrs = ("group_name", "filename",)
+    checksum = None
+
+
+class FileInfo(BaseStruct):
+    """
+    @ TRACKER_PROTO_PKG_LEN_SIZE bytes: file_size
+    @ TRACKER_PROTO_PKG_LEN_SIZE bytes: create_timestamp
+    @ TRACKER_PROTO_PKG_LEN_SIZE bytes: crc32
+    @ IP_ADDRESS_SIZE bytes: source_ip_addr
+    """
+    desc = "File information"
+    fmt = '!3Q %ds' % IP_ADDRESS_SIZE
+
+    attributes = ("file_size", "create_timestamp", "crc32", "source_ip_addr",)
+    str_attrs = ("source_ip_addr",)
+    date_attrs = ("create_timestamp",)
@@ -0,0 +1,176 @@
+# coding=utf-8
+"""
+Bandwidth throttling and priority classes.
+
+A TransferScheduler holds token buckets (bytes per second) for the whole
+client, for each group and for each storage server endpoint. Every storage
+connection of a client paces its socket reads and writes through them, in
+chunks of chunk_size bytes, so a long transfer is spread evenly instead of
+bursting.
+
+The priority class is bound to the calling thread:
+
+    with priority(PRIORITY_BACKGROUND):
+        client.upload_file_by_filename(path)
+
+Every transfer waits for its tokens, so the rates hold for ordinary callers.
+With throttle_interactive=False interactive transfers take theirs without
+waiting, leaving less bandwidth to the background ones; the debt they leave in
+a bucket is capped at one burst or one chunk, so background transfers never
+wait more than max(burst, chunk_size) / rate seconds behind it. Interactive callers are also served first when
+they wait for a connection of a full pool (see ConnectionPool wait_timeout).
+"""
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+
+from pyfdfs.deadline import get_deadline
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_local = threading.local()
+
+
+def get_priority():
+    """
+    :return: priority class of the current thread, lower is served first
+    """
+    return getattr(_local, "priority", PRIORITY_INTERACTIVE)
+
+
+class priority(object):
+    """
+    context manager binding a priority class to the current thread
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = get_priority()
+        _local.priority = self.level
+        return self.level
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.priority = self.previous
+
+
+class TokenBucket(object):
+    """
+    rate bytes per second, bursts up to burst bytes. Tokens can go negative:
+    a transfer taking more than what is left waits for its whole debt, and
+    the next ones pay back what is left of it, down to max_debt bytes at most.
+    """
+    description_format = "TokenBucket<rate=%(rate)s,tokens=%(tokens)d>"
+
+    def __init__(self, rate, burst=None, max_debt=None):
+        """
+        :param rate: bytes per second
+        :param burst: bucket size in bytes, default one second worth of rate
+        :param max_debt: tokens can go down to -max_debt, default burst
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.max_debt = float(max_debt if max_debt is not None else self.burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {"rate": self.rate, "tokens": self.tokens}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, nbytes):
+        """
+        :return: seconds to wait before the nbytes may be sent, the tokens are taken at once
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            # the wait is worked out from the whole debt, only the balance left to the next ones is capped
+            debt = nbytes - self.tokens
+            self.tokens = max(self.tokens - nbytes, -self.max_debt)
+            return 0 if debt <= 0 else debt / self.rate
+
+
+class TransferScheduler(object):
+    """
+    Token buckets of a client, see the module doc
+    """
+    description_format = "TransferScheduler<rate=%(rate)s,groups=%(groups)s,endpoints=%(endpoints)s>"
+
+    def __init__(self, rate=None, group_rates=None, endpoint_rates=None, endpoint_rate=None,
+                 chunk_size=64 * 1024, throttle_interactive=True):
+        """
+        :param rate: bytes per second for the whole client, None for unlimited
+        :param group_rates: {group_name: bytes per second}
+        :param endpoint_rates: {(ip, port): bytes per second}
+        :param endpoint_rate: bytes per second of every endpoint missing in endpoint_rates
+        :param chunk_size: bytes sent or received between two pacing points
+        :param throttle_interactive: interactive transfers wait for tokens too, False to let them through
+                                     at once, at the expense of the background ones
+        """
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.throttle_interactive = throttle_interactive
+        self.client_bucket = self._bucket(rate) if rate else None
+        self.group_buckets = dict((name, self._bucket(value)) for name, value in (group_rates or {}).items())
+        self.endpoint_rates = dict(endpoint_rates or {})
+        self.endpoint_rate = endpoint_rate
+        self.endpoint_buckets = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return self.description_format % {
+            "rate": self.rate,
+            "groups": sorted(self.group_buckets),
+            "endpoints": sorted(self.endpoint_rates)
+        }
+
+    def _bucket(self, rate):
+        """
+        a bucket owing one chunk at least, so a rate below chunk_size keeps the debt of every chunk
+        """
+        return TokenBucket(rate, max_debt=max(rate, self.chunk_size))
+
+    def buckets(self, endpoint, group_name=None):
+        """
+        :param endpoint: (ip, port) of the storage server
+        :return: buckets a transfer to endpoint goes through
+        """
+        buckets = []
+        if self.client_bucket is not None:
+            buckets.append(self.client_bucket)
+        if group_name in self.group_buckets:
+            buckets.append(self.group_buckets[group_name])
+        rate = self.endpoint_rates.get(endpoint, self.endpoint_rate)
+        if rate:
+            with self._lock:
+                bucket = self.endpoint_buckets.get(endpoint)
+                if bucket is None:
+                    bucket = self.endpoint_buckets[endpoint] = self._bucket(rate)
+            buckets.append(bucket)
+        return buckets
+
+    def pace(self, buckets, nbytes):
+        """
+        take nbytes from every bucket, sleeping as long as the most depleted
+        one needs, bounded by the deadline of the thread
+        """
+        if not buckets:
+            return
+        wait = max([bucket.take(nbytes) for bucket in buckets])
+        if wait <= 0 or (get_priority() <= PRIORITY_INTERACTIVE and not self.throttle_interactive):
+            return
+        deadline = get_deadline()
+        if deadline is not None:
+            wait = min(wait, max(deadline.remaining(), 0))
+        time.sleep(wait)
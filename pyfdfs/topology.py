@@ -0,0 +1,195 @@
+# coding=utf-8
+from __future__ import absolute_import, with_statement
+
+__author__ = 'mazesoul'
+
+import os
+import time
+import random
+import threading
+
+from pyfdfs.structs import BasicStorageInfo
+from pyfdfs.enums import FDFS_STORAGE_STATUS_ACTIVE, STORAGE_STATUS_MAP
+
+
+class ClusterTopology(object):
+    """
+    Local snapshot of the groups and storage servers known by the tracker.
+
+    The snapshot is loaded with list_groups / list_servers and refreshed by a
+    background thread every `refresh_interval` seconds, so upload targets and
+    read servers can be picked without a tracker round-trip. Every pick_* method
+    returns None when the snapshot cannot answer (never loaded, too old, unknown
+    group, no active server); callers are expected to ask the tracker instead.
+    """
+    description_format = "ClusterTopology<groups=%(groups)s,refreshed_at=%(refreshed_at)s>"
+
+    def __init__(self, tracker, refresh_interval=30, max_age=None):
+        """
+        :param tracker: Tracker object used for the refresh
+        :param refresh_interval: seconds between two refreshes
+        :param max_age: seconds after which the snapshot is considered stale,
+                        default three refresh intervals
+        """
+        self.tracker = tracker
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age or refresh_interval * 3
+        self.refreshed_at = None
+        self.last_error = None
+        self._groups = {}
+        self._servers = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.pid = os.getpid()
+
+    def __repr__(self):
+        return self.description_format % {
+            "groups": sorted(self._groups.keys()),
+            "refreshed_at": self.refreshed_at
+        }
+
+    def start(self):
+        """
+        load the topology in a background thread and keep it refreshed
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pyfdfs-topology")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = e
+            self._stop_event.wait(self.refresh_interval)
+
+    def refresh(self):
+        """
+        reload all groups and their storage servers from the tracker
+        """
+        groups = {}
+        servers = {}
+        for group in self.tracker.list_groups():
+            groups[group.group_name] = group
+            servers[group.group_name] = self.tracker.list_servers(group.group_name)
+        with self._lock:
+            self._groups = groups
+            self._servers = servers
+            self.refreshed_at = time.time()
+            self.last_error = None
+
+    def _check_pid(self):
+        """
+        threads do not survive a fork, restart the refresh in the child
+        """
+        if self.pid != os.getpid() and self._thread is not None:
+            self.start()
+
+    def is_fresh(self):
+        self._check_pid()
+        return self.refreshed_at is not None and time.time() - self.refreshed_at <= self.max_age
+
+    @staticmethod
+    def _weighted_choice(items, weight):
+        """
+        pick one item at random, proportionally to weight(item)
+        """
+        total = sum(weight(item) for item in items)
+        if total <= 0:
+            return random.choice(items)
+        point = random.uniform(0, total)
+        for item in items:
+            point -= weight(item)
+            if point <= 0:
+                return item
+        return items[-1]
+
+    @staticmethod
+    def _free_mb(info):
+        return info.get_raw("free_mb", 0)
+
+    def _active_servers(self, group_name):
+        return [item for item in self._servers.get(group_name, ())
+                if item.status == FDFS_STORAGE_STATUS_ACTIVE]
+
+    @staticmethod
+    def _to_basic_info(group_name, server):
+        si = BasicStorageInfo()
+        si.group_name = group_name
+        si.ip_addr = server.ip_addr
+        si.storage_port = server.storage_port
+        si.current_write_path = server.current_write_path
+        return si
+
+    def pick_store(self, group_name=None):
+        """
+        :param group_name: which group, can be null
+        :return: BasicStorageInfo or None
+        function: pick an active storage server for upload, favouring free space
+        """
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            if group_name is not None:
+                group_names = [group_name]
+            else:
+                group_names = [name for name, group in self._groups.items() if group.get_raw("free_mb", 0) > 0]
+            candidates = [name for name in group_names if self._active_servers(name)]
+            if not candidates:
+                return None
+            group_name = self._weighted_choice(candidates, lambda name: self._free_mb(self._groups[name]))
+            server = self._weighted_choice(self._active_servers(group_name), self._free_mb)
+            return self._to_basic_info(group_name, server)
+
+    def pick_fetch(self, group_name):
+        """
+        :param group_name: which group
+        :return: BasicStorageInfo or None
+        function: pick an active storage server of the group for download
+        """
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            servers = self._active_servers(group_name)
+            if not servers:
+                return None
+            return self._to_basic_info(group_name, random.choice(servers))
+
+    def snapshot(self):
+        """
+        :return: dictionary, groups and storage servers as last seen by the tracker
+        """
+        with self._lock:
+            groups = {}
+            for group_name, group in self._groups.items():
+                groups[group_name] = {
+                    "total_mb": group.get_raw("total_mb", 0),
+                    "free_mb": group.get_raw("free_mb", 0),
+                    "active_count": group.active_count,
+                    "current_write_server": group.current_write_server,
+                    "servers": [{
+                        "id": item.id,
+                        "ip_addr": item.ip_addr,
+                        "storage_port": item.storage_port,
+                        "status": STORAGE_STATUS_MAP.get(item.status, item.status),
+                        "total_mb": item.get_raw("total_mb", 0),
+                        "free_mb": item.get_raw("free_mb", 0),
+                        "current_write_path": item.current_write_path,
+                    } for item in self._servers.get(group_name, ())],
+                }
+            return {
+                "refreshed_at": self.refreshed_at,
+                "last_error": self.last_error,
+                "groups": groups,
+            }
@@ -4,19 +4,47 @@ from __future__ import absolute_import
 __author__ = 'mazesoul'
 
 from pyfdfs.command import CommandHeader, Command
-from pyfdfs.structs import StorageInfo, GroupInfo, BasicStorageInfo
+from pyfdfs.structs import StorageInfo, GroupInfo, BasicStorageInfo, StorageIdInfo
+from pyfdfs.compat import to_bytes
 from pyfdfs.enums import FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE, \
     TRACKER_PROTO_CMD_SERVER_LIST_STORAGE, TRACKER_PROTO_CMD_SERVER_LIST_ALL_GROUPS, \
     TRACKER_PROTO_CMD_SERVER_LIST_ONE_GROUP, TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ONE, \
     TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ONE, TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ALL, \
     TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ALL, TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ONE, \
-    TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ALL, TRACKER_PROTO_PKG_LEN_SIZE
+    TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ALL, TRACKER_PROTO_PKG_LEN_SIZE, TRACKER_PROTO_CMD_SERVICE_QUERY_UPDATE, \
+    TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS
 
 
 class Tracker(object):
     def __init__(self, pool):
         self.pool = pool
 
+    @staticmethod
+    def _fetch_store_all(cmd):
+        """
+        @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+        @ server count * (IP_ADDRESS_SIZE - 1 bytes: ip address, TRACKER_PROTO_PKG_LEN_SIZE bytes: port)
+        @ 1 byte: store path index on the storage server
+        """
+        with cmd.response() as (resp, resp_size):
+            server_size = IP_ADDRESS_SIZE - 1 + TRACKER_PROTO_PKG_LEN_SIZE
+            server_count = (resp_size - FDFS_GROUP_NAME_MAX_LEN - 1) // server_size
+            recv_fmt = '!%ds %s B' % (FDFS_GROUP_NAME_MAX_LEN,
+                                      ' '.join(['%ds Q' % (IP_ADDRESS_SIZE - 1)] * server_count))
+            result = cmd.unpack(recv_fmt, resp)
+
+        group_name = result[0]
+        current_write_path = result[-1]
+        si_list = []
+        for idx in range(server_count):
+            si = BasicStorageInfo()
+            si.group_name = group_name
+            si.current_write_path = current_write_path
+            si.ip_addr = result[idx * 2 + 1]
+            si.storage_port = result[idx * 2 + 2]
+            si_list.append(si)
+        return si_list
+
     def list_groups(self):
         """
         :return: List<GroupInfo>
@@ -106,22 +134,7 @@ class Tracker(object):
         """
         header = CommandHeader(cmd=TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ALL)
         cmd = Command(pool=self.pool, header=header)
-        resp, resp_size = cmd.execute()
-        server_count = (resp_size - FDFS_GROUP_NAME_MAX_LEN) / (IP_ADDRESS_SIZE + TRACKER_PROTO_PKG_LEN_SIZE)
-        recv_fmt = '!%ds %ds %dQ B' % (FDFS_GROUP_NAME_MAX_LEN, server_count * IP_ADDRESS_SIZE, server_count)
-        result = cmd.unpack(recv_fmt, resp)
-
-        group_name = result[0]
-        current_write_path = result[-1]
-        si_list = []
-        for idx in xrange(server_count):
-            si = BasicStorageInfo()
-            si.group_name = group_name
-            si.current_write_path = current_write_path
-            si.ip_addr = result[idx + 1]
-            si.port = result[idx + 1 + server_count]
-            si_list.append(si)
-        return si_list
+        return self._fetch_store_all(cmd)
 
     def query_store_with_group_all(self, group_name):
         """
@@ -138,22 +151,7 @@ class Tracker(object):
                                cmd=TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ALL)
         cmd = Command(pool=self.pool, header=header, fmt='!%ds' % FDFS_GROUP_NAME_MAX_LEN)
         cmd.pack(group_name)
-        resp, resp_size = cmd.execute()
-        server_count = (resp_size - FDFS_GROUP_NAME_MAX_LEN) / (IP_ADDRESS_SIZE + TRACKER_PROTO_PKG_LEN_SIZE)
-        recv_fmt = '!%ds %ds %dQ B' % (FDFS_GROUP_NAME_MAX_LEN, server_count * IP_ADDRESS_SIZE, server_count)
-        result = cmd.unpack(recv_fmt, resp)
-
-        group_name = result[0]
-        current_write_path = result[-1]
-        si_list = []
-        for idx in xrange(server_count):
-            si = BasicStorageInfo()
-            si.group_name = group_name
-            si.current_write_path = current_write_path
-            si.ip_addr = result[idx + 1]
-            si.port = result[idx + 1 + server_count]
-            si_list.append(si)
-        return si_list
+        return self._fetch_store_all(cmd)
 
     def query_fetch_one(self, group_name, file_name):
         """
@@ -167,14 +165,37 @@ class Tracker(object):
               @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
            # response body: BasicStorageInfo
         """
-        file_name_size = len(file_name)
+        file_name_size = len(to_bytes(file_name))
         header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_size,
                                cmd=TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ONE)
         cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_size))
-        recv_fmt = '!%ds %ds Q' % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE)
+        recv_fmt = '!%ds %ds Q' % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE - 1)
         cmd.pack(group_name, file_name)
         si = BasicStorageInfo()
-        si.group_name, si.ip_addr, si.port = cmd.fetch_by_fmt(recv_fmt)
+        si.group_name, si.ip_addr, si.storage_port = cmd.fetch_by_fmt(recv_fmt)
+        return si
+
+    def query_update(self, group_name, file_name):
+        """
+        :param group_name: which group
+        :param file_name: which file
+        :return: BasicStorageInfo
+
+        * TRACKER_PROTO_CMD_SERVICE_QUERY_UPDATE
+           # function: query the source storage server of the file, to update or delete it
+           # request body:
+              @ FDFS_GROUP_NAME_MAX_LEN bytes: group name
+              @ filename bytes: filename
+           # response body: BasicStorageInfo
+        """
+        file_name_size = len(to_bytes(file_name))
+        header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_size,
+                               cmd=TRACKER_PROTO_CMD_SERVICE_QUERY_UPDATE)
+        cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_size))
+        recv_fmt = '!%ds %ds Q' % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE - 1)
+        cmd.pack(group_name, file_name)
+        si = BasicStorageInfo()
+        si.group_name, si.ip_addr, si.storage_port = cmd.fetch_by_fmt(recv_fmt)
         return si
 
     def query_fetch_all(self, group_name, file_name):
@@ -190,30 +211,60 @@ class Tracker(object):
               @ filename bytes: filename
            # response body: List<BasicStorageInfo>
         """
-        file_name_size = len(file_name)
+        file_name_size = len(to_bytes(file_name))
         header = CommandHeader(req_pkg_len=FDFS_GROUP_NAME_MAX_LEN + file_name_size,
                                cmd=TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ALL)
         cmd = Command(pool=self.pool, header=header, fmt="!%ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, file_name_size))
         cmd.pack(group_name, file_name)
-        resp, resp_size = cmd.execute()
-        server_count = (resp_size - FDFS_GROUP_NAME_MAX_LEN - 1 - TRACKER_PROTO_PKG_LEN_SIZE
-                        - IP_ADDRESS_SIZE) / IP_ADDRESS_SIZE
-        recv_fmt = '!%ds %ds Q %ds' % (FDFS_GROUP_NAME_MAX_LEN,
-                                       IP_ADDRESS_SIZE,
-                                       server_count * IP_ADDRESS_SIZE)
-        result = cmd.unpack(recv_fmt, resp)
+        with cmd.response() as (resp, resp_size):
+            server_count = (resp_size - FDFS_GROUP_NAME_MAX_LEN - TRACKER_PROTO_PKG_LEN_SIZE
+                            - (IP_ADDRESS_SIZE - 1)) // (IP_ADDRESS_SIZE - 1)
+            recv_fmt = '!%ds %ds Q %s' % (FDFS_GROUP_NAME_MAX_LEN,
+                                          IP_ADDRESS_SIZE - 1,
+                                          '%ds ' % (IP_ADDRESS_SIZE - 1) * server_count)
+            result = cmd.unpack(recv_fmt, resp)
         group_name = result[0]
         server_port = result[2]
         si_list = []
         si = BasicStorageInfo()
         si.group_name = group_name
         si.ip_addr = result[1]
-        si.port = server_port
+        si.storage_port = server_port
         si_list.append(si)
-        for idx in xrange(server_count):
+        for idx in range(server_count):
             si = BasicStorageInfo()
             si.group_name = group_name
             si.ip_addr = result[idx + 3]
-            si.port = server_port
+            si.storage_port = server_port
             si_list.append(si)
         return si_list
+
+    def fetch_storage_ids(self):
+        """
+        :return: List<StorageIdInfo>
+
+        * TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS
+           # function: list the storage ids of storage_ids.conf, a page at a time
+           # request body:
+              @ 4 bytes: start index
+           # response body:
+              @ 4 bytes: total count
+              @ 4 bytes: count of this page
+              @ one "id group_name ip_addr" line per storage server
+           # the tracker answers EPERM when use_storage_id is off
+        """
+        id_list = []
+        while 1:
+            header = CommandHeader(req_pkg_len=4, cmd=TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS)
+            cmd = Command(pool=self.pool, header=header, fmt="!i")
+            cmd.pack(len(id_list))
+            with cmd.response() as (resp, resp_size):
+                total_count, current_count = cmd.unpack("!i i", bytes(resp[:8]))
+                lines = bytes(resp[8:resp_size]).splitlines()
+            for line in lines[:current_count]:
+                if line.strip():
+                    info = StorageIdInfo()
+                    info.set_line(line)
+                    id_list.append(info)
+            if current_count <= 0 or len(id_list) >= total_count:
+                return id_list
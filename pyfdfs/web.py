@@ -0,0 +1,199 @@
+# coding=utf-8
+"""
+Serve fast dfs files over HTTP from a python web tier.
+
+    application = FdfsWSGIApp(FdfsClient(["192.168.0.81:22122"]))
+
+answers GET /group1/M00/00/00/xxx.jpg with the file streamed from a storage
+server chunk_size bytes at a time, so memory stays bounded whatever the file
+size. A Range header is mapped to the offset and length of the download
+request. pyfdfs.asgi has the same for ASGI servers (python 3 only).
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import re
+import io
+import errno
+import mimetypes
+
+try:
+    from http.client import responses
+except ImportError:
+    from httplib import responses
+
+from pyfdfs.command import ServerError
+
+RANGE_RE = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(value, size):
+    """
+    :param value: value of the Range header, can be null
+    :param size: file size
+    :return: (offset, length) of the range, None to send the whole file
+
+    a single byte range is supported, other ranges (several ranges, other units)
+    are ignored and the whole file is sent, as HTTP allows
+    """
+    match = RANGE_RE.match(value or "")
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise RangeNotSatisfiable(value)
+        offset = max(size - int(last), 0)
+        return offset, size - offset
+    offset = int(first)
+    if offset >= size:
+        raise RangeNotSatisfiable(value)
+    last = min(int(last), size - 1) if last else size - 1
+    if last < offset:
+        return None
+    return offset, last - offset + 1
+
+
+class _FileSlice(object):
+    """
+    length bytes of a file object from its current position
+    """
+
+    def __init__(self, f_obj, length):
+        self.f_obj = f_obj
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        chunk = self.f_obj.read(size) if size > 0 else b""
+        self.remaining -= len(chunk)
+        return chunk
+
+    def close(self):
+        self.f_obj.close()
+
+
+def open_response(client, group_name, file_name, range_header=None, chunk_size=64 * 1024, head=False):
+    """
+    :param client: FdfsClient
+    :param range_header: value of the Range header of the request
+    :param head: HEAD request, the body is empty
+    :return: (status code, [(header, value)], body), body is file-like: read(size) and close()
+
+    the local cache of the client serves the file when it has it
+    """
+    headers = [("Accept-Ranges", "bytes"),
+               ("Content-Type", mimetypes.guess_type(file_name)[0] or "application/octet-stream")]
+    try:
+        size = None
+        byte_range = None
+        if range_header or head:
+            size = client.content_size(group_name, file_name)
+            byte_range = parse_range(range_header, size)
+        offset, length = byte_range or (0, 0)
+        if head:
+            body = io.BytesIO(b"")
+            content_length = length or size
+        else:
+            body = None
+            f_obj = client.cache.open(group_name, file_name) if client.cache is not None else None
+            if f_obj is not None:
+                f_obj.seek(offset)
+                body = f_obj if byte_range is None else _FileSlice(f_obj, length)
+                content_length = length or os.fstat(f_obj.fileno()).st_size
+            if body is None:
+                body = client.download_stream(group_name, file_name, offset, length, chunk_size)
+                content_length = body.length
+    except RangeNotSatisfiable:
+        return 416, [("Content-Range", "bytes */%d" % size)] + headers[:1], io.BytesIO(b"")
+    except ServerError as e:
+        if e.status == errno.ENOENT:
+            return 404, [("Content-Length", "0")], io.BytesIO(b"")
+        raise
+    headers.append(("Content-Length", "%d" % content_length))
+    if byte_range is None:
+        return 200, headers, body
+    headers.append(("Content-Range", "bytes %d-%d/%d" % (offset, offset + length - 1, size)))
+    return 206, headers, body
+
+
+def split_path(path):
+    """
+    :param path: /group_name/file_name
+    :return: (group_name, file_name), None for an invalid path
+    """
+    parts = path.lstrip("/").split("/", 1)
+    if len(parts) != 2 or not parts[0] or not parts[1]:
+        return None
+    return parts[0], parts[1]
+
+
+def read_bytes(body, size):
+    """
+    :return: next chunk of the body as bytes, the type WSGI and ASGI servers require,
+             a ResponseStream may read into a bytearray
+    """
+    chunk = body.read(size)
+    return chunk if isinstance(chunk, bytes) else bytes(chunk)
+
+
+def status_line(status):
+    return "%d %s" % (status, responses.get(status, ""))
+
+
+class FdfsWSGIApp(object):
+    """
+    WSGI application serving GET and HEAD /group_name/file_name, see the module doc
+    """
+
+    def __init__(self, client, chunk_size=64 * 1024):
+        self.client = client
+        self.chunk_size = chunk_size
+
+    def __call__(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD", "GET")
+        if method not in ("GET", "HEAD"):
+            start_response(status_line(405), [("Allow", "GET, HEAD"), ("Content-Length", "0")])
+            return []
+        file_id = split_path(environ.get("PATH_INFO", ""))
+        if file_id is None:
+            start_response(status_line(404), [("Content-Length", "0")])
+            return []
+        status, headers, body = open_response(self.client, file_id[0], file_id[1], environ.get("HTTP_RANGE"),
+                                              self.chunk_size, method == "HEAD")
+        start_response(status_line(status), headers)
+        body = _iter_body(body, self.chunk_size)
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if file_wrapper is not None:
+            return file_wrapper(body, self.chunk_size)
+        return body
+
+
+class _iter_body(object):
+    """
+    iterable over a file-like body, and file-like itself for wsgi.file_wrapper, reading bytes;
+    closed by the server once the response is sent
+    """
+
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        while 1:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        return read_bytes(self.body, size)
+
+    def close(self):
+        self.body.close()
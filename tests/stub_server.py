@@ -0,0 +1,276 @@
+# coding=utf-8
+"""
+In-process stub speaking the fast dfs protocol, acting both as tracker and as
+the single storage server of group "group1". Only meant for tests.
+"""
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import zlib
+import errno
+import struct
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from pyfdfs.command import CommandHeader
+from pyfdfs.enums import FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE, FDFS_FILE_EXT_NAME_MAX_LEN, \
+    TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ONE, TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ONE, \
+    TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ALL, TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ALL, \
+    TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ONE, TRACKER_PROTO_CMD_SERVICE_QUERY_UPDATE, \
+    TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ALL, STORAGE_PROTO_CMD_UPLOAD_FILE, STORAGE_PROTO_CMD_GET_METADATA, \
+    STORAGE_PROTO_CMD_RESP, STORAGE_PROTO_CMD_DELETE_FILE, STORAGE_PROTO_CMD_SET_METADATA, \
+    STORAGE_PROTO_CMD_CREATE_LINK, FDFS_FILE_PREFIX_MAX_LEN, STORAGE_PROTO_CMD_DOWNLOAD_FILE, \
+    STORAGE_PROTO_CMD_QUERY_FILE_INFO, STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG, \
+    TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS, STORAGE_SET_METADATA_FLAG_MERGE, FDFS_RECORD_SEPARATOR, \
+    FDFS_FIELD_SEPARATOR
+
+GROUP_NAME = "group1"
+
+
+class StubHandler(socketserver.BaseRequestHandler):
+    commands = {
+        TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ONE: "query_store",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ONE: "query_store",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITHOUT_GROUP_ALL: "query_store_all",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_STORE_WITH_GROUP_ALL: "query_store_all",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ONE: "query_fetch",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_UPDATE: "query_fetch",
+        TRACKER_PROTO_CMD_SERVICE_QUERY_FETCH_ALL: "query_fetch_all",
+        STORAGE_PROTO_CMD_UPLOAD_FILE: "upload_file",
+        STORAGE_PROTO_CMD_GET_METADATA: "get_meta",
+        STORAGE_PROTO_CMD_SET_METADATA: "set_meta",
+        STORAGE_PROTO_CMD_DELETE_FILE: "delete_file",
+        STORAGE_PROTO_CMD_CREATE_LINK: "create_link",
+        STORAGE_PROTO_CMD_DOWNLOAD_FILE: "download_file",
+        STORAGE_PROTO_CMD_QUERY_FILE_INFO: "query_file_info",
+        STORAGE_PROTO_CMD_FETCH_ONE_PATH_BINLOG: "fetch_one_path_binlog",
+        TRACKER_PROTO_CMD_STORAGE_FETCH_STORAGE_IDS: "fetch_storage_ids",
+    }
+
+    def recv_exactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.request.recv(min(size, 65536))
+            if not chunk:
+                raise EOFError()
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def reply(self, body=b"", status=0):
+        header = CommandHeader(req_pkg_len=len(body), cmd=STORAGE_PROTO_CMD_RESP, status=status)
+        self.request.sendall(header.pack_req() + body)
+
+    def handle(self):
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+        header = CommandHeader()
+        while 1:
+            try:
+                header.unpack_resp(self.recv_exactly(header.resp_header_len()))
+                body = self.recv_exactly(header.resp_pkg_len)
+            except (EOFError, IOError):
+                return
+            handler = getattr(self, self.commands.get(header.cmd, ""), None)
+            if handler is None:
+                self.reply(status=errno.EINVAL)
+                continue
+            with self.server.lock:
+                self.server.stats["requests"] += 1
+            try:
+                handler(body)
+            except IOError:
+                # the client went away, e.g. the loser of a hedged read
+                return
+
+    def storage_address(self):
+        host, port = self.server.server_address
+        return struct.pack("!%ds %ds Q" % (FDFS_GROUP_NAME_MAX_LEN, IP_ADDRESS_SIZE - 1),
+                           GROUP_NAME.encode(), host.encode(), port)
+
+    def query_store(self, body):
+        self.reply(self.storage_address() + struct.pack("!B", 0))
+
+    def query_store_all(self, body):
+        servers = b"".join(struct.pack("!%ds Q" % (IP_ADDRESS_SIZE - 1), server.server_address[0].encode(),
+                                       server.server_address[1])
+                           for server in [self.server] + self.server.peers)
+        self.reply(struct.pack("!%ds" % FDFS_GROUP_NAME_MAX_LEN, GROUP_NAME.encode()) + servers + struct.pack("!B", 0))
+
+    def query_fetch(self, body):
+        self.reply(self.storage_address())
+
+    def query_fetch_all(self, body):
+        """
+        this server first, then its peers, which listen on the same port
+        """
+        peers = b"".join(struct.pack("!%ds" % (IP_ADDRESS_SIZE - 1), peer.server_address[0].encode())
+                         for peer in self.server.peers)
+        self.reply(self.storage_address() + peers)
+
+    def upload_file(self, body):
+        """
+        @ 1 byte: store path index, 8 bytes: meta size, 8 bytes: file size, 6 bytes: ext,
+        @ meta data, file content
+        """
+        fixed_fmt = "!B Q Q %ds" % FDFS_FILE_EXT_NAME_MAX_LEN
+        fixed_size = struct.calcsize(fixed_fmt)
+        path_idx, meta_size, file_size, ext = struct.unpack(fixed_fmt, body[:fixed_size])
+        meta = body[fixed_size:fixed_size + meta_size]
+        content = body[fixed_size + meta_size:fixed_size + meta_size + file_size]
+        with self.server.lock:
+            self.server.stats["uploads"] += 1
+        file_name = self.server.add_file(content, meta, ext)
+        self.server.log("C", file_name)
+        self.reply_file_id(file_name)
+
+    def reply_file_id(self, file_name):
+        self.reply(struct.pack("!%ds" % FDFS_GROUP_NAME_MAX_LEN, GROUP_NAME.encode()) + file_name.encode())
+
+    def get_meta(self, body):
+        file_name = body[FDFS_GROUP_NAME_MAX_LEN:].decode()
+        time.sleep(self.server.delay)
+        if file_name not in self.server.files:
+            self.reply(status=errno.ENOENT)
+            return
+        self.reply(self.server.files[file_name][1])
+
+    def download_file(self, body):
+        fixed_fmt = "!Q Q %ds" % FDFS_GROUP_NAME_MAX_LEN
+        fixed_size = struct.calcsize(fixed_fmt)
+        offset, download_bytes, group_name = struct.unpack(fixed_fmt, body[:fixed_size])
+        file_name = body[fixed_size:].decode()
+        time.sleep(self.server.delay)
+        if file_name not in self.server.files:
+            self.reply(status=errno.ENOENT)
+            return
+        content = self.server.files[file_name][0]
+        self.reply(content[offset:offset + download_bytes] if download_bytes else content[offset:])
+
+    def query_file_info(self, body):
+        file_name = body[FDFS_GROUP_NAME_MAX_LEN:].decode()
+        if file_name not in self.server.files:
+            self.reply(status=errno.ENOENT)
+            return
+        content = self.server.files[file_name][0]
+        # a storage server keeps the crc32 in a signed int and sends it sign extended
+        crc32 = zlib.crc32(content) & 0xffffffff
+        self.reply(struct.pack("!Q Q q %ds" % IP_ADDRESS_SIZE, len(content), int(time.time()),
+                               crc32 - (1 << 32) if crc32 >= 1 << 31 else crc32,
+                               self.server.server_address[0].encode()))
+
+    def set_meta(self, body):
+        fixed_fmt = "!Q Q c %ds" % FDFS_GROUP_NAME_MAX_LEN
+        fixed_size = struct.calcsize(fixed_fmt)
+        file_name_len, meta_len, flag, group_name = struct.unpack(fixed_fmt, body[:fixed_size])
+        file_name = body[fixed_size:fixed_size + file_name_len].decode()
+        if file_name not in self.server.files:
+            self.reply(status=errno.ENOENT)
+            return
+        content, meta = self.server.files[file_name]
+        new_meta = body[fixed_size + file_name_len:]
+        if flag == STORAGE_SET_METADATA_FLAG_MERGE.encode() and meta:
+            items = dict(record.split(FDFS_FIELD_SEPARATOR, 1) for record in meta.split(FDFS_RECORD_SEPARATOR))
+            items.update(record.split(FDFS_FIELD_SEPARATOR, 1) for record in new_meta.split(FDFS_RECORD_SEPARATOR)
+                         if new_meta)
+            new_meta = FDFS_RECORD_SEPARATOR.join(name + FDFS_FIELD_SEPARATOR + value
+                                                  for name, value in sorted(items.items()))
+        self.server.files[file_name] = (content, new_meta)
+        self.reply()
+
+    def delete_file(self, body):
+        file_name = body[FDFS_GROUP_NAME_MAX_LEN:].decode()
+        if self.server.files.pop(file_name, None) is None:
+            self.reply(status=errno.ENOENT)
+            return
+        self.server.log("D", file_name)
+        self.reply()
+
+    def create_link(self, body):
+        fixed_fmt = "!Q Q Q %ds %ds %ds" % (FDFS_GROUP_NAME_MAX_LEN, FDFS_FILE_PREFIX_MAX_LEN,
+                                            FDFS_FILE_EXT_NAME_MAX_LEN)
+        fixed_size = struct.calcsize(fixed_fmt)
+        master_len, src_len, signature_len, group_name, prefix, ext = struct.unpack(fixed_fmt, body[:fixed_size])
+        src_file_name = body[fixed_size + master_len:fixed_size + master_len + src_len].decode()
+        if src_file_name not in self.server.files:
+            self.reply(status=errno.ENOENT)
+            return
+        with self.server.lock:
+            self.server.stats["links"] += 1
+        file_name = self.server.add_file(self.server.files[src_file_name][0], b"", ext)
+        self.server.log("L", file_name, src_file_name)
+        self.reply_file_id(file_name)
+
+    def fetch_one_path_binlog(self, body):
+        with self.server.lock:
+            binlog = b"".join(self.server.binlog)
+        self.reply(binlog)
+
+    def fetch_storage_ids(self, body):
+        """
+        @ 4 bytes: start index, answered two lines of server.storage_ids at a time
+        """
+        if not self.server.storage_ids:
+            self.reply(status=errno.EPERM)
+            return
+        start, = struct.unpack("!i", body)
+        lines = self.server.storage_ids[start:start + 2]
+        self.reply(struct.pack("!i i", len(self.server.storage_ids), len(lines)) +
+                   b"".join(line.encode() + b"\n" for line in lines))
+
+
+class StubServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, handler_cls=StubHandler, host="127.0.0.1", port=0, files=None, delay=0):
+        """
+        :param files: share the files of another server, to act as its replica
+        :param delay: seconds slept before answering a read
+        """
+        socketserver.TCPServer.__init__(self, (host, port), handler_cls)
+        self.lock = threading.Lock()
+        self.files = files if files is not None else {}
+        self.delay = delay
+        self.peers = []
+        self.binlog = []
+        self.storage_ids = []
+        self.stats = {"connections": 0, "requests": 0, "uploads": 0, "links": 0}
+        self.thread = None
+        self._file_count = 0
+
+    def add_file(self, content, meta, ext):
+        with self.lock:
+            self._file_count += 1
+            file_name = "M00/00/00/%08d.%s" % (self._file_count, ext.rstrip(b"\x00").decode())
+            self.files[file_name] = (content, meta)
+        return file_name
+
+    def log(self, op_type, file_name, src_file_name=None):
+        """
+        append a binlog record, see pyfdfs.binlog
+        """
+        fields = ["%d" % time.time(), op_type, file_name] + ([src_file_name] if src_file_name else [])
+        with self.lock:
+            self.binlog.append((" ".join(fields) + "\n").encode())
+
+    @property
+    def address(self):
+        return "%s:%s" % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
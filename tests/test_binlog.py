@@ -0,0 +1,97 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true
+from pyfdfs.binlog import BinlogParser, ChangeFeed, OffsetStore, OP_CREATE, OP_DELETE, OP_LINK
+from pyfdfs.client import FdfsClient
+from tests.stub_server import StubServer
+
+BINLOG = (b"1500000000 C M00/00/00/a.jpg\n"
+          b"1500000001 c 00/00/b.jpg\n"
+          b"garbage\n"
+          b"1500000002 L M00/00/00/c.jpg M00/00/00/a.jpg\n"
+          b"1500000003 D M00/00/00/a.jpg\n")
+
+
+class TestBinlogParser(unittest.TestCase):
+    def test_chunks(self):
+        for chunk_size in (1, 7, len(BINLOG)):
+            parser = BinlogParser("group1")
+            records = []
+            for idx in range(0, len(BINLOG), chunk_size):
+                records.extend(parser.feed(BINLOG[idx:idx + chunk_size]))
+            assert_equal([(record.op, record.file_id, record.replica) for record in records], [
+                (OP_CREATE, "group1/M00/00/00/a.jpg", False),
+                (OP_CREATE, "group1/M00/00/00/b.jpg", True),
+                (OP_LINK, "group1/M00/00/00/c.jpg", False),
+                (OP_DELETE, "group1/M00/00/00/a.jpg", False),
+            ])
+            assert_equal(records[2].src_file_id, "group1/M00/00/00/a.jpg")
+            assert_equal(records[-1].offset, len(BINLOG))
+            assert_equal(parser.errors, 1)
+
+    def test_partial_line(self):
+        parser = BinlogParser("group1")
+        assert_equal(len(parser.feed(b"1500000000 C M00/00/00/a.jpg\n1500000001 D M00")), 1)
+        assert_equal(parser.offset, len(b"1500000000 C M00/00/00/a.jpg\n"))
+        records = parser.feed(b"/00/00/a.jpg\n")
+        assert_equal([record.op for record in records], [OP_DELETE])
+        assert_equal(parser.offset, len(b"1500000000 C M00/00/00/a.jpg\n1500000001 D M00/00/00/a.jpg\n"))
+
+
+class TestChangeFeed(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address])
+        self.store = OffsetStore(os.path.join(self.tmp_dir, "offsets.json"))
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def feed(self):
+        return ChangeFeed(self.client, "group1", offset_store=OffsetStore(self.store.path), chunk_size=16)
+
+    def test_incremental(self):
+        first = self.client.upload_file_by_buffer(b"first", "txt")
+        second = self.client.upload_file_by_buffer(b"second", "txt")
+        assert_equal([record.file_id for record in self.feed().poll()],
+                     ["group1/%s" % first.filename, "group1/%s" % second.filename])
+        self.client.delete_file("group1", first.filename)
+        # a new feed resumes from the saved offset
+        records = list(self.feed().poll())
+        assert_equal([(record.op, record.file_id) for record in records],
+                     [(OP_DELETE, "group1/%s" % first.filename)])
+        assert_equal(list(self.feed().poll()), [])
+
+    def test_at_least_once(self):
+        for content in (b"a", b"b", b"c"):
+            self.client.upload_file_by_buffer(content, "txt")
+        feed = self.feed()
+        seen = []
+        try:
+            for record in feed.poll():
+                if len(seen) == 1:
+                    raise IOError("index down")
+                seen.append(record.file_id)
+        except IOError:
+            pass
+        # the record that failed comes back
+        assert_equal(len(list(self.feed().poll())), 2)
+
+    def test_rewritten(self):
+        self.client.upload_file_by_buffer(b"a", "txt")
+        list(self.feed().poll())
+        self.server.binlog[0] = self.server.binlog[0].replace(b" C ", b" c ")
+        feed = self.feed()
+        assert_equal(len(list(feed.poll())), 1)
+        assert_equal(feed.resets, 1)
@@ -0,0 +1,113 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import socket
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises, assert_less
+from pyfdfs.breaker import CircuitBreaker, CircuitOpen, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+from pyfdfs.client import FdfsClient
+from pyfdfs.connection import ConnectionPool
+from tests.stub_server import StubServer
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_states(self):
+        breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_timeout=0.1)
+        for ok in (True, False, True):
+            breaker.record(ok)
+        assert_equal(breaker.state, STATE_CLOSED)
+        breaker.record(False)
+        assert_equal(breaker.state, STATE_OPEN)
+        assert_false(breaker.allow())
+        assert_raises(CircuitOpen, breaker.check)
+        time.sleep(0.15)
+        assert_true(breaker.available())
+        assert_true(breaker.allow())
+        assert_equal(breaker.state, STATE_HALF_OPEN)
+        assert_false(breaker.allow())
+        breaker.record(False)
+        assert_equal(breaker.state, STATE_OPEN)
+        time.sleep(0.15)
+        assert_true(breaker.allow())
+        breaker.record(True)
+        assert_equal(breaker.state, STATE_CLOSED)
+
+    def test_abandoned_trial(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.1)
+        breaker.record(False)
+        time.sleep(0.15)
+        assert_true(breaker.allow())
+        # the outcome of the trial is never recorded
+        assert_false(breaker.allow())
+        assert_false(breaker.available())
+        time.sleep(0.15)
+        assert_true(breaker.available())
+        assert_true(breaker.allow())
+        assert_equal(breaker.state, STATE_HALF_OPEN)
+        breaker.record(True)
+        assert_equal(breaker.state, STATE_CLOSED)
+
+    def test_window(self):
+        breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4)
+        for ok in (False, True, True, True, False, True, True, True):
+            breaker.record(ok)
+        assert_equal(breaker.state, STATE_CLOSED)
+
+
+class TestPoolBreaker(unittest.TestCase):
+    def test_dead_endpoint_fails_fast(self):
+        pool = ConnectionPool(hosts=[("127.0.0.1", free_port())], timeout=5,
+                              breaker=CircuitBreaker(min_calls=3, reset_timeout=60))
+        assert_raises(Exception, pool.get_connection)
+        assert_equal(pool.breaker.state, STATE_OPEN)
+        start = time.time()
+        assert_raises(CircuitOpen, pool.get_connection)
+        assert_less(time.time() - start, 0.1)
+        assert_equal(pool._created_connections, 0)
+
+    def test_server_errors_keep_closed(self):
+        server = StubServer().start()
+        try:
+            client = FdfsClient([server.address], breaker_cls=CircuitBreaker)
+            for _ in range(10):
+                assert_raises(Exception, client.get_meta, "group1", "M00/00/00/missing.txt")
+            storage = list(client.storage_servers.values())[0]
+            assert_equal(storage.pool.breaker.state, STATE_CLOSED)
+            assert_equal(server.stats["connections"], 2)
+        finally:
+            server.stop()
+
+
+class TestRedirect(unittest.TestCase):
+    def setUp(self):
+        self.primary = StubServer().start()
+        self.replica = StubServer(host="127.0.0.2", port=self.primary.server_address[1],
+                                  files=self.primary.files).start()
+        self.primary.peers.append(self.replica)
+        self.file_name = self.primary.add_file(b"content", b"", b"txt")
+
+    def tearDown(self):
+        self.primary.stop()
+        self.replica.stop()
+
+    def test_open_breaker_redirects(self):
+        client = FdfsClient([self.primary.address], breaker_cls=CircuitBreaker)
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"content")
+        primary = client.storage_servers[self.primary.server_address]
+        primary.pool.breaker._open()
+        requests = self.replica.stats["requests"]
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"content")
+        sr = client.upload_file_by_buffer(b"redirected", "txt")
+        assert_equal(self.replica.stats["requests"], requests + 2)
+        assert_equal(self.primary.files[sr.filename][0], b"redirected")
@@ -0,0 +1,137 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+import unittest
+from nose.tools import assert_equal, assert_true, assert_raises
+from pyfdfs.budget import MemoryBudget, BudgetExceeded
+from pyfdfs.buffers import BufferPool
+from pyfdfs.client import FdfsClient
+from pyfdfs.deadline import DeadlineExceeded, deadline
+from tests.stub_server import StubServer
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_reserve_and_release(self):
+        budget = MemoryBudget(1000, wait_timeout=0, min_size=10)
+        assert_equal(budget.reserve(5), 0)
+        first = budget.reserve(600)
+        assert_equal(first, 600)
+        assert_raises(BudgetExceeded, budget.reserve, 500)
+        with budget.hold(400):
+            assert_equal(budget.in_use, 1000)
+        budget.release(first)
+        # larger than the whole budget: granted once nothing else is in flight
+        with budget.hold(5000):
+            assert_equal(budget.in_use, 5000)
+        snapshot = budget.snapshot()
+        assert_equal((snapshot["in_use"], snapshot["peak"]), (0, 5000))
+        assert_equal((snapshot["reservations"], snapshot["rejected"]), (3, 1))
+
+    def test_wait(self):
+        budget = MemoryBudget(1000, min_size=1)
+        held = budget.hold(800)
+        order = []
+
+        def reserve(name, nbytes):
+            with budget.hold(nbytes):
+                order.append(name)
+
+        threads = [threading.Thread(target=reserve, args=("large", 900))]
+        threads[0].start()
+        while budget.waiting < 1:
+            time.sleep(0.01)
+        # would fit, but waits behind the first waiter
+        threads.append(threading.Thread(target=reserve, args=("small", 100)))
+        threads[1].start()
+        while budget.waiting < 2:
+            time.sleep(0.01)
+        assert_equal(order, [])
+        held.release()
+        for thread in threads:
+            thread.join(5)
+        assert_equal(order, ["large", "small"])
+        assert_equal((budget.in_use, budget.waits), (0, 2))
+
+    def test_timeouts(self):
+        budget = MemoryBudget(1000, wait_timeout=0.05, min_size=1)
+        with budget.hold(1000):
+            assert_raises(BudgetExceeded, budget.reserve, 10)
+            with deadline(0.05):
+                assert_raises(DeadlineExceeded, budget.reserve, 10, None)
+            assert_equal(budget.waiting, 0)
+        assert_equal(budget.reserve(10, 0), 10)
+
+
+class TestClientBudget(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.budget = MemoryBudget(1024 * 1024, wait_timeout=0, min_size=1024)
+        self.client = FdfsClient([self.server.address], budget=self.budget)
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_round_trip(self):
+        content = b"x" * 300 * 1024
+        sr = self.client.upload_file_by_buffer(content, "bin")
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), content)
+        chunks = list(self.client.download_stream(sr.group_name, sr.filename, chunk_size=64 * 1024))
+        assert_equal(b"".join(chunks), content)
+        assert_equal(self.budget.in_use, 0)
+        assert_equal(self.budget.peak, len(content))
+        assert_equal(self.budget.reservations, 2 + len(chunks))
+
+    def test_fail_fast(self):
+        sr = self.client.upload_file_by_buffer(b"y" * 4096, "bin")
+        with self.budget.hold(1024 * 1024):
+            # refused before anything is sent
+            assert_raises(BudgetExceeded, self.client.upload_file_by_buffer, b"z" * 4096, "bin")
+            assert_equal(self.server.stats["uploads"], 1)
+            assert_raises(BudgetExceeded, self.client.download_to_buffer, sr.group_name, sr.filename)
+            # under min_size: not counted
+            self.client.get_meta(sr.group_name, sr.filename)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"y" * 4096)
+        assert_equal(self.budget.in_use, 0)
+
+    def test_wait_holds_no_connection(self):
+        client = FdfsClient([self.server.address], max_conn=1, wait_timeout=1,
+                            budget=MemoryBudget(1024 * 1024, min_size=1024))
+        results = []
+        thread = threading.Thread(target=lambda: results.append(client.upload_file_by_buffer(b"z" * 4096, "bin")))
+        thread.daemon = True
+        try:
+            sr = client.upload_file_by_buffer(b"y" * 4096, "bin")
+            with client.budget.hold(1024 * 1024):
+                thread.start()
+                while client.budget.waiting < 1:
+                    time.sleep(0.01)
+                # the upload waiting for the budget leaves the only storage connection to others
+                started = time.time()
+                assert_equal(client.get_meta(sr.group_name, sr.filename), {})
+                assert_true(time.time() - started < 0.5)
+            thread.join(5)
+            assert_equal(len(results), 1)
+            assert_equal(self.server.stats["uploads"], 2)
+        finally:
+            for pool in client._pools():
+                pool.destroy()
+
+    def test_refused_releases_request(self):
+        buffers = BufferPool(debug=True)
+        client = FdfsClient([self.server.address], buffer_pool=buffers,
+                            budget=MemoryBudget(1024 * 1024, wait_timeout=0, min_size=1024))
+        try:
+            with client.budget.hold(1024 * 1024):
+                # meta data large enough for a pooled request slab
+                assert_raises(BudgetExceeded, client.upload_file_by_buffer, b"z" * 4096, "bin",
+                              meta_data={"k": "v" * 3000})
+            buffers.check_leaks()
+        finally:
+            for pool in client._pools():
+                pool.destroy()
@@ -0,0 +1,113 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import unittest
+from nose.tools import assert_equal, assert_true, assert_raises
+from pyfdfs.buffers import BufferPool, BufferLeak
+from pyfdfs.client import FdfsClient
+from pyfdfs.command import ServerError
+from pyfdfs.connection import Connection
+from pyfdfs.storage import Storage
+from tests.stub_server import StubServer
+
+
+class BrokenBodyConnection(Connection):
+    """
+    fails reading any response body large enough for a pooled slab
+    """
+
+    def recv_into(self, view, buffer_size=65536, checksum=None):
+        if len(view) >= 2048:
+            raise Exception("Error: connection broken")
+        return Connection.recv_into(self, view, buffer_size, checksum)
+
+
+class FakePeer(object):
+    def __init__(self, idx):
+        self.server_address = ("10.0.%d.%d" % (idx // 256, idx % 256), 23000)
+
+
+class TestBufferPool(unittest.TestCase):
+    def test_size_classes(self):
+        pool = BufferPool(size_classes=(64, 1024), max_free=1)
+        slab = pool.acquire(10)
+        assert_equal(len(slab), 64)
+        pool.release(slab)
+        assert_true(pool.acquire(64) is slab)
+        assert_equal(len(pool.acquire(65)), 1024)
+        # above the largest class: allocated, never kept
+        large = pool.acquire(5000)
+        assert_equal(len(large), 5000)
+        pool.release(large)
+        assert_equal((pool.allocations, pool.reuses), (3, 1))
+
+    def test_max_free(self):
+        pool = BufferPool(size_classes=(64,), max_free=1)
+        first, second = pool.acquire(1), pool.acquire(1)
+        pool.release(first)
+        pool.release(second)
+        assert_true(pool.acquire(1) is first)
+        assert_equal(pool.allocations, 2)
+        assert_true(pool.acquire(1) is not second)
+
+    def test_debug(self):
+        pool = BufferPool(size_classes=(64,), debug=True)
+        slab = pool.acquire(8)
+        slab[:4] = b"data"
+        assert_equal(len(pool.leaks()), 1)
+        assert_raises(BufferLeak, pool.check_leaks)
+        pool.release(slab)
+        pool.check_leaks()
+        # given back buffers are poisoned, and can not be given back twice
+        assert_equal(bytes(slab[:4]), b"\xdd" * 4)
+        assert_raises(BufferLeak, pool.release, slab)
+
+
+class TestClientBuffers(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.buffers = BufferPool(debug=True)
+        self.client = FdfsClient([self.server.address], buffer_pool=self.buffers, checksum="crc32")
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_round_trip(self):
+        for size in (10, 5000, 300 * 1024):
+            content = bytearray(b"x") * size
+            sr = self.client.upload_file_by_buffer(content, "bin", meta_data={"size": size})
+            assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), content)
+            assert_equal(self.client.get_meta(sr.group_name, sr.filename), {"size": "%d" % size})
+            assert_equal(self.client.query_file_info(sr.group_name, sr.filename).file_size, size)
+            copy = self.client.copy_file(sr.group_name, sr.filename, chunk_size=64 * 1024, slots=2)
+            assert_equal(self.client.download_to_buffer(copy.group_name, copy.filename), content)
+        assert_raises(ServerError, self.client.query_file_info, "group1", "M00/00/00/missing.bin")
+        self.buffers.check_leaks()
+        assert_true(self.buffers.reuses > self.buffers.allocations)
+
+    def test_no_connection(self):
+        host, port = self.server.server_address
+        storage = Storage(host, port, max_conn=1, buffer_pool=self.buffers)
+        held = storage.pool.get_connection()
+        try:
+            # the pool is exhausted once the request, with meta data in a pooled slab, is packed
+            assert_raises(Exception, storage.set_meta, "M00/00/00/missing.bin", "group1", {"k": "v" * 3000})
+        finally:
+            storage.pool.release(held)
+            storage.pool.destroy()
+        self.buffers.check_leaks()
+
+    def test_broken_body(self):
+        client = FdfsClient([self.server.address], conn_cls=BrokenBodyConnection, buffer_pool=self.buffers)
+        # a query_fetch_all response over 2 KB, read into a pooled slab
+        self.server.peers = [FakePeer(idx) for idx in range(200)]
+        try:
+            assert_raises(Exception, client.tracker.query_fetch_all, "group1", "M00/00/00/missing.bin")
+        finally:
+            for pool in client._pools():
+                pool.destroy()
+        self.buffers.check_leaks()
@@ -0,0 +1,115 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true
+from pyfdfs import bulk
+from pyfdfs.compat import PY3
+from pyfdfs.bulk import BulkImporter, load_manifest, walk_files
+from tests.stub_server import StubServer
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+def _raising_upload(path):
+    raise RuntimeError("boom")
+
+
+def _unpicklable_upload(path):
+    return path, lambda: None, 0, 0, None
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_torn_line(self):
+        manifest = os.path.join(self.root, "manifest.jsonl")
+        assert_equal(load_manifest(manifest), set())
+        with open(manifest, "w") as f_obj:
+            f_obj.write(json.dumps({"path": "/a", "file_id": "group1/x", "size": 1}) + "\n")
+            f_obj.write('{"path": "/b", "fi')
+        assert_equal(load_manifest(manifest), set(["/a"]))
+
+    def test_walk_skips_done(self):
+        for name in ("a", "b", "c"):
+            with open(os.path.join(self.root, name), "w") as f_obj:
+                f_obj.write(name)
+        done = set([os.path.join(self.root, "b")])
+        assert_equal([os.path.basename(path) for path in walk_files(self.root, done)], ["a", "c"])
+
+
+class TestBulkImporter(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, "data")
+        os.makedirs(os.path.join(self.root, "sub"))
+        for name in ("a", "b", os.path.join("sub", "c")):
+            with open(os.path.join(self.root, name), "w") as f_obj:
+                f_obj.write(name * 10)
+        self.manifest = os.path.join(self.tmp, "manifest.jsonl")
+        self.upload = bulk._upload
+
+    def tearDown(self):
+        bulk._upload = self.upload
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def importer(self, hosts=None, **kwargs):
+        return BulkImporter(hosts or [self.server.address], self.manifest, workers=2, retries=0, timeout=5,
+                            queue_factor=1, out=StringIO(), **kwargs)
+
+    def test_resume(self):
+        importer = self.importer(report_interval=0)
+        stats = importer.run(self.root)
+        assert_equal((stats.files, stats.bytes, stats.failed), (3, 10 + 10 + 50, 0))
+        # a report per file as it completes, and the final one
+        assert_equal(len(importer.out.getvalue().splitlines()), 4)
+        assert_equal(self.server.stats["uploads"], 3)
+        os.remove(os.path.join(self.root, "a"))
+        with open(os.path.join(self.root, "d"), "w") as f_obj:
+            f_obj.write("d")
+        # only the new file is uploaded
+        stats = self.importer().run(self.root)
+        assert_equal((stats.files, stats.failed), (1, 0))
+        assert_equal(self.server.stats["uploads"], 4)
+        assert_equal(len(load_manifest(self.manifest)), 4)
+
+    def test_failures(self):
+        port = self.server.address.split(":")[1]
+        self.server.stop()
+        importer = self.importer(hosts=["127.0.0.1:%s" % port])
+        stats = importer.run(self.root)
+        assert_equal((stats.files, stats.failed), (0, 3))
+        assert_equal(len(importer.failures), 3)
+        assert_true("Error: " in importer.out.getvalue())
+        assert_equal(load_manifest(self.manifest), set())
+        self.server = StubServer().start()
+
+    def test_worker_raises(self):
+        # more files than slots: a failed task must give its slot back
+        bulk._upload = _raising_upload
+        importer = self.importer()
+        stats = importer.run(self.root)
+        assert_equal((stats.files, stats.failed), (0, 3))
+        assert_equal(sorted(error for path, error in importer.failures), ["boom"] * 3)
+
+    @unittest.skipIf(not PY3, "no error_callback on python 2")
+    def test_result_not_picklable(self):
+        bulk._upload = _unpicklable_upload
+        importer = self.importer()
+        stats = importer.run(self.root)
+        assert_equal((stats.files, stats.failed), (0, 3))
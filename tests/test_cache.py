@@ -0,0 +1,131 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from nose.tools import assert_equal, assert_is_none, assert_raises, assert_less
+from pyfdfs.cache import DiskCache
+from pyfdfs.client import FdfsClient
+from tests.stub_server import StubServer
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lru(self):
+        cache = DiskCache(self.tmp_dir, max_bytes=20)
+        cache.set("group1", "a", b"a" * 8)
+        cache.set("group1", "b", memoryview(b"b" * 8))
+        assert_equal(cache.get("group1", "a")[:], b"a" * 8)
+        cache.set("group1", "c", bytearray(b"c" * 8))
+        assert_is_none(cache.get("group1", "b"))
+        assert_equal(cache.size, 16)
+        assert_equal(sorted(os.listdir(self.tmp_dir)), sorted(cache._entries))
+        cache.discard("group1", "a")
+        assert_is_none(cache.get("group1", "a"))
+        assert_equal(len(DiskCache(self.tmp_dir, max_bytes=20)), 1)
+
+    def test_shared_directory(self):
+        cache = DiskCache(self.tmp_dir, max_bytes=20)
+        other = DiskCache(self.tmp_dir, max_bytes=100)
+        for name in ("a", "b", "c"):
+            other.set("group1", name, name.encode() * 8)
+        # files cached by the other process count against the bound too
+        for name in ("a", "b", "c"):
+            assert_equal(cache.read("group1", name), name.encode() * 8)
+        assert_equal(cache.size, 16)
+        assert_equal(len(os.listdir(self.tmp_dir)), 2)
+        other.set("group1", "d", b"d" * 30)
+        # larger than the whole cache: a miss, evicting nothing
+        assert_is_none(cache.path("group1", "d"))
+        assert_equal(cache.size, 16)
+
+    def test_read(self):
+        cache = DiskCache(self.tmp_dir)
+        cache.set("group1", "a", b"0123456789")
+        cache.set("group1", "empty", b"")
+        assert_equal(cache.read("group1", "a", 2, 5), b"23456")
+        assert_equal(cache.read("group1", "a", 8), b"89")
+        assert_equal(cache.read("group1", "empty"), b"")
+        assert_is_none(cache.read("group1", "missing"))
+
+    def test_sendfile(self):
+        cache = DiskCache(self.tmp_dir)
+        cache.set("group1", "a", b"0123456789")
+        a, b = socket.socketpair()
+        try:
+            assert_equal(cache.sendfile(a, "group1", "a", offset=2, count=5), 5)
+            assert_equal(b.recv(10), b"23456")
+            assert_is_none(cache.sendfile(a, "group1", "missing"))
+        finally:
+            a.close()
+            b.close()
+
+    def test_sendfile_full_socket(self):
+        cache = DiskCache(self.tmp_dir)
+        content = os.urandom(4 * 1024 * 1024)
+        cache.set("group1", "a", content)
+        received = []
+
+        def drain(sock):
+            while 1:
+                chunk = sock.recv(1 << 16)
+                if not chunk:
+                    return
+                received.append(chunk)
+        a, b = socket.socketpair()
+        try:
+            # nobody reads: the wait for room is bounded by the socket timeout
+            a.settimeout(0.1)
+            start = time.time()
+            assert_raises(socket.timeout, cache.sendfile, a, "group1", "a")
+            assert_less(time.time() - start, 1)
+        finally:
+            a.close()
+            b.close()
+        a, b = socket.socketpair()
+        a.settimeout(2)
+        reader = threading.Thread(target=drain, args=(b,))
+        reader.start()
+        try:
+            assert_equal(cache.sendfile(a, "group1", "a"), len(content))
+        finally:
+            a.close()
+            reader.join(5)
+            b.close()
+        assert_equal(b"".join(received), content)
+
+
+class TestCachedClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = StubServer().start()
+        self.file_name = self.server.add_file(b"cached content", b"", b"txt")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_through(self):
+        client = FdfsClient([self.server.address], cache=DiskCache(self.tmp_dir))
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"cached content")
+        requests = self.server.stats["requests"]
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"cached content")
+        assert_equal(client.download_to_buffer("group1", self.file_name, 7, 3), b"con")
+        assert_equal(self.server.stats["requests"], requests)
+        client.set_meta(self.file_name, {"k": "v"}, "group1")
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"cached content")
+        assert_equal(self.server.stats["requests"], requests + 4)
+        client.delete_file("group1", self.file_name)
+        assert_equal(len(client.cache), 0)
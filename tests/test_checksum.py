@@ -0,0 +1,91 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import zlib
+import hashlib
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_raises
+from pyfdfs.checksum import Checksum, ChecksumMismatch
+from pyfdfs.client import FdfsClient
+from pyfdfs.structs import FileInfo
+from tests.stub_server import StubServer, StubHandler
+
+CONTENT = os.urandom(300 * 1024)
+
+
+class CorruptHandler(StubHandler):
+    """
+    flips the last byte of the downloaded content
+    """
+
+    def reply(self, body=b"", status=0):
+        if len(body) > 1000:
+            body = body[:-1] + (b"x" if body[-1:] != b"x" else b"y")
+        StubHandler.reply(self, body, status)
+
+
+class TestChecksum(unittest.TestCase):
+    def test_update(self):
+        checksum = Checksum(sha256=True)
+        for chunk in (CONTENT[:10], bytearray(CONTENT[10:1000]), memoryview(CONTENT)[1000:]):
+            checksum.update(chunk)
+        assert_equal(checksum.size, len(CONTENT))
+        assert_equal(checksum.crc32, zlib.crc32(CONTENT) & 0xffffffff)
+        assert_equal(checksum.sha256, hashlib.sha256(CONTENT).hexdigest())
+
+    def test_verify(self):
+        checksum = Checksum()
+        checksum.update(b"abc")
+        file_info = FileInfo()
+        file_info.file_size = 3
+        # sign extended as sent by the storage server
+        file_info.crc32 = (zlib.crc32(b"abc") & 0xffffffff) | 0xffffffff00000000
+        checksum.verify(file_info)
+        file_info.crc32 = 0
+        assert_raises(ChecksumMismatch, checksum.verify, file_info)
+
+
+class TestClientChecksum(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address], checksum="sha256", verify=True)
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_upload_buffer(self):
+        sr = self.client.upload_file_by_buffer(memoryview(CONTENT), "bin")
+        assert_equal(sr.checksum.crc32, zlib.crc32(CONTENT) & 0xffffffff)
+        assert_equal(sr.checksum.sha256, hashlib.sha256(CONTENT).hexdigest())
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), CONTENT)
+        with self.client.download_stream(sr.group_name, sr.filename, chunk_size=4096) as stream:
+            assert_equal(b"".join(stream), CONTENT)
+            assert_equal(stream.checksum.sha256, sr.checksum.sha256)
+
+    def test_upload_file(self):
+        fd, path = tempfile.mkstemp(suffix=".bin")
+        try:
+            os.write(fd, CONTENT)
+            os.close(fd)
+            sr = self.client.upload_file_by_filename(path)
+            assert_equal(sr.checksum.sha256, hashlib.sha256(CONTENT).hexdigest())
+        finally:
+            os.remove(path)
+
+    def test_corrupt_download(self):
+        sr = self.client.upload_file_by_buffer(CONTENT, "bin")
+        corrupt = StubServer(CorruptHandler, files=self.server.files).start()
+        try:
+            client = FdfsClient([corrupt.address], verify=True)
+            assert_raises(ChecksumMismatch, client.download_to_buffer, sr.group_name, sr.filename)
+            assert_equal(client.download_to_buffer(sr.group_name, sr.filename, 0, 10), CONTENT[:10])
+            for pool in client._pools():
+                pool.destroy()
+        finally:
+            corrupt.stop()
@@ -0,0 +1,112 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import json
+import unittest
+from nose.tools import assert_equal, assert_is_none, assert_less, assert_in, assert_not_in
+from pyfdfs.client import FdfsClient
+from pyfdfs.compress import Compressor, ZlibCodec, CODECS, META_CODEC, META_SIZE
+from tests.stub_server import StubServer
+
+CONTENT = json.dumps([{"id": i, "name": "item %d" % i, "tags": ["a", "b"]} for i in range(2000)]).encode()
+
+
+class TestCompressor(unittest.TestCase):
+    def test_skips(self):
+        compressor = Compressor(min_size=1024, sample_size=4096)
+        assert_is_none(compressor.compress(b"x" * 100, "json"))
+        assert_is_none(compressor.compress(CONTENT, "jpg"))
+        assert_is_none(compressor.compress(CONTENT, "tar.gz"))
+        assert_is_none(compressor.compress(os.urandom(64 * 1024), "bin"))
+
+    def test_compress(self):
+        compressed, meta_data = Compressor().compress(memoryview(CONTENT), "json")
+        assert_less(len(compressed), len(CONTENT) // 4)
+        assert_equal(meta_data, {META_CODEC: "zlib", META_SIZE: len(CONTENT)})
+        assert_equal(ZlibCodec().decompress(compressed), CONTENT)
+
+
+class TestCompressedClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address], compressor=Compressor())
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_round_trip(self):
+        sr = self.client.upload_file_by_buffer(CONTENT, "json", meta_data={"owner": "me"})
+        assert_less(len(self.server.files[sr.filename][0]), len(CONTENT) // 4)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), CONTENT)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename, 100, 50), CONTENT[100:150])
+        assert_equal(self.client.content_size(sr.group_name, sr.filename), len(CONTENT))
+        self.client.set_meta(sr.filename, {"owner": "you"}, sr.group_name)
+        meta_data = self.client.get_meta(sr.group_name, sr.filename)
+        assert_equal(meta_data["owner"], "you")
+        assert_in(META_CODEC, meta_data)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), CONTENT)
+
+    def test_stream(self):
+        sr = self.client.upload_file_by_buffer(CONTENT, "json")
+        with self.client.download_stream(sr.group_name, sr.filename, chunk_size=1024) as stream:
+            assert_equal(stream.length, len(CONTENT))
+            assert_equal(b"".join(stream), CONTENT)
+        with self.client.download_stream(sr.group_name, sr.filename, 5000, 3000, chunk_size=1024) as stream:
+            assert_equal(stream.read(), CONTENT[5000:8000])
+
+    def test_incompressible(self):
+        content = os.urandom(16 * 1024)
+        sr = self.client.upload_file_by_buffer(content, "bin")
+        assert_equal(self.server.files[sr.filename][0], content)
+        assert_not_in(META_CODEC, self.client.get_meta(sr.group_name, sr.filename))
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), content)
+
+    def test_codec_cache(self):
+        sr = self.client.upload_file_by_buffer(CONTENT, "json")
+        plain = self.client.upload_file_by_buffer(os.urandom(16 * 1024), "bin")
+        photo = self.client.upload_file_by_buffer(os.urandom(16 * 1024), "jpg")
+        reader = FdfsClient([self.server.address], compressor=Compressor())
+        try:
+            for client, get_metas in ((self.client, 0), (reader, 2)):
+                requests = self.server.stats["requests"]
+                for _ in range(2):
+                    for item in (sr, plain, photo):
+                        client.download_to_buffer(item.group_name, item.filename)
+                # a tracker query and a download each, and the codecs asked for once, never for the jpg
+                assert_equal(self.server.stats["requests"] - requests, 2 * (6 + get_metas))
+        finally:
+            for pool in reader._pools():
+                pool.destroy()
+
+    def test_bounded_stream(self):
+        content = b"\0" * (8 << 20)
+        codecs = [ZlibCodec()] + ([CODECS["lzma"]] if "lzma" in CODECS else [])
+        for codec in codecs:
+            writer = FdfsClient([self.server.address], compressor=Compressor(codec, max_size=16 << 20))
+            sr = writer.upload_file_by_buffer(content, "bin")
+            for pool in writer._pools():
+                pool.destroy()
+            largest = total = 0
+            with self.client.download_stream(sr.group_name, sr.filename, chunk_size=1024) as stream:
+                while 1:
+                    chunk = stream.read(1024)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    largest = max(largest, len(stream._pending))
+            assert_equal(total, len(content))
+            assert_less(largest, 2048)
+
+    @unittest.skipIf("lzma" not in CODECS, "lzma needs python 3")
+    def test_lzma(self):
+        writer = FdfsClient([self.server.address], compressor=Compressor(CODECS["lzma"]))
+        sr = writer.upload_file_by_buffer(CONTENT, "json")
+        assert_equal(self.client.get_meta(sr.group_name, sr.filename)[META_CODEC], "lzma")
+        assert_equal(b"".join(self.client.download_stream(sr.group_name, sr.filename)), CONTENT)
+        for pool in writer._pools():
+            pool.destroy()
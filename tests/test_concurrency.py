@@ -0,0 +1,104 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import gc
+import threading
+import unittest
+from nose.tools import assert_equal
+from pyfdfs.client import FdfsClient
+from pyfdfs.connection import Connection, ThreadAffinityConnectionPool
+from tests.stub_server import StubServer
+
+
+class RecordingConnection(Connection):
+    """
+    records which threads sent over this connection
+    """
+    usage = {}
+    usage_lock = threading.Lock()
+
+    def send(self, byte_stream):
+        with self.usage_lock:
+            self.usage.setdefault(id(self), set()).add(threading.current_thread().ident)
+        super(RecordingConnection, self).send(byte_stream)
+
+
+class TestConcurrency(unittest.TestCase):
+    thread_count = 16
+    loop_count = 30
+
+    def setUp(self):
+        self.server = StubServer().start()
+        RecordingConnection.usage = {}
+
+    def tearDown(self):
+        self.server.stop()
+
+    def upload_and_check(self, client, tag, errors):
+        try:
+            sr = client.upload_file_by_buffer(("%s" % tag).encode() * 64, "txt", meta_data={"tag": tag})
+            meta = client.get_meta(sr.group_name, sr.filename)
+            if meta != {"tag": tag}:
+                errors.append("%s != %s" % (meta, tag))
+        except Exception as e:
+            errors.append(e)
+
+    def run_threads(self, client):
+        errors = []
+
+        def worker(idx):
+            for loop in range(self.loop_count):
+                self.upload_and_check(client, "%d-%d" % (idx, loop), errors)
+
+        threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(self.thread_count)]
+        for item in threads:
+            item.start()
+        for item in threads:
+            item.join()
+        return errors
+
+    def test_threads_share_client(self):
+        client = FdfsClient([self.server.address])
+        assert_equal(self.run_threads(client), [])
+        assert_equal(self.server.stats["uploads"], self.thread_count * self.loop_count)
+        assert_equal(len(client.tracker_pool._in_use_connections), 0)
+        assert_equal(len(client.storage_servers), 1)
+
+    def test_thread_affinity(self):
+        client = FdfsClient([self.server.address], pool_cls=ThreadAffinityConnectionPool,
+                            conn_cls=RecordingConnection)
+        assert_equal(self.run_threads(client), [])
+        for threads in RecordingConnection.usage.values():
+            assert_equal(len(threads), 1)
+        # one tracker and one storage connection per thread
+        assert_equal(len(RecordingConnection.usage), self.thread_count * 2)
+
+    def test_fork(self):
+        if not hasattr(os, "fork"):
+            raise unittest.SkipTest("fork is not available")
+        client = FdfsClient([self.server.address])
+        errors = []
+        self.upload_and_check(client, "parent", errors)
+        children = []
+        for idx in range(4):
+            pid = os.fork()
+            if pid == 0:
+                child_errors = []
+                for loop in range(self.loop_count):
+                    self.upload_and_check(client, "child-%d-%d" % (idx, loop), child_errors)
+                # dropping the client in the child must leave the parent sockets alone
+                del client
+                gc.collect()
+                os._exit(1 if child_errors else 0)
+            children.append(pid)
+        for pid in children:
+            assert_equal(os.waitpid(pid, 0)[1], 0)
+        connections = self.server.stats["connections"]
+        self.upload_and_check(client, "parent-again", errors)
+        assert_equal(errors, [])
+        # the parent went on with its own pooled connections
+        assert_equal(self.server.stats["connections"], connections)
+        assert_equal(self.server.stats["uploads"], 2 + 4 * self.loop_count)
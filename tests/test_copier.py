@@ -0,0 +1,92 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import threading
+import unittest
+from nose.tools import assert_equal, assert_true, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.copier import RingBuffer
+from tests.stub_server import StubServer
+
+
+class FakeStream(object):
+    def __init__(self, content, fail_at=None):
+        self.content = content
+        self.offset = 0
+        self.fail_at = fail_at
+        self.closed = False
+        self.reads = 0
+
+    def readinto(self, view):
+        if self.fail_at is not None and self.offset >= self.fail_at:
+            raise IOError("connection reset")
+        size = min(len(view), len(self.content) - self.offset)
+        view[:size] = self.content[self.offset:self.offset + size]
+        self.offset += size
+        self.reads += 1
+        return size
+
+    def close(self):
+        self.closed = True
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_chunks(self):
+        content = b"0123456789" * 1000
+        stream = FakeStream(content)
+        ring = RingBuffer(stream, slots=3, chunk_size=1024)
+        try:
+            assert_equal(b"".join(view.tobytes() for view in ring), content)
+        finally:
+            ring.close()
+        assert_true(stream.closed)
+
+    def test_bounded(self):
+        stream = FakeStream(b"x" * 100000)
+        ring = RingBuffer(stream, slots=2, chunk_size=1000)
+        try:
+            chunks = iter(ring)
+            next(chunks)
+            # the reader stops once every slot is filled
+            threading.Event().wait(0.2)
+            assert_equal(stream.reads, 2)
+        finally:
+            ring.close()
+        assert_true(stream.closed)
+
+    def test_reader_error(self):
+        ring = RingBuffer(FakeStream(b"x" * 10000, fail_at=4000), slots=2, chunk_size=1000)
+        try:
+            assert_raises(IOError, lambda: [view for view in ring])
+        finally:
+            ring.close()
+
+
+class TestCopyFile(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.content = b"copy me " * 50000
+        self.file_name = self.server.add_file(self.content, b"", b"txt")
+        self.client = FdfsClient([self.server.address], checksum="crc32")
+        self.client.set_meta(self.file_name, {"owner": "alice"}, "group1")
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_copy(self):
+        sr = self.client.copy_file("group1", self.file_name, chunk_size=4096, slots=4)
+        assert_true(sr.filename != self.file_name)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), self.content)
+        assert_equal(self.client.get_meta(sr.group_name, sr.filename), {"owner": "alice"})
+        assert_equal(sr.checksum.size, len(self.content))
+        assert_true(self.file_name in self.server.files)
+
+    def test_move(self):
+        sr = self.client.copy_file("group1", self.file_name, meta=False, delete_source=True)
+        assert_true(self.file_name not in self.server.files)
+        assert_equal(self.client.get_meta(sr.group_name, sr.filename), {})
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), self.content)
@@ -0,0 +1,65 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import unittest
+from nose.tools import assert_equal, assert_less, assert_is_none, assert_raises, assert_true
+from pyfdfs.client import FdfsClient
+from pyfdfs.deadline import Deadline, DeadlineExceeded, deadline, get_deadline
+from tests.stub_server import StubServer
+
+
+class TestDeadline(unittest.TestCase):
+    def test_nesting(self):
+        assert_is_none(get_deadline())
+        with deadline(0.5) as outer:
+            with deadline(10) as inner:
+                assert_true(inner is outer)
+            with deadline(0.1) as inner:
+                assert_less(inner.remaining(), 0.2)
+            assert_true(get_deadline() is outer)
+        assert_is_none(get_deadline())
+
+    def test_timeout(self):
+        assert_equal(Deadline(10).timeout(1), 1)
+        assert_less(Deadline(0.5).timeout(None), 0.6)
+        assert_raises(DeadlineExceeded, Deadline(-1).check)
+
+
+class TestClientTimeouts(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(delay=2).start()
+        self.file_name = self.server.add_file(b"slow content", b"", b"txt")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_client_deadline(self):
+        client = FdfsClient([self.server.address], deadline=0.3)
+        start = time.time()
+        assert_raises(DeadlineExceeded, client.download_to_buffer, "group1", self.file_name)
+        assert_less(time.time() - start, 1)
+
+    def test_call_deadline(self):
+        client = FdfsClient([self.server.address])
+        start = time.time()
+        with deadline(0.3):
+            assert_raises(DeadlineExceeded, client.get_meta, "group1", self.file_name)
+        assert_less(time.time() - start, 1)
+        self.server.delay = 0
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"slow content")
+
+    def test_read_timeout(self):
+        client = FdfsClient([self.server.address], read_timeout=0.3)
+        start = time.time()
+        try:
+            client.download_to_buffer("group1", self.file_name)
+        except DeadlineExceeded:
+            raise AssertionError("read timeout reported as deadline")
+        except Exception:
+            pass
+        else:
+            raise AssertionError("read timeout not raised")
+        assert_less(time.time() - start, 1)
@@ -0,0 +1,89 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_not_equal, assert_is_none
+from pyfdfs.client import FdfsClient
+from pyfdfs.dedup import dedup_key, MemoryDedupIndex, SqliteDedupIndex
+from tests.stub_server import StubServer
+
+
+class TestDedupIndex(unittest.TestCase):
+    def test_key_without_copy(self):
+        payload = bytearray(b"x" * 1024)
+        assert_equal(dedup_key(payload, "jpg"), dedup_key(memoryview(payload), "jpg"))
+        assert_not_equal(dedup_key(payload, "jpg"), dedup_key(payload, "png"))
+
+    def test_memory_lru(self):
+        index = MemoryDedupIndex(max_size=2)
+        index.set("a", "group1/a")
+        index.set("b", "group1/b")
+        index.get("a")
+        index.set("c", "group1/c")
+        assert_is_none(index.get("b"))
+        assert_equal(index.get("a"), "group1/a")
+        index.discard_file("group1/a")
+        assert_is_none(index.get("a"))
+        assert_equal(len(index), 1)
+
+    def test_memory_repoint(self):
+        index = MemoryDedupIndex()
+        index.set("a", "group1/old")
+        index.set("a", "group1/new")
+        index.discard_file("group1/old")
+        assert_equal(index.get("a"), "group1/new")
+        assert_equal(index._files, {"group1/new": "a"})
+        # the same file under another key: the first key goes with it
+        index.set("b", "group1/new")
+        index.discard_file("group1/new")
+        assert_equal((index.get("a"), index.get("b"), len(index)), (None, None, 0))
+
+    def test_sqlite(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "dedup.db")
+            SqliteDedupIndex(path).set("a", "group1/a")
+            index = SqliteDedupIndex(path)
+            assert_equal(index.get("a"), "group1/a")
+            index.discard_file("group1/a")
+            assert_is_none(index.get("a"))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestDedupClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_hit_skips_upload(self):
+        client = FdfsClient([self.server.address], dedup_index=MemoryDedupIndex())
+        first = client.upload_file_by_buffer(b"same bytes", "txt")
+        second = client.upload_file_by_buffer(b"same bytes", "txt")
+        assert_equal(str(first), str(second))
+        assert_equal(self.server.stats["uploads"], 1)
+        client.upload_file_by_buffer(b"same bytes", "txt", meta_data={"k": "v"})
+        assert_equal(self.server.stats["uploads"], 2)
+
+    def test_delete_evicts(self):
+        client = FdfsClient([self.server.address], dedup_index=MemoryDedupIndex())
+        first = client.upload_file_by_buffer(b"same bytes", "txt")
+        client.delete_file(first.group_name, first.filename)
+        client.upload_file_by_buffer(b"same bytes", "txt")
+        assert_equal(self.server.stats["uploads"], 2)
+
+    def test_link(self):
+        client = FdfsClient([self.server.address], dedup_index=MemoryDedupIndex(), dedup_link=True)
+        first = client.upload_file_by_buffer(b"same bytes", "txt")
+        second = client.upload_file_by_buffer(b"same bytes", "txt", meta_data={"k": "v"})
+        assert_not_equal(first.filename, second.filename)
+        assert_equal(self.server.stats["uploads"], 1)
+        assert_equal(self.server.stats["links"], 1)
+        assert_equal(client.get_meta(second.group_name, second.filename), {"k": "v"})
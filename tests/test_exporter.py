@@ -0,0 +1,103 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import unittest
+from nose.tools import assert_equal, assert_in, assert_raises
+from pyfdfs.exporter import ClusterExporter
+from pyfdfs.structs import GroupInfo, StorageInfo
+from pyfdfs.enums import FDFS_STORAGE_STATUS_ACTIVE
+
+
+def make_server(ip_addr):
+    server = StorageInfo()
+    server.ip_addr = ip_addr
+    server.status = FDFS_STORAGE_STATUS_ACTIVE
+    server.storage_port = 23000
+    server.total_mb = 2048
+    server.free_mb = 1024
+    for attr in StorageInfo.attributes:
+        if attr.endswith("_count") or attr.endswith("_bytes"):
+            setattr(server, attr, 0)
+    server.last_heart_beat_time = 1500000000
+    return server
+
+
+class FakeTracker(object):
+    def __init__(self):
+        group = GroupInfo()
+        group.group_name = "group1"
+        group.total_mb = 4096
+        group.free_mb = 2048
+        group.trunk_free_mb = 0
+        group.count = 2
+        group.active_count = 2
+        self.groups = [group]
+        self.servers = [make_server("10.0.0.1"), make_server("10.0.0.2")]
+        self.fail = False
+
+    def list_groups(self):
+        if self.fail:
+            raise IOError("tracker down")
+        return self.groups
+
+    def list_servers(self, group_name, storage_ip=None):
+        return self.servers
+
+
+def samples(page):
+    return dict(line.rsplit(" ", 1) for line in page.decode("utf-8").splitlines() if not line.startswith("#"))
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.tracker = FakeTracker()
+        self.exporter = ClusterExporter(self.tracker)
+
+    def test_counters_and_rates(self):
+        self.exporter.refresh()
+        labels = 'group="group1",server="10.0.0.1:23000"'
+        values = samples(self.exporter.render())
+        assert_equal(values['fdfs_group_free_bytes{group="group1"}'], "%d" % (2048 * 1024 * 1024))
+        assert_equal(values['fdfs_storage_active{%s}' % labels], "1")
+        assert_equal(values['fdfs_storage_last_heart_beat_timestamp_seconds{%s}' % labels], "1500000000")
+        assert_equal(values['fdfs_storage_upload_total{%s,result="success"}' % labels], "0")
+        assert_equal(values['fdfs_storage_connections{%s,state="max"}' % labels], "0")
+        assert_equal(len([key for key in values if key.startswith("fdfs_storage_upload_per_second")]), 0)
+        # no heartbeat since the previous refresh: no rate yet
+        self.exporter.refresh()
+        values = samples(self.exporter.render())
+        assert_equal(len([key for key in values if key.startswith("fdfs_storage_upload_per_second")]), 0)
+        # the next heartbeat, 10s later, brought new counters
+        self.tracker.servers[0].last_heart_beat_time = 1500000010
+        self.tracker.servers[0].success_upload_count = 50
+        self.tracker.servers[0].success_download_bytes = 10 * 1024 * 1024
+        self.exporter.refresh()
+        values = samples(self.exporter.render())
+        assert_equal(values['fdfs_storage_upload_total{%s,result="success"}' % labels], "50")
+        assert_equal(float(values['fdfs_storage_upload_per_second{%s,result="success"}' % labels]), 5)
+        assert_equal(float(values['fdfs_storage_download_bytes_per_second{%s,result="success"}' % labels]),
+                     1024 * 1024)
+        # refreshed again before the next heartbeat: the rates of the last heartbeats, not 0
+        self.exporter.refresh()
+        values = samples(self.exporter.render())
+        assert_equal(float(values['fdfs_storage_upload_per_second{%s,result="success"}' % labels]), 5)
+
+    def test_failed_refresh(self):
+        self.exporter.refresh()
+        self.tracker.fail = True
+        assert_raises(IOError, self.exporter.refresh)
+        values = samples(self.exporter.render())
+        assert_equal(values["fdfs_exporter_up"], "0")
+        assert_equal(values["fdfs_exporter_refresh_errors_total"], "1")
+
+    def test_wsgi(self):
+        self.exporter.refresh()
+        headers = {}
+
+        def start_response(status, response_headers):
+            headers.update(response_headers)
+        body = b"".join(self.exporter({}, start_response))
+        assert_in(b"# TYPE fdfs_storage_upload_total counter", body)
+        assert_equal(headers["Content-Length"], "%d" % len(body))
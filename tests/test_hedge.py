@@ -0,0 +1,127 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import sys
+import time
+import threading
+import unittest
+from nose.tools import assert_equal, assert_less, assert_true
+from pyfdfs.client import FdfsClient
+from pyfdfs.hedge import HedgePolicy, _AttemptPool, _Scheduler
+from pyfdfs.storage import Storage
+from tests.stub_server import StubServer
+
+
+def hedge_threads():
+    return len([thread for thread in threading.enumerate() if thread.name == "pyfdfs-hedge"])
+
+
+class TestHedgePolicy(unittest.TestCase):
+    def test_adaptive_delay(self):
+        policy = HedgePolicy(delay=0.5, adaptive=True, percentile=90, window=100, min_samples=10)
+        assert_equal(policy.get_delay(), 0.5)
+        for ms in range(1, 101):
+            policy.record(ms / 1000.0)
+        assert_equal(policy.get_delay(), 0.091)
+        policy.record(100)
+        assert_equal(policy.get_delay(), 0.092)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        # switch threads as often as possible, for the first schedule() calls to race
+        if hasattr(sys, "setswitchinterval"):
+            self.interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        if hasattr(sys, "setswitchinterval"):
+            sys.setswitchinterval(self.interval)
+
+    def test_concurrent_start(self):
+        errors = []
+        before = hedge_threads()
+        for _ in range(100):
+            scheduler = _Scheduler()
+            start = threading.Event()
+
+            def schedule():
+                start.wait()
+                try:
+                    scheduler.schedule(0, len, "")
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=schedule) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+        assert_equal(errors, [])
+        # one timer thread per scheduler
+        assert_equal(hedge_threads(), before + 100)
+
+
+class TestAttemptPool(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        host, port = self.server.server_address
+        self.storage = Storage(host, port)
+
+    def tearDown(self):
+        self.storage.pool.destroy()
+        self.server.stop()
+
+    def test_cancel_after_recv(self):
+        attempt = _AttemptPool(self.storage.pool)
+        conn = attempt.get_connection()
+        conn.connect()
+        # the command got its response, then loses the race before giving the connection back
+        attempt.cancel()
+        attempt.release(conn)
+        assert_true(conn.sock is None)
+        assert_equal(self.storage.pool._available_connections, [])
+        assert_equal(self.storage.get_meta("group1", self.server.add_file(b"x", b"", b"txt")), {})
+
+
+class TestHedgedReads(unittest.TestCase):
+    def setUp(self):
+        self.primary = StubServer(delay=1.0).start()
+        self.replica = StubServer(host="127.0.0.2", port=self.primary.server_address[1],
+                                  files=self.primary.files).start()
+        self.primary.peers.append(self.replica)
+        self.file_name = self.primary.add_file(b"hedged content", b"k\x02v", b"txt")
+
+    def tearDown(self):
+        self.primary.stop()
+        self.replica.stop()
+
+    def test_slow_primary(self):
+        policy = HedgePolicy(delay=0.05)
+        client = FdfsClient([self.primary.address], hedge=policy)
+        start = time.time()
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"hedged content")
+        assert_equal(client.download_to_buffer("group1", self.file_name, 7, 3), b"con")
+        assert_equal(client.get_meta("group1", self.file_name), {"k": "v"})
+        assert_less(time.time() - start, 1.0)
+        assert_equal(policy.hedged, 3)
+
+    def test_fast_primary(self):
+        self.primary.delay = 0
+        policy = HedgePolicy(delay=0.5)
+        client = FdfsClient([self.primary.address], hedge=policy)
+        for _ in range(5):
+            assert_equal(client.download_to_buffer("group1", self.file_name), b"hedged content")
+        assert_equal(policy.hedged, 0)
+        assert_equal(self.replica.stats["requests"], 0)
+
+    def test_failover(self):
+        self.primary.delay = 0
+        client = FdfsClient([self.primary.address], hedge=HedgePolicy(delay=5))
+        self.primary.files.pop(self.file_name)
+        self.replica.files = {self.file_name: (b"only on the replica", b"")}
+        start = time.time()
+        assert_equal(client.download_to_buffer("group1", self.file_name), b"only on the replica")
+        assert_true(time.time() - start < 1.0)
@@ -0,0 +1,97 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import unittest
+from nose.tools import assert_equal, assert_true, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.compress import Compressor
+from pyfdfs.packing import Packer, packed_id, parse_packed_id, parse_index
+from tests.stub_server import StubServer
+
+
+class TestPackedId(unittest.TestCase):
+    def test_round_trip(self):
+        value = packed_id("group1", "M00/00/00/abc.pak", 4096, 1024)
+        assert_equal(value, "group1/M00/00/00/abc.pak#4096+1024")
+        assert_equal(parse_packed_id(value), ("group1", "M00/00/00/abc.pak", 4096, 1024))
+        assert_raises(ValueError, parse_packed_id, "group1/M00/00/00/abc.pak")
+
+
+class TestPacker(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address])
+        self.packer = Packer(self.client, bundle_size=1000)
+
+    def tearDown(self):
+        self.packer.close()
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_pack_and_read(self):
+        contents = [("%03d" % idx).encode() * 50 for idx in range(25)]
+        ids = self.packer.pack(contents)
+        # 150 bytes objects, 1000 bytes bundles: 7 objects a bundle
+        assert_equal(self.server.stats["uploads"], 4)
+        assert_equal(self.packer.bundles, 4)
+        assert_equal([self.packer.read(value) for value in ids], contents)
+        group_name, file_name, offset, length = parse_packed_id(ids[8])
+        bundle = self.client.download_to_buffer(group_name, file_name)
+        assert_equal(parse_index(bundle)[1], (offset, length))
+
+    def test_large_and_empty(self):
+        large, empty = self.packer.pack([b"x" * 600, b""])
+        assert_true("#" not in large)
+        assert_equal(self.packer.unpacked, 1)
+        assert_equal(self.packer.read(large), b"x" * 600)
+        assert_equal(self.packer.read(empty), b"")
+        self.packer.delete(large)
+        assert_equal(self.server.stats["uploads"], 2)
+
+    def test_delete_and_compact(self):
+        ids = self.packer.pack([b"a" * 100, b"b" * 100, b"c" * 100])
+        bundle_id = parse_packed_id(ids[0])[0] + "/" + parse_packed_id(ids[0])[1]
+        self.packer.delete(ids[0])
+        # a third of the bytes deleted, under min_garbage
+        assert_equal(self.packer.compact(bundle_id), {})
+        self.packer.delete(ids[2])
+        moved = self.packer.compact(bundle_id)
+        assert_equal(list(moved.keys()), [ids[1]])
+        assert_equal(self.packer.read(moved[ids[1]]), b"b" * 100)
+        assert_equal(len(self.server.files), 1)
+        # a bundle left with deleted objects only goes away
+        self.packer.delete(moved[ids[1]])
+        new_bundle = moved[ids[1]].split("#")[0]
+        assert_equal(self.packer.compact(new_bundle), {})
+        assert_equal(len(self.server.files), 0)
+
+    def test_max_delay(self):
+        packer = Packer(self.client, bundle_size=1000, max_delay=0.05)
+        try:
+            obj = packer.add(b"late")
+            assert_equal(packer.read(obj.wait(5)), b"late")
+        finally:
+            packer.close()
+
+    def test_compressing_client(self):
+        contents = [("%03d" % idx).encode() * 50 for idx in range(6)]
+        clients = [FdfsClient([self.server.address], compressor=Compressor(min_size=0)) for _ in range(2)]
+        try:
+            ids = Packer(clients[0], bundle_size=1000).pack(contents)
+            # the bundle is stored as is, not compressed
+            content, meta = self.server.files[parse_packed_id(ids[0])[1]]
+            assert_equal(content[:150], contents[0])
+            assert_equal(meta, b"")
+            # read by a client that knows nothing of the bundle
+            requests = self.server.stats["requests"]
+            assert_equal([Packer(clients[1]).read(value) for value in ids], contents)
+            # a tracker query and a ranged download per object: no get_meta, no whole bundle
+            assert_equal(self.server.stats["requests"] - requests, 2 * len(ids))
+        finally:
+            for client in clients:
+                for pool in client._pools():
+                    pool.destroy()
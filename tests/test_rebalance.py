@@ -0,0 +1,113 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true
+from pyfdfs.rebalance import plan_moves, Rebalancer
+from pyfdfs.structs import GroupInfo, StorageResponseInfo, FileInfo
+
+MB = 1024 * 1024
+
+
+def make_group(group_name, total_mb, free_mb):
+    group = GroupInfo()
+    group.group_name = group_name
+    group.total_mb = total_mb
+    group.free_mb = free_mb
+    return group
+
+
+class FakeClient(object):
+    def __init__(self, groups, sizes, fail=()):
+        self.groups = groups
+        self.sizes = sizes
+        self.fail = fail
+        self.copies = []
+
+    def list_groups(self):
+        return self.groups
+
+    def query_file_info(self, group_name, file_name):
+        info = FileInfo()
+        info.file_size = self.sizes["%s/%s" % (group_name, file_name)]
+        return info
+
+    def copy_file(self, group_name, file_name, dest_group_name=None, delete_source=False):
+        if file_name in self.fail:
+            raise IOError("storage down")
+        self.copies.append((group_name, file_name, dest_group_name, delete_source))
+        sr = StorageResponseInfo()
+        sr.group_name, sr.filename = dest_group_name, "copy-" + file_name
+        return sr
+
+
+class TestPlanMoves(unittest.TestCase):
+    def test_drain_full_group(self):
+        groups = [make_group("group1", 1000, 100), make_group("group2", 1000, 900), make_group("group3", 1000, 500)]
+        files = [("group1/a", 100 * MB), ("group2/b", 100 * MB), ("group3/c", 100 * MB)] + \
+                [("group1/%d" % idx, 100 * MB) for idx in range(10)]
+        moves = list(plan_moves(groups, files, None))
+        # group1 gives until it is back at the cluster free ratio of 50%
+        assert_true(all(file_id.startswith("group1/") for file_id, _, _ in moves))
+        assert_equal(len(moves), 4)
+        assert_true(all(target == "group2" for _, _, target in moves))
+
+    def test_balanced(self):
+        groups = [make_group("group1", 1000, 480), make_group("group2", 1000, 520)]
+        assert_equal(list(plan_moves(groups, [("group1/a", MB)], None)), [])
+
+    def test_size_of_and_max_bytes(self):
+        groups = [make_group("group1", 1000, 0), make_group("group2", 1000, 1000)]
+        asked = []
+
+        def size_of(file_id):
+            asked.append(file_id)
+            return 10 * MB
+        files = [("group2/x", None)] + [("group1/%d" % idx, None) for idx in range(10)]
+        moves = list(plan_moves(groups, files, size_of, max_bytes=35 * MB))
+        assert_equal(len(moves), 3)
+        # the files of the group with room are not looked at
+        assert_true("group2/x" not in asked)
+
+
+class TestRebalancer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmp_dir, "files.txt")
+        self.manifest = os.path.join(self.tmp_dir, "moves.jsonl")
+        with open(self.input, "w") as f_obj:
+            f_obj.write("group1/a\n")
+            f_obj.write(json.dumps({"file_id": "group1/b", "size": 50 * MB}) + "\n")
+            f_obj.write("group1/c\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def client(self, fail=()):
+        groups = [make_group("group1", 1000, 0), make_group("group2", 1000, 1000)]
+        return FakeClient(groups, {"group1/a": 50 * MB, "group1/c": 50 * MB}, fail)
+
+    def test_resume(self):
+        out = open(os.devnull, "w")
+        try:
+            client = self.client(fail=("c",))
+            stats = Rebalancer(client, self.manifest, workers=2, delete_source=True, out=out).run(self.input)
+            assert_equal((stats.files, stats.failed), (2, 1))
+            assert_true(all(copy[2:] == ("group2", True) for copy in client.copies))
+            # a second run only moves what failed
+            client = self.client()
+            stats = Rebalancer(client, self.manifest, workers=2, out=out).run(self.input)
+            assert_equal((stats.files, stats.failed), (1, 0))
+            assert_equal(client.copies, [("group1", "c", "group2", False)])
+        finally:
+            out.close()
+        with open(self.manifest) as f_obj:
+            moves = [json.loads(line) for line in f_obj]
+        assert_equal(sorted(move["file_id"] for move in moves), ["group1/a", "group1/b", "group1/c"])
+        assert_true(all(move["new_file_id"] == "group2/copy-" + move["file_id"][7:] for move in moves))
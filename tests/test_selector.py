@@ -0,0 +1,78 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import unittest
+from nose.tools import assert_equal, assert_true
+from pyfdfs.client import FdfsClient
+from pyfdfs.selector import ReplicaSelector
+from pyfdfs.structs import BasicStorageInfo
+from tests.stub_server import StubServer
+
+
+def storage_info(ip_addr, port=23000):
+    si = BasicStorageInfo()
+    si.group_name = "group1"
+    si.ip_addr = ip_addr
+    si.storage_port = port
+    return si
+
+
+class CountingTracker(object):
+    def __init__(self):
+        self.queries = 0
+
+    def query_fetch_all(self, group_name, file_name):
+        self.queries += 1
+        return [storage_info("10.0.0.1"), storage_info("10.0.0.2")]
+
+
+class TestReplicaSelector(unittest.TestCase):
+    def test_rank(self):
+        selector = ReplicaSelector(explore=0, min_transfer_size=1)
+        infos = [storage_info("10.0.0.1"), storage_info("10.0.0.2"), storage_info("10.0.0.3")]
+        selector.record(("10.0.0.1", 23000), 0.001, 1.0, 1000000)
+        selector.record(("10.0.0.2", 23000), 0.010, 0.01, 1000000)
+        assert_equal([si.ip_addr for si in selector.rank(infos)], ["10.0.0.3", "10.0.0.2", "10.0.0.1"])
+        assert_equal(selector.rank(infos, nbytes=0)[1].ip_addr, "10.0.0.1")
+        selector.record(("10.0.0.2", 23000), 0.010, ok=False)
+        assert_true(selector.endpoints[("10.0.0.2", 23000)].latency > 0.1)
+
+    def test_explore(self):
+        selector = ReplicaSelector(explore=1)
+        selector.record(("10.0.0.1", 23000), 1.0)
+        infos = [storage_info("10.0.0.1"), storage_info("10.0.0.2")]
+        for _ in range(10):
+            assert_equal(selector.rank(infos)[0].ip_addr, "10.0.0.1")
+
+    def test_replicas_cache(self):
+        selector = ReplicaSelector(replicas_ttl=60)
+        tracker = CountingTracker()
+        selector.replicas(tracker, "group1", "a")
+        selector.replicas(tracker, "group1", "a")
+        assert_equal(tracker.queries, 1)
+        selector.discard("group1", "a")
+        selector.replicas(tracker, "group1", "a")
+        assert_equal(tracker.queries, 2)
+
+
+class TestSelectedReads(unittest.TestCase):
+    def setUp(self):
+        self.primary = StubServer(delay=0.2).start()
+        self.replica = StubServer(host="127.0.0.2", port=self.primary.server_address[1],
+                                  files=self.primary.files).start()
+        self.primary.peers.append(self.replica)
+        self.file_name = self.primary.add_file(b"selected content", b"", b"txt")
+
+    def tearDown(self):
+        self.primary.stop()
+        self.replica.stop()
+
+    def test_fastest_replica(self):
+        selector = ReplicaSelector(explore=0)
+        client = FdfsClient([self.primary.address], selector=selector)
+        for _ in range(5):
+            assert_equal(client.download_to_buffer("group1", self.file_name), b"selected content")
+        assert_equal(self.replica.stats["requests"], 4)
+        assert_equal(len(selector.endpoints), 2)
@@ -0,0 +1,96 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+import unittest
+from nose.tools import assert_equal, assert_true
+from pyfdfs.client import FdfsClient
+from pyfdfs.singleflight import SingleFlight
+from tests.stub_server import StubServer
+
+
+def run_together(target, count):
+    """
+    :return: results of count threads calling target at the same time
+    """
+    start = threading.Event()
+    results = [None] * count
+
+    def worker(idx):
+        start.wait()
+        try:
+            results[idx] = target()
+        except Exception as e:
+            results[idx] = e
+    threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(count)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_shared_result(self):
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return bytearray(b"content")
+        results = run_together(lambda: flight.do("key", slow), 10)
+        assert_equal(len(calls), 1)
+        assert_equal(flight.shared, 9)
+        assert_true(all(result is results[0] for result in results))
+        assert_true(isinstance(results[0], bytes))
+        # nothing in flight any more, the next call runs again
+        flight.do("key", slow)
+        assert_equal(len(calls), 2)
+
+    def test_private_copies(self):
+        flight = SingleFlight()
+
+        def slow():
+            time.sleep(0.2)
+            return {"owner": "alice"}
+
+        def mutate():
+            meta = flight.do("key", slow)
+            meta["owner"] = "%d" % id(meta)
+            return meta
+        results = run_together(mutate, 5)
+        assert_equal(len(set(id(result) for result in results)), 5)
+        assert_true(all(result["owner"] == "%d" % id(result) for result in results))
+
+    def test_shared_error(self):
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.2)
+            raise IOError("down")
+        results = run_together(lambda: flight.do("key", failing), 5)
+        assert_true(all(isinstance(result, IOError) for result in results))
+
+
+class TestClientSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(delay=0.3).start()
+        self.file_name = self.server.add_file(b"popular" * 100000, b"", b"bin")
+        self.client = FdfsClient([self.server.address], single_flight=True)
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_stampede(self):
+        results = run_together(lambda: self.client.download_to_buffer("group1", self.file_name), 20)
+        assert_true(all(result == b"popular" * 100000 for result in results))
+        # one query_fetch_one and one download
+        assert_equal(self.server.stats["requests"], 2)
+        assert_true(self.server.stats["connections"] <= 2)
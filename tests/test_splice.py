@@ -0,0 +1,98 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_false, assert_raises
+from pyfdfs import connection
+from pyfdfs.client import FdfsClient
+from pyfdfs.command import ServerError
+from pyfdfs.buffers import BufferPool
+from pyfdfs.throttle import TransferScheduler
+from tests.stub_server import StubServer
+
+
+class TestDownloadToFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = StubServer().start()
+        self.buffers = BufferPool(debug=True)
+        self.client = FdfsClient([self.server.address], verify=True, buffer_pool=self.buffers)
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        with open(path, "rb") as f_obj:
+            return f_obj.read()
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmp_dir, "download")
+        for size in (0, 10, 3 * 1024 * 1024 + 7):
+            content = os.urandom(size)
+            sr = self.client.upload_file_by_buffer(content, "bin")
+            for use_splice in (True, False):
+                assert_equal(self.client.download_to_file(sr.group_name, sr.filename, path, use_splice=use_splice),
+                             size)
+                assert_equal(self.read(path), content)
+        assert_equal(self.client.download_to_file(sr.group_name, sr.filename, path, 5, 100), 100)
+        assert_equal(self.read(path), content[5:105])
+        self.buffers.check_leaks()
+        # the connection is left clean for the next command
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename, 0, 3), content[:3])
+
+    def test_missing(self):
+        path = os.path.join(self.tmp_dir, "download")
+        assert_raises(ServerError, self.client.download_to_file, "group1", "M00/00/00/missing.bin", path)
+        assert_false(os.path.exists(path))
+
+    @unittest.skipIf(connection.splice is None, "os.splice needs linux and python 3.10+")
+    def test_splice_used(self):
+        calls = []
+        splice = connection.splice
+
+        def counting_splice(*args):
+            calls.append(args)
+            return splice(*args)
+        connection.splice = counting_splice
+        try:
+            sr = self.client.upload_file_by_buffer(b"x" * 100000, "bin")
+            path = os.path.join(self.tmp_dir, "download")
+            self.client.download_to_file(sr.group_name, sr.filename, path)
+            assert_equal(self.read(path), b"x" * 100000)
+            self.assertTrue(calls)
+            del calls[:]
+            self.client.download_to_file(sr.group_name, sr.filename, path, use_splice=False)
+            assert_equal(calls, [])
+        finally:
+            connection.splice = splice
+
+    @unittest.skipIf(connection.splice is None, "os.splice needs linux and python 3.10+")
+    def test_splice_paced_by_chunk(self):
+        sizes = []
+        splice = connection.splice
+
+        def counting_splice(src, dst, count, *args):
+            sizes.append(count)
+            return splice(src, dst, count, *args)
+        connection.splice = counting_splice
+        client = FdfsClient([self.server.address],
+                            scheduler=TransferScheduler(rate=100 * 1024 * 1024, chunk_size=16 * 1024))
+        try:
+            sr = client.upload_file_by_buffer(b"x" * 100000, "bin")
+            path = os.path.join(self.tmp_dir, "download")
+            client.download_to_file(sr.group_name, sr.filename, path)
+            assert_equal(self.read(path), b"x" * 100000)
+            # no splice larger than a pacing chunk
+            assert_equal(max(sizes), 16 * 1024)
+        finally:
+            connection.splice = splice
+            for pool in client._pools():
+                pool.destroy()
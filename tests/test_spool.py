@@ -0,0 +1,159 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import os
+import errno
+import shutil
+import tempfile
+import unittest
+from nose.tools import assert_equal, assert_true, assert_is_none, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.spool import UploadSpool, SpoolError
+from tests.stub_server import StubServer
+
+
+class FlakyClient(object):
+    """
+    fails the first `failures` uploads
+    """
+
+    def __init__(self, client, failures):
+        self.client = client
+        self.failures = failures
+
+    def upload_file_by_buffer(self, *args):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError("connection refused")
+        return self.client.upload_file_by_buffer(*args)
+
+
+class PoisonClient(object):
+    """
+    fails every upload of the content `poison`
+    """
+
+    def __init__(self, client, poison):
+        self.client = client
+        self.poison = poison
+
+    def upload_file_by_buffer(self, content, *args):
+        if content == self.poison:
+            raise IOError("rejected")
+        return self.client.upload_file_by_buffer(content, *args)
+
+
+class FullDiskWriter(object):
+    """
+    writer of a segment whose disk fills up in the middle of the next content written
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, data):
+        if len(data) > 100:
+            self.writer.write(data[:len(data) // 2])
+            self.writer.flush()
+            raise IOError(errno.ENOSPC, "No space left on device")
+        return self.writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address])
+        self.spools = []
+
+    def tearDown(self):
+        for spool in self.spools:
+            spool.close()
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def spool(self, client=None, **kwargs):
+        spool = UploadSpool(client or self.client, self.tmp_dir, **kwargs)
+        self.spools.append(spool)
+        return spool
+
+    def test_write_behind(self):
+        done = []
+        spool = self.spool(segment_size=1, callback=lambda handle, sr, error: done.append((handle, error)))
+        handles = [spool.upload_file_by_buffer(b"content %d" % idx, "txt", meta_data={"idx": "%d" % idx})
+                   for idx in range(5)]
+        assert_true(spool.flush(10))
+        for idx, handle in enumerate(handles):
+            sr = spool.result(handle)
+            assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"content %d" % idx)
+            assert_equal(self.client.get_meta(sr.group_name, sr.filename), {"idx": "%d" % idx})
+        assert_equal(sorted(done), sorted((handle, None) for handle in handles))
+        # every sealed segment is done and removed, only the one being written is left
+        assert_equal(len([name for name in os.listdir(self.tmp_dir) if name.endswith(".log")]), 1)
+
+    def test_restart(self):
+        spool = self.spool(workers=0)
+        handles = [spool.upload_file_by_buffer(content, "txt") for content in (b"first", b"second")]
+        assert_is_none(spool.result(handles[0]))
+        spool.close()
+        # the tail of a record the crash interrupted
+        segment = os.path.join(self.tmp_dir, sorted(os.listdir(self.tmp_dir))[-1])
+        with open(segment, "ab") as f_obj:
+            f_obj.write(b"FSP1 torn")
+        spool = self.spool()
+        assert_equal(spool.pending, 2)
+        sr = spool.result(handles[1], timeout=10)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"second")
+        assert_true(spool.flush(10))
+        assert_equal(self.server.stats["uploads"], 2)
+        spool.close()
+        # the done segment was removed, nothing is uploaded twice
+        spool = self.spool()
+        assert_equal(spool.pending, 0)
+        assert_is_none(spool.result(handles[0]))
+        assert_equal(self.server.stats["uploads"], 2)
+
+    def test_retry(self):
+        spool = self.spool(client=FlakyClient(self.client, 2), retry_delay=0.01)
+        handle = spool.upload_file_by_buffer(b"content", "txt")
+        sr = spool.result(handle, timeout=10)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"content")
+
+    def test_give_up(self):
+        errors = []
+        spool = self.spool(client=FlakyClient(self.client, 5), retry_delay=0.01, max_attempts=2,
+                           callback=lambda handle, sr, error: errors.append(error))
+        handle = spool.upload_file_by_buffer(b"content", "txt")
+        assert_raises(SpoolError, spool.result, handle, 10)
+        assert_equal(len(errors), 1)
+        assert_equal(self.server.stats["uploads"], 0)
+
+    def test_failed_write(self):
+        spool = self.spool(workers=0)
+        first = spool.upload_file_by_buffer(b"first", "txt")
+        spool._writer = FullDiskWriter(spool._writer)
+        assert_raises(IOError, spool.upload_file_by_buffer, b"x" * 1000, "txt")
+        # the next records are not behind torn bytes
+        last = spool.upload_file_by_buffer(b"last", "txt")
+        spool.close()
+        spool = self.spool()
+        assert_equal(spool.pending, 2)
+        for handle, content in ((first, b"first"), (last, b"last")):
+            sr = spool.result(handle, timeout=10)
+            assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), content)
+
+    def test_retry_does_not_block(self):
+        spool = self.spool(client=PoisonClient(self.client, b"poison"), workers=1, batch_size=1, retry_delay=30)
+        poisoned = spool.upload_file_by_buffer(b"poison", "txt")
+        # the worker goes on while the failed record waits for its retry
+        sr = spool.result(spool.upload_file_by_buffer(b"fresh", "txt"), timeout=5)
+        assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"fresh")
+        assert_is_none(spool.result(poisoned))
+        assert_equal(spool.pending, 1)
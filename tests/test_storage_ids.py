@@ -0,0 +1,149 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import base64
+import struct
+import socket
+import unittest
+from nose.tools import assert_equal, assert_true, assert_is_none, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.command import ServerError
+from pyfdfs.storage_ids import StorageIdMap, decode_file_name
+from pyfdfs.structs import StorageIdInfo
+from pyfdfs.enums import FDFS_STORAGE_STATUS_ACTIVE, FDFS_STORAGE_STATUS_OFFLINE, FDFS_ID_TYPE_SERVER_ID
+from tests.stub_server import StubServer
+from tests.test_topology import FakeTracker, make_server
+
+
+def make_file_name(source, timestamp=1500000000, ext="jpg"):
+    """
+    :param source: ip address or numeric server id
+    """
+    if isinstance(source, int):
+        source = struct.pack("<I", source)
+    else:
+        source = socket.inet_aton(source)
+    raw = source + struct.pack("!I Q I", timestamp, 1024, 0)
+    return "M00/00/00/%s.%s" % (base64.b64encode(raw, b"-_")[:27].decode(), ext)
+
+
+class IdTracker(FakeTracker):
+    def __init__(self):
+        FakeTracker.__init__(self)
+        self.ids = ["100001 group1 10.0.0.1", "100002 group1 10.0.0.2", "100003 group2 10.0.0.3"]
+
+    def fetch_storage_ids(self):
+        if not self.ids:
+            raise ServerError(1)
+        id_list = []
+        for line in self.ids:
+            info = StorageIdInfo()
+            info.set_line(line)
+            id_list.append(info)
+        return id_list
+
+
+class TestDecode(unittest.TestCase):
+    def test_ip_address(self):
+        info = decode_file_name("group1/M00/00/00/wKgAUVr0Ku6AQk9BAAAAAAAAAAA123.jpg")
+        assert_equal(info.source_ip, "192.168.0.81")
+        assert_is_none(info.source_id)
+        assert_equal(decode_file_name(make_file_name("10.0.0.1")).timestamp, 1500000000)
+
+    def test_server_id(self):
+        info = decode_file_name(make_file_name(100001))
+        assert_equal((info.id_type, info.source_id, info.file_size), (FDFS_ID_TYPE_SERVER_ID, "100001", 1024))
+
+    def test_storage_byte_order(self):
+        # names as a storage server on a little endian host makes them
+        assert_equal(decode_file_name("group1/M00/00/00/oYYBAFloLwAAAAAAAAAEAAAAAAA.jpg").source_id, "100001")
+        assert_equal(decode_file_name("M00/00/00/wKgAUVloLwAAAAAAAAAEAAAAAAA.jpg").source_ip, "192.168.0.81")
+
+    def test_foreign_name(self):
+        assert_is_none(decode_file_name("M00/00/00/00000001.txt"))
+        assert_is_none(decode_file_name("M00/00/00/wKgAUVr0Ku6AQk9B+AAAAAAAAAA123.jpg"))
+
+    def test_id_line(self):
+        info = StorageIdInfo()
+        info.set_line(b"100001 group1 10.0.0.1,192.168.0.1:23001")
+        assert_equal((info.id, info.group_name, info.ip_addr, info.port), ("100001", "group1", "10.0.0.1", 0))
+        info.set_line("100002 group1 10.0.0.2:23001")
+        assert_equal((info.ip_addr, info.port), ("10.0.0.2", 23001))
+
+
+class TestStorageIdMap(unittest.TestCase):
+    def setUp(self):
+        self.tracker = IdTracker()
+        self.ids = StorageIdMap(self.tracker, refresh_interval=60)
+
+    def test_pick_source(self):
+        assert_is_none(self.ids.pick_source("group1", make_file_name(100001)))
+        self.ids.refresh()
+        assert_equal(self.ids.get("100003").ip_addr, "10.0.0.3")
+        for source in (100001, "10.0.0.1"):
+            si = self.ids.pick_source("group1", make_file_name(source))
+            assert_equal((si.group_name, si.ip_addr, si.storage_port), ("group1", "10.0.0.1", 23000))
+        # offline, unknown, in another group
+        assert_is_none(self.ids.pick_source("group1", make_file_name(100002)))
+        assert_is_none(self.ids.pick_source("group1", make_file_name(100009)))
+        assert_is_none(self.ids.pick_source("group1", make_file_name(100003)))
+
+    def test_ids_disabled(self):
+        self.tracker.ids = []
+        self.ids.refresh()
+        assert_is_none(self.ids.pick_source("group1", make_file_name(100001)))
+        assert_equal(self.ids.pick_source("group1", make_file_name("10.0.0.1")).ip_addr, "10.0.0.1")
+
+
+class TestClientStorageIds(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.client = FdfsClient([self.server.address])
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_fetch_storage_ids(self):
+        assert_raises(ServerError, self.client.tracker.fetch_storage_ids)
+        self.server.storage_ids = ["100001 group1 10.0.0.1", "100002 group1 10.0.0.2", "100003 group2 10.0.0.3"]
+        assert_equal([(info.id, info.group_name, info.ip_addr) for info in self.client.tracker.fetch_storage_ids()],
+                     [("100001", "group1", "10.0.0.1"), ("100002", "group1", "10.0.0.2"),
+                      ("100003", "group2", "10.0.0.3")])
+
+    def test_read_from_source(self):
+        host, port = self.server.server_address
+        tracker = IdTracker()
+        tracker.servers["group1"] = [make_server(host, FDFS_STORAGE_STATUS_ACTIVE, 2048)]
+        tracker.servers["group1"][0].storage_port = port
+        tracker.ids = ["100001 group1 %s" % host]
+        self.client.storage_ids = StorageIdMap(tracker)
+        self.client.storage_ids.refresh()
+        file_name = make_file_name(100001)
+        self.server.files[file_name] = (b"content", b"")
+        assert_equal(self.client.download_to_buffer("group1", file_name), b"content")
+        self.client.delete_file("group1", file_name)
+        # no tracker query, only the download and the delete
+        assert_equal(self.server.stats["requests"], 2)
+        assert_true(file_name not in self.server.files)
+        tracker.servers["group1"][0].status = FDFS_STORAGE_STATUS_OFFLINE
+        assert_is_none(self.client.storage_ids.pick_source("group1", file_name))
+
+    def test_set_meta_on_source(self):
+        host, port = self.server.server_address
+        tracker = IdTracker()
+        tracker.servers["group1"] = [make_server(host, FDFS_STORAGE_STATUS_ACTIVE, 2048)]
+        tracker.servers["group1"][0].storage_port = port
+        tracker.ids = ["100001 group1 %s" % host]
+        self.client.storage_ids = StorageIdMap(tracker)
+        self.client.storage_ids.refresh()
+        file_name = make_file_name(100001)
+        self.server.files[file_name] = (b"content", b"")
+        self.client.set_meta(file_name, {"owner": "alice"}, "group1")
+        self.client.set_meta("group1/%s" % file_name, {"size": "7"}, overwrite=False)
+        # straight to the source server, no tracker query
+        assert_equal(self.server.stats["requests"], 2)
+        assert_equal(self.client.get_meta("group1", file_name), {"owner": "alice", "size": "7"})
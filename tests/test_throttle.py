@@ -0,0 +1,137 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import threading
+import unittest
+from nose.tools import assert_equal, assert_less, assert_greater, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.connection import ConnectionPool
+from pyfdfs import throttle
+from pyfdfs.throttle import TokenBucket, TransferScheduler, priority, PRIORITY_BACKGROUND
+from tests.stub_server import StubServer
+
+
+class FakeClock(object):
+    """
+    stands for the time module in pyfdfs.throttle, sleep() only moves the clock
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_take(self):
+        bucket = TokenBucket(1000, burst=500)
+        assert_equal(bucket.take(500), 0)
+        assert_greater(bucket.take(500), 0.45)
+
+    def test_max_debt(self):
+        bucket = TokenBucket(1000, burst=500)
+        for _ in range(10):
+            bucket.take(1000)
+        assert_less(bucket.take(0), 0.51)
+
+    def test_rate_below_chunk_size(self):
+        clock = FakeClock()
+        throttle.time = clock
+        try:
+            scheduler = TransferScheduler(rate=10000)
+            buckets = scheduler.buckets(("127.0.0.1", 23000))
+            for _ in range(20):
+                scheduler.pace(buckets, scheduler.chunk_size)
+        finally:
+            throttle.time = time
+        # one second of burst, then 10000 bytes per second
+        assert_less(abs(20 * scheduler.chunk_size / clock.now - 10000), 1000)
+        assert_greater(TokenBucket(10000).take(65536), 5.5)
+
+    def test_buckets(self):
+        scheduler = TransferScheduler(rate=100, group_rates={"group1": 10}, endpoint_rate=50)
+        buckets = scheduler.buckets(("127.0.0.1", 23000), "group1")
+        assert_equal([bucket.rate for bucket in buckets], [100, 10, 50])
+        assert_equal(scheduler.buckets(("127.0.0.1", 23000))[1], buckets[2])
+        assert_equal(len(TransferScheduler().buckets(("127.0.0.1", 23000), "group1")), 0)
+
+
+class TestThrottledClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_paced(self):
+        scheduler = TransferScheduler(rate=400 * 1024, chunk_size=16 * 1024)
+        client = FdfsClient([self.server.address], scheduler=scheduler)
+        payload = b"x" * (400 * 1024)
+        start = time.time()
+        client.upload_file_by_buffer(payload, "bin")
+        sr = client.upload_file_by_buffer(payload, "bin")
+        # the first upload spends the burst, the second one waits for the rate
+        assert_greater(time.time() - start, 0.8)
+        assert_equal(self.server.files[sr.filename][0], payload)
+
+    def test_background_paced(self):
+        scheduler = TransferScheduler(rate=400 * 1024, chunk_size=16 * 1024, throttle_interactive=False)
+        client = FdfsClient([self.server.address], scheduler=scheduler)
+        payload = b"x" * (400 * 1024)
+        start = time.time()
+        for _ in range(3):
+            client.upload_file_by_buffer(payload, "bin")
+        assert_less(time.time() - start, 0.3)
+        start = time.time()
+        with priority(PRIORITY_BACKGROUND):
+            sr = client.upload_file_by_buffer(payload, "bin")
+        # behind one burst of interactive debt at most, not three
+        assert_greater(time.time() - start, 0.8)
+        assert_less(time.time() - start, 2.5)
+        assert_equal(self.server.files[sr.filename][0], payload)
+
+
+class TestPoolWaitQueue(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.pool = ConnectionPool(hosts=[self.server.server_address], timeout=5, max_conn=1, wait_timeout=5)
+
+    def tearDown(self):
+        self.pool.destroy()
+        self.server.stop()
+
+    def test_priority_order(self):
+        held = self.pool.get_connection()
+        order = []
+
+        def waiter(name, level):
+            with priority(level):
+                conn = self.pool.get_connection()
+            order.append(name)
+            time.sleep(0.05)
+            self.pool.release(conn)
+
+        threads = [threading.Thread(target=waiter, args=("background", PRIORITY_BACKGROUND))]
+        threads[0].start()
+        time.sleep(0.1)
+        threads.append(threading.Thread(target=waiter, args=("interactive", 0)))
+        threads[1].start()
+        time.sleep(0.1)
+        self.pool.release(held)
+        for thread in threads:
+            thread.join()
+        assert_equal(order, ["interactive", "background"])
+
+    def test_timeout(self):
+        self.pool.wait_timeout = 0.1
+        held = self.pool.get_connection()
+        assert_raises(Exception, self.pool.get_connection)
+        self.pool.release(held)
+        self.pool.release(self.pool.get_connection())
@@ -0,0 +1,116 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import unittest
+from nose.tools import assert_equal, assert_true, assert_is_none, assert_raises
+from pyfdfs.client import FdfsClient
+from pyfdfs.command import ServerError
+from pyfdfs.topology import ClusterTopology
+from pyfdfs.structs import GroupInfo, StorageInfo
+from pyfdfs.enums import FDFS_STORAGE_STATUS_ACTIVE, FDFS_STORAGE_STATUS_OFFLINE
+from tests.stub_server import StubServer
+
+
+def make_group(group_name, free_mb):
+    group = GroupInfo()
+    group.group_name = group_name
+    group.total_mb = 1024 * 1024
+    group.free_mb = free_mb
+    return group
+
+
+def make_server(ip_addr, status, free_mb):
+    server = StorageInfo()
+    server.ip_addr = ip_addr
+    server.status = status
+    server.storage_port = 23000
+    server.current_write_path = 1
+    server.free_mb = free_mb
+    return server
+
+
+class FakeTracker(object):
+    def __init__(self):
+        self.calls = 0
+        self.groups = [make_group("group1", 2048), make_group("group2", 0)]
+        self.servers = {
+            "group1": [make_server("10.0.0.1", FDFS_STORAGE_STATUS_ACTIVE, 2048),
+                       make_server("10.0.0.2", FDFS_STORAGE_STATUS_OFFLINE, 4096)],
+            "group2": [make_server("10.0.0.3", FDFS_STORAGE_STATUS_ACTIVE, 0)],
+        }
+
+    def list_groups(self):
+        self.calls += 1
+        return self.groups
+
+    def list_servers(self, group_name, storage_ip=None):
+        return self.servers[group_name]
+
+
+class TestTopology(unittest.TestCase):
+    def setUp(self):
+        self.tracker = FakeTracker()
+        self.topology = ClusterTopology(self.tracker, refresh_interval=60)
+
+    def test_miss_before_refresh(self):
+        assert_is_none(self.topology.pick_store())
+        assert_is_none(self.topology.pick_fetch("group1"))
+
+    def test_pick_store_skips_full_and_offline(self):
+        self.topology.refresh()
+        for _ in range(20):
+            si = self.topology.pick_store()
+            assert_equal(si.group_name, "group1")
+            assert_equal(si.ip_addr, "10.0.0.1")
+            assert_equal(si.storage_port, 23000)
+            assert_equal(si.current_write_path, 1)
+
+    def test_pick_fetch_by_group(self):
+        self.topology.refresh()
+        assert_equal(self.topology.pick_fetch("group2").ip_addr, "10.0.0.3")
+        assert_is_none(self.topology.pick_fetch("group3"))
+
+    def test_snapshot(self):
+        self.topology.refresh()
+        snapshot = self.topology.snapshot()
+        assert_true(snapshot["refreshed_at"] is not None)
+        servers = snapshot["groups"]["group1"]["servers"]
+        assert_equal([item["status"] for item in servers], ["ACTIVE", "OFFLINE"])
+        assert_equal(servers[1]["free_mb"], 4096)
+
+    def test_stale_snapshot(self):
+        self.topology.refresh()
+        self.topology.refreshed_at -= self.topology.max_age + 1
+        assert_is_none(self.topology.pick_store("group1"))
+
+
+class TestTopologyReads(unittest.TestCase):
+    def setUp(self):
+        # the tracker answers with the source server, the topology also lists a replica not synced yet
+        self.source = StubServer().start()
+        self.replica = StubServer().start()
+        self.client = FdfsClient([self.source.address])
+        tracker = FakeTracker()
+        tracker.servers["group1"] = [make_server("127.0.0.1", FDFS_STORAGE_STATUS_ACTIVE, 2048)
+                                     for _ in range(2)]
+        tracker.servers["group1"][0].storage_port = self.source.server_address[1]
+        tracker.servers["group1"][1].storage_port = self.replica.server_address[1]
+        self.topology = ClusterTopology(tracker, refresh_interval=60)
+        self.topology.refresh()
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.source.stop()
+        self.replica.stop()
+
+    def test_read_before_sync(self):
+        sr = self.client.upload_file_by_buffer(b"fresh", "txt")
+        self.client.topology = self.topology
+        for _ in range(10):
+            assert_equal(self.client.download_to_buffer(sr.group_name, sr.filename), b"fresh")
+            assert_equal(b"".join(self.client.download_stream(sr.group_name, sr.filename)), b"fresh")
+        self.source.files.clear()
+        assert_raises(ServerError, self.client.download_to_buffer, sr.group_name, sr.filename)
@@ -1,5 +1,5 @@
 # coding=utf-8
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
 
 __author__ = 'mazesoul'
 
@@ -22,6 +22,6 @@ class TestTracker(unittest.TestCase):
             fetch_group = self.client.list_one_group(item.group_name)
             assert_equal(str(item), str(fetch_group))
             for storage_server in self.client.list_servers(item.group_name):
-                print storage_server
-            print self.client.query_store_with_group_one(item.group_name)
-        print self.client.query_store_without_group_one()
\ No newline at end of file
+                print(storage_server)
+            print(self.client.query_store_with_group_one(item.group_name))
+        print(self.client.query_store_without_group_one())
\ No newline at end of file
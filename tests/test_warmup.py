@@ -0,0 +1,56 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import time
+import unittest
+from nose.tools import assert_equal, assert_true, assert_false
+from pyfdfs.client import FdfsClient
+from pyfdfs.connection import ConnectionPool, ThreadAffinityConnectionPool
+from tests.stub_server import StubServer
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def wait_connections(self, count):
+        # the stub counts a connection once its handler thread runs
+        for _ in range(100):
+            if self.server.stats["connections"] >= count:
+                break
+            time.sleep(0.01)
+        assert_equal(self.server.stats["connections"], count)
+
+    def test_pool(self):
+        for pool_cls in (ConnectionPool, ThreadAffinityConnectionPool):
+            self.server.stats["connections"] = 0
+            pool = pool_cls(hosts=[self.server.server_address], timeout=5, min_idle=3)
+            assert_false(pool.is_warm())
+            assert_equal(pool.warmup(), 3)
+            assert_equal(pool.warmup(), 0)
+            assert_true(pool.is_warm())
+            pool.release(pool.get_connection())
+            pool.release(pool.get_connection())
+            self.wait_connections(3)
+            pool.destroy()
+
+    def test_client_background(self):
+        client = FdfsClient([self.server.address], min_idle=2, warmup=True, warmup_jitter=0.1,
+                            warmup_storages=True)
+        assert_true(client.ready(timeout=5))
+        self.wait_connections(4)
+        client.upload_file_by_buffer(b"warm", "txt")
+        self.wait_connections(4)
+
+    def test_unreachable(self):
+        port = self.server.server_address[1]
+        self.server.stop()
+        self.server = StubServer().start()
+        client = FdfsClient(["127.0.0.1:%d" % port], min_idle=1, connect_timeout=0.5)
+        assert_false(client.warmup())
+        assert_false(client.ready())
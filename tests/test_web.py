@@ -0,0 +1,173 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = 'mazesoul'
+
+import sys
+import shutil
+import tempfile
+import unittest
+from wsgiref import util as wsgi_util
+from wsgiref.validate import validator
+from nose.tools import assert_equal, assert_raises, assert_is_none, assert_in
+from pyfdfs.cache import DiskCache
+from pyfdfs.client import FdfsClient
+from pyfdfs.web import FdfsWSGIApp, parse_range, RangeNotSatisfiable
+from tests.stub_server import StubServer
+
+CONTENT = b"0123456789" * 10000
+
+
+def call_wsgi(app, path, method="GET", range_header=None):
+    environ = {"REQUEST_METHOD": method, "PATH_INFO": path}
+    if range_header is not None:
+        environ["HTTP_RANGE"] = range_header
+    response = {}
+
+    def start_response(status, headers):
+        response["status"] = status
+        response["headers"] = dict(headers)
+
+    body = app(environ, start_response)
+    try:
+        response["body"] = b"".join(body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return response
+
+
+class TestParseRange(unittest.TestCase):
+    def test_parse_range(self):
+        assert_equal(parse_range("bytes=0-9", 100), (0, 10))
+        assert_equal(parse_range("bytes=90-", 100), (90, 10))
+        assert_equal(parse_range("bytes=90-200", 100), (90, 10))
+        assert_equal(parse_range("bytes=-10", 100), (90, 10))
+        assert_equal(parse_range("bytes=-200", 100), (0, 100))
+        assert_is_none(parse_range(None, 100))
+        assert_is_none(parse_range("bytes=0-1,5-6", 100))
+        assert_is_none(parse_range("bytes=9-5", 100))
+        assert_raises(RangeNotSatisfiable, parse_range, "bytes=100-", 100)
+        assert_raises(RangeNotSatisfiable, parse_range, "bytes=-0", 100)
+
+
+class TestWSGIApp(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.file_name = self.server.add_file(CONTENT, b"", b"txt")
+        self.client = FdfsClient([self.server.address])
+        self.app = FdfsWSGIApp(self.client, chunk_size=4096)
+
+    def tearDown(self):
+        for pool in self.client._pools():
+            pool.destroy()
+        self.server.stop()
+
+    def test_get(self):
+        response = call_wsgi(self.app, "/group1/" + self.file_name)
+        assert_equal(response["status"], "200 OK")
+        assert_equal(response["headers"]["Content-Length"], str(len(CONTENT)))
+        assert_equal(response["headers"]["Content-Type"], "text/plain")
+        assert_equal(response["body"], CONTENT)
+
+    def test_range(self):
+        response = call_wsgi(self.app, "/group1/" + self.file_name, range_header="bytes=10-19")
+        assert_equal(response["status"], "206 Partial Content")
+        assert_equal(response["headers"]["Content-Range"], "bytes 10-19/%d" % len(CONTENT))
+        assert_equal(response["headers"]["Content-Length"], "10")
+        assert_equal(response["body"], CONTENT[10:20])
+        response = call_wsgi(self.app, "/group1/" + self.file_name, range_header="bytes=%d-" % len(CONTENT))
+        assert_equal(response["status"], "416 Requested Range Not Satisfiable")
+        assert_equal(response["headers"]["Content-Range"], "bytes */%d" % len(CONTENT))
+
+    def test_head_and_missing(self):
+        response = call_wsgi(self.app, "/group1/" + self.file_name, method="HEAD")
+        assert_equal(response["headers"]["Content-Length"], str(len(CONTENT)))
+        assert_equal(response["body"], b"")
+        assert_equal(call_wsgi(self.app, "/group1/M00/00/00/missing.txt")["status"], "404 Not Found")
+        assert_equal(call_wsgi(self.app, "/group1")["status"], "404 Not Found")
+        assert_in("405", call_wsgi(self.app, "/group1/" + self.file_name, method="POST")["status"])
+
+    def test_close_early(self):
+        body = self.app({"REQUEST_METHOD": "GET", "PATH_INFO": "/group1/" + self.file_name},
+                        lambda status, headers: None)
+        assert_equal(len(next(iter(body))), 4096)
+        body.close()
+        assert_equal(self.client.download_to_buffer("group1", self.file_name, 0, 5), CONTENT[:5])
+
+    def test_validator(self):
+        # large chunks are read in several recv, into a bytearray
+        file_name = self.server.add_file(b"v" * 300 * 1024, b"", b"bin")
+        app = validator(FdfsWSGIApp(self.client, chunk_size=128 * 1024))
+        for file_wrapper in (None, wsgi_util.FileWrapper):
+            environ = {"PATH_INFO": str("/group1/" + file_name), "SCRIPT_NAME": "", "QUERY_STRING": ""}
+            wsgi_util.setup_testing_defaults(environ)
+            if file_wrapper is None:
+                environ.pop("wsgi.file_wrapper", None)
+            else:
+                environ["wsgi.file_wrapper"] = file_wrapper
+            response = {}
+
+            def start_response(status, headers):
+                response["status"] = status
+            body = app(environ, start_response)
+            try:
+                chunks = list(body)
+            finally:
+                body.close()
+            assert_equal(response["status"], "200 OK")
+            assert_equal([type(chunk) for chunk in chunks], [bytes] * 3)
+            assert_equal(b"".join(chunks), b"v" * 300 * 1024)
+
+    def test_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            client = FdfsClient([self.server.address], cache=DiskCache(tmp_dir))
+            client.download_to_buffer("group1", self.file_name)
+            requests = self.server.stats["requests"]
+            response = call_wsgi(FdfsWSGIApp(client), "/group1/" + self.file_name)
+            assert_equal(response["body"], CONTENT)
+            assert_equal(self.server.stats["requests"], requests)
+            response = call_wsgi(FdfsWSGIApp(client), "/group1/" + self.file_name, range_header="bytes=-5")
+            assert_equal(response["body"], CONTENT[-5:])
+            for pool in client._pools():
+                pool.destroy()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "asgi needs python 3.7+")
+class TestASGIApp(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.file_name = self.server.add_file(CONTENT, b"", b"txt")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_range(self):
+        import asyncio
+        from pyfdfs.asgi import FdfsASGIApp
+        app = FdfsASGIApp(FdfsClient([self.server.address]), chunk_size=128 * 1024)
+        messages = []
+
+        def done(result=None):
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(result)
+            return future
+
+        def receive():
+            return done({"type": "http.request"})
+
+        def send(message):
+            messages.append(message)
+            return done()
+
+        scope = {"type": "http", "method": "GET", "path": "/group1/" + self.file_name,
+                 "headers": [(b"range", b"bytes=100-")]}
+        asyncio.run(app(scope, receive, send))
+        assert_equal(messages[0]["status"], 206)
+        assert_in((b"content-length", str(len(CONTENT) - 100).encode()), messages[0]["headers"])
+        assert_equal(b"".join(message.get("body", b"") for message in messages[1:]), CONTENT[100:])
+        assert_equal(messages[-1]["more_body"], False)
+        assert_equal(set(type(message["body"]) for message in messages[1:]), set([bytes]))